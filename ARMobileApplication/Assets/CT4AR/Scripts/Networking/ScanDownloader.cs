@@ -178,13 +178,19 @@ namespace CT4AR.Networking
             }
 
             // --- Download FBX model ---
+            // The last download's ETag is remembered, so reopening an unchanged
+            // scan costs one 304 instead of the whole model.
             string fileName = $"{scanID}.fbx";
             string localPath = Path.Combine(Application.persistentDataPath, fileName);
+            string tempPath = localPath + ".part";
+            string etagKey = $"CT4AR.fbx.etag.{scanID}";
 
             using (UnityWebRequest request = UnityWebRequest.Get(fbxUrl))
             {
                 _activeRequest = request;
-                request.downloadHandler = new DownloadHandlerFile(localPath) { removeFileOnAbort = true };
+                if (File.Exists(localPath) && PlayerPrefs.HasKey(etagKey))
+                    request.SetRequestHeader("If-None-Match", PlayerPrefs.GetString(etagKey));
+                request.downloadHandler = new DownloadHandlerFile(tempPath) { removeFileOnAbort = true };
 
                 yield return request.SendWebRequest();
 
@@ -203,7 +209,24 @@ namespace CT4AR.Networking
                 }
                 else
                 {
-                    Debug.Log("[CT4AR] FBX download complete: " + localPath);
+                    if (request.responseCode == 304)
+                    {
+                        if (File.Exists(tempPath)) File.Delete(tempPath);
+                        Debug.Log("[CT4AR] FBX unchanged, using cached copy: " + localPath);
+                    }
+                    else
+                    {
+                        if (File.Exists(localPath)) File.Delete(localPath);
+                        File.Move(tempPath, localPath);
+
+                        string etag = request.GetResponseHeader("ETag");
+                        if (!string.IsNullOrEmpty(etag))
+                        {
+                            PlayerPrefs.SetString(etagKey, etag);
+                            PlayerPrefs.Save();
+                        }
+                        Debug.Log("[CT4AR] FBX download complete: " + localPath);
+                    }
                     onDownloadComplete?.Invoke(localPath);
                 }
             }
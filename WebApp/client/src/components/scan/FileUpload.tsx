@@ -109,8 +109,8 @@ export default function FileUpload({ onUploadComplete }: FileUploadProps) {
             <Upload className="w-12 h-12 text-muted-foreground" />
             <p className="text-lg font-medium">Drop your CT scan here</p>
             <p className="text-sm text-muted-foreground">
-              or click to browse &mdash; .nii, .nii.gz, .mhd, .nrrd, .zip, or
-              .fbx
+              or click to browse &mdash; .nii, .nii.gz, .mhd, .nrrd, .zip
+              (also zipped DICOM series), or .fbx
             </p>
             <p className="text-xs text-muted-foreground">
               Max file size: {MAX_SIZE_MB} MB
@@ -74,6 +74,7 @@ function getStepStates(
   switch (status) {
     case "uploaded":
       return ["completed", "pending", "pending", "pending"];
+    case "submitting":
     case "processing":
       return ["completed", "active", "pending", "pending"];
     case "segmented":
@@ -277,7 +278,9 @@ export default function ProcessingTimeline({
         })}
       </div>
 
-      {(status === "processing" || status === "post_processing") && (
+      {(status === "submitting" ||
+        status === "processing" ||
+        status === "post_processing") && (
         <div className="mt-4 h-1.5 rounded-full bg-secondary overflow-hidden">
           <div className="h-full bg-primary/60 rounded-full animate-progress-indeterminate" />
         </div>
@@ -1,5 +1,6 @@
 export type ScanStatus =
   | "uploaded"
+  | "submitting"
   | "processing"
   | "segmented"
   | "post_processing"
@@ -20,6 +21,29 @@ export interface ScanMetadata {
   processing_error?: string;
   organs_processed?: string[];
   fbx_size?: number;
+  ct_header?: CTHeader | null;
+  timeline?: Record<string, TimelineStage>;
+}
+
+/** One pipeline stage of a scan (see the server's services/timeline.py). */
+export interface TimelineStage {
+  started_at: string;
+  finished_at: string;
+  duration: number;
+  bytes?: number;
+  failed?: boolean;
+  [detail: string]: unknown;
+}
+
+export interface CTHeader {
+  format: "nifti" | "mhd" | "nrrd";
+  container: "zip" | null;
+  inner_file?: string;
+  dimensions: [number, number, number];
+  spacing: [number, number, number];
+  origin: [number, number, number];
+  dtype: string;
+  warnings: string[];
 }
 
 export interface UploadResult {
@@ -43,40 +67,102 @@ export async function fetchScan(scanId: string): Promise<ScanMetadata> {
   return res.json();
 }
 
-export function uploadScan(
+export interface ScanProgress {
+  stage: string;
+  message: string;
+}
+
+/** Server-Sent Events stream of a scan's changes (see useScanPolling). */
+export function scanEventsUrl(scanId: string): string {
+  return `${API_BASE}/scans/${scanId}/events`;
+}
+
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+const UPLOAD_MAX_RETRIES = 5;
+
+function encodeUploadMetadata(meta: Record<string, string>): string {
+  return Object.entries(meta)
+    .map(([key, value]) => {
+      const bytes = new TextEncoder().encode(value);
+      let binary = "";
+      bytes.forEach((b) => (binary += String.fromCharCode(b)));
+      return `${key} ${btoa(binary)}`;
+    })
+    .join(",");
+}
+
+async function uploadErrorMessage(res: Response, fallback: string): Promise<string> {
+  const body = await res.json().catch(() => ({ detail: `${fallback} (${res.status})` }));
+  return body.detail || fallback;
+}
+
+async function fetchUploadOffset(uploadUrl: string): Promise<number> {
+  const res = await fetch(uploadUrl, {
+    method: "HEAD",
+    headers: { "Tus-Resumable": "1.0.0" },
+  });
+  if (!res.ok) throw new Error(`Upload expired or not found (${res.status})`);
+  return Number(res.headers.get("Upload-Offset") ?? 0);
+}
+
+/**
+ * Upload a scan through the resumable upload protocol (/uploads).
+ * The file is sent in chunks; if a chunk fails (e.g. the connection drops)
+ * the current offset is re-queried and the upload continues from there.
+ */
+export async function uploadScan(
   file: File,
   onProgress?: (percent: number) => void,
 ): Promise<UploadResult> {
-  return new Promise((resolve, reject) => {
-    const xhr = new XMLHttpRequest();
-    const formData = new FormData();
-    formData.append("file", file);
-
-    xhr.upload.addEventListener("progress", (e) => {
-      if (e.lengthComputable && onProgress) {
-        onProgress(Math.round((e.loaded / e.total) * 100));
-      }
-    });
-
-    xhr.addEventListener("load", () => {
-      if (xhr.status >= 200 && xhr.status < 300) {
-        resolve(JSON.parse(xhr.responseText));
-      } else {
-        try {
-          const err = JSON.parse(xhr.responseText);
-          reject(new Error(err.detail || "Upload failed"));
-        } catch {
-          reject(new Error(`Upload failed (${xhr.status})`));
-        }
-      }
-    });
-
-    xhr.addEventListener("error", () => reject(new Error("Network error")));
-    xhr.addEventListener("abort", () => reject(new Error("Upload cancelled")));
-
-    xhr.open("POST", `${API_BASE}/scans/upload`);
-    xhr.send(formData);
+  const createRes = await fetch(`${API_BASE}/uploads`, {
+    method: "POST",
+    headers: {
+      "Tus-Resumable": "1.0.0",
+      "Upload-Length": String(file.size),
+      "Upload-Metadata": encodeUploadMetadata({ filename: file.name }),
+    },
   });
+  if (!createRes.ok) {
+    throw new Error(await uploadErrorMessage(createRes, "Upload failed"));
+  }
+  const location = createRes.headers.get("Location") ?? "";
+  const uploadUrl = `${API_BASE}/uploads/${location.split("/").pop()}`;
+
+  let offset = 0;
+  let retries = 0;
+  while (true) {
+    const end = Math.min(offset + UPLOAD_CHUNK_SIZE, file.size);
+    let res: Response;
+    try {
+      res = await fetch(uploadUrl, {
+        method: "PATCH",
+        headers: {
+          "Tus-Resumable": "1.0.0",
+          "Upload-Offset": String(offset),
+          "Content-Type": "application/offset+octet-stream",
+        },
+        body: file.slice(offset, end),
+      });
+    } catch {
+      if (++retries > UPLOAD_MAX_RETRIES) throw new Error("Network error");
+      await new Promise((r) => setTimeout(r, 1000 * 2 ** retries));
+      offset = await fetchUploadOffset(uploadUrl);
+      continue;
+    }
+
+    if (res.status === 409) {
+      offset = await fetchUploadOffset(uploadUrl);
+      continue;
+    }
+    if (!res.ok) {
+      throw new Error(await uploadErrorMessage(res, "Upload failed"));
+    }
+
+    retries = 0;
+    offset = Number(res.headers.get("Upload-Offset") ?? end);
+    onProgress?.(Math.round((offset / file.size) * 100));
+    if (res.status === 200) return res.json();
+  }
 }
 
 export async function triggerProcessing(scanId: string): Promise<{ status: string; message: string }> {
@@ -88,7 +174,9 @@ export async function triggerProcessing(scanId: string): Promise<{ status: strin
   return res.json();
 }
 
-export async function triggerPostProcessing(scanId: string): Promise<{ status: string; message: string }> {
+export async function triggerPostProcessing(
+  scanId: string,
+): Promise<{ job_id: string; status: string; message: string; eta_seconds?: number }> {
   const res = await fetch(`${API_BASE}/scans/${scanId}/postprocess`, { method: "POST" });
   if (!res.ok) {
     const body = await res.json().catch(() => ({ detail: `Request failed (${res.status})` }));
@@ -102,8 +190,8 @@ export interface CTInfo {
   dimensions: [number, number, number];
   spacing: [number, number, number];
   origin: [number, number, number];
-  min_value: number;
-  max_value: number;
+  min_value: number | null;
+  max_value: number | null;
   slice_sizes: {
     axial: [number, number];
     sagittal: [number, number];
@@ -1,11 +1,14 @@
 import { useState, useEffect, useCallback, useRef } from "react";
 import {
   fetchScan,
+  scanEventsUrl,
   type ScanMetadata,
+  type ScanProgress,
   type ScanStatus,
 } from "./api";
 
 const ACTIVE_STATUSES: Set<ScanStatus> = new Set([
+  "submitting",
   "processing",
   "segmented",
   "post_processing",
@@ -17,6 +20,11 @@ interface UseScanPollingOpts {
   interval?: number;
 }
 
+/**
+ * Live scan state.  While the scan is being processed the hook listens to
+ * the server's event stream (`/scans/{id}/events`) and only falls back to
+ * polling every `interval` ms while that stream is not connected.
+ */
 export function useScanPolling({
   scanId,
   enabled,
@@ -26,6 +34,8 @@ export function useScanPolling({
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [notFound, setNotFound] = useState(false);
+  const [streaming, setStreaming] = useState(false);
+  const [progress, setProgress] = useState<ScanProgress | null>(null);
 
   const isFetchingRef = useRef(false);
 
@@ -33,6 +43,7 @@ export function useScanPolling({
     setScanData(null);
     setError(null);
     setNotFound(false);
+    setProgress(null);
     setLoading(true);
   }, [scanId]);
 
@@ -68,16 +79,45 @@ export function useScanPolling({
     fetchData();
   }, [enabled, fetchData]);
 
+  const active = scanData != null && ACTIVE_STATUSES.has(scanData.status);
+
   useEffect(() => {
-    if (!enabled || notFound) return;
+    if (!enabled || notFound || !active) return;
+    if (typeof EventSource === "undefined") return;
+
+    const source = new EventSource(scanEventsUrl(scanId));
+    const onScan = (event: MessageEvent) => {
+      setScanData(JSON.parse(event.data) as ScanMetadata);
+      setError(null);
+    };
+    source.addEventListener("snapshot", onScan);
+    source.addEventListener("metadata", onScan);
+    source.addEventListener("progress", (event: MessageEvent) => {
+      setProgress(JSON.parse(event.data) as ScanProgress);
+    });
+    source.onopen = () => setStreaming(true);
+    // EventSource reconnects by itself; poll until it is back.
+    source.onerror = () => setStreaming(false);
 
-    const shouldPoll =
-      scanData != null && ACTIVE_STATUSES.has(scanData.status);
-    if (!shouldPoll) return;
+    return () => {
+      source.close();
+      setStreaming(false);
+    };
+  }, [enabled, notFound, active, scanId]);
+
+  useEffect(() => {
+    if (!enabled || notFound || !active || streaming) return;
 
     const id = setInterval(fetchData, interval);
     return () => clearInterval(id);
-  }, [enabled, scanData?.status, notFound, fetchData, interval]);
+  }, [enabled, active, streaming, notFound, fetchData, interval]);
 
-  return { scanData, loading, error, notFound, refetch: fetchData };
+  return {
+    scanData,
+    progress,
+    loading,
+    error,
+    notFound,
+    refetch: fetchData,
+  };
 }
@@ -1,14 +1,33 @@
 """FastAPI application factory."""
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import CORS_ORIGINS
 from app.routes import all_routers
+from app.routes.uploads import upload_sweeper
+from app.services.jobs import job_queue
+from app.services.reconciler import reconciler
+from app.services.runpod import close_client
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    # Resume persisted post-processing jobs
+    await job_queue.start()
+    reconciler.start()
+    upload_sweeper.start()
+    yield
+    await upload_sweeper.stop()
+    await reconciler.stop()
+    await job_queue.stop()
+    await close_client()
 
 
 def create_app() -> FastAPI:
-    application = FastAPI(title="AR4CT API", version="1.0.0")
+    application = FastAPI(title="AR4CT API", version="1.0.0", lifespan=lifespan)
 
     application.add_middleware(
         CORSMiddleware,
@@ -16,6 +35,10 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[
+            "Location", "Upload-Offset", "Upload-Length", "Upload-Expires", "Tus-Resumable",
+            "ETag", "Accept-Ranges", "Content-Range", "Content-Disposition",
+        ],
     )
 
     @application.get("/")
@@ -7,12 +7,52 @@ from pathlib import Path
 DATA_DIR = Path(__file__).parent.parent / "data" / "scans"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+# Partial (resumable) uploads live next to the scans, on the same filesystem,
+# so a finished upload can be moved into its scan directory with a rename.
+UPLOADS_DIR = DATA_DIR.parent / "uploads"
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Post-processing jobs (one JSON file each) survive restarts
+JOBS_DIR = DATA_DIR.parent / "jobs"
+JOBS_DIR.mkdir(parents=True, exist_ok=True)
+
 ASSETS_DIR = Path(__file__).parent.parent / "assets"
 TOOL_IMAGE_PATH = ASSETS_DIR / "tool_image.png"
 
 # Limits
 MAX_FILE_SIZE = 500 * 1024 * 1024
 MAX_STL_SIZE = 100 * 1024 * 1024
+MAX_STL_BUNDLE_SIZE = 4 * 1024 * 1024 * 1024  # one archive with all organ STLs
+
+# Upload / metadata disk I/O runs on a small bounded thread pool so slow
+# writes never block the event loop.  Incoming data is buffered into
+# UPLOAD_CHUNK_SIZE blocks before each write.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+IO_WORKERS = int(os.environ.get("IO_WORKERS", 4))
+
+# Seconds an unfinished resumable upload is kept after its last write (tus
+# "expiration"); stale uploads are removed every UPLOAD_SWEEP_INTERVAL
+UPLOAD_EXPIRY = int(os.environ.get("UPLOAD_EXPIRY", 24 * 3600))
+UPLOAD_SWEEP_INTERVAL = int(os.environ.get("UPLOAD_SWEEP_INTERVAL", 3600))
+
+# Canonical CT handed to the segmentation worker (int16 .nii.gz).  A low
+# gzip level keeps ingest fast; the worker never re-encodes the file.
+CANONICAL_GZIP_LEVEL = int(os.environ.get("CANONICAL_GZIP_LEVEL", 1))
+
+# Precompressed download sidecars (.gz / .br) written once per artefact
+SIDECAR_GZIP_LEVEL = int(os.environ.get("SIDECAR_GZIP_LEVEL", 9))
+SIDECAR_BROTLI_QUALITY = int(os.environ.get("SIDECAR_BROTLI_QUALITY", 9))
+
+# Post-processing jobs run at the same time (each one is a Blender process)
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", 1))
+# Canonical CT ingest jobs run at the same time – own workers and threads,
+# apart from Blender jobs and the upload I/O pool
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 1))
+# Seconds finished jobs stay queryable via /jobs/{id}
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 7 * 24 * 3600))
+
+# Worker processes used to decode DICOM slice pixel data
+DICOM_DECODE_WORKERS = int(os.environ.get("DICOM_DECODE_WORKERS", os.cpu_count() or 1))
 
 # CORS origins
 CORS_ORIGINS = [
@@ -31,6 +71,12 @@ API_BASE_URL = os.environ.get("API_BASE_URL", "https://api.ar4ct.com")
 # RunPod configuration
 RUNPOD_API_KEY = os.environ.get("RUNPOD_API_KEY", "")
 RUNPOD_ENDPOINT_ID = os.environ.get("RUNPOD_ENDPOINT_ID", "")
+# Point at a local stand-in (totalsegmentator/fake_runpod.py) for load tests
+RUNPOD_BASE_URL = os.environ.get("RUNPOD_BASE_URL", "https://api.runpod.ai/v2").rstrip("/")
+# Retries (with exponential backoff) for failed RunPod API calls
+RUNPOD_MAX_RETRIES = int(os.environ.get("RUNPOD_MAX_RETRIES", 4))
+# Seconds between checks of in-flight segmentation jobs (0 disables)
+RUNPOD_RECONCILE_INTERVAL = int(os.environ.get("RUNPOD_RECONCILE_INTERVAL", 60))
 
 # Default organs to segment – all 117 TotalSegmentator v2 "total" classes + body surface
 DEFAULT_ORGANS = [
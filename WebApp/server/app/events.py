@@ -0,0 +1,86 @@
+"""In-process event bus – pushes scan changes to connected clients.
+
+``storage.save_metadata`` publishes every metadata write, and the
+post-processing pipeline publishes progress steps.  Subscribers (the SSE
+route) each get a bounded asyncio queue on their own event loop;
+publishing is thread-safe because metadata is usually written on the
+I/O executor.
+
+Events only exist in memory: a client that connects late gets the current
+metadata as a snapshot first, then live events.  With several server
+processes each one only sees its own writes.
+"""
+
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+# Events buffered per subscriber before the oldest are dropped
+QUEUE_SIZE = 64
+
+
+class Subscription:
+    """One client's view of the events of a scan."""
+
+    def __init__(self, scan_id: str):
+        self.scan_id = scan_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[tuple[str, Any]] = asyncio.Queue(QUEUE_SIZE)
+
+    def _put(self, event: tuple[str, Any]):
+        if self.queue.full():
+            # A stalled client loses the oldest events rather than
+            # holding memory; metadata events carry the full state anyway.
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    def deliver(self, event: tuple[str, Any]):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:  # loop closed
+            pass
+
+    async def get(self) -> tuple[str, Any]:
+        return await self.queue.get()
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, set[Subscription]] = {}
+
+    @contextmanager
+    def subscribe(self, scan_id: str) -> Iterator[Subscription]:
+        """Receive events for *scan_id* while the ``with`` block runs."""
+        subscription = Subscription(scan_id)
+        with self._lock:
+            self._subscribers.setdefault(scan_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(scan_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[scan_id]
+
+    def has_subscribers(self, scan_id: str) -> bool:
+        return scan_id in self._subscribers
+
+    def publish(self, scan_id: str, event: str, data: Any):
+        """Send ``(event, data)`` to every subscriber of *scan_id*.  Thread-safe."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(scan_id, ()))
+        for subscription in subscribers:
+            subscription.deliver((event, data))
+
+    def publish_metadata(self, scan_id: str, metadata: dict):
+        """Publish a metadata write (copied – callers keep mutating theirs)."""
+        if self.has_subscribers(scan_id):
+            self.publish(scan_id, "metadata", json.loads(json.dumps(metadata)))
+
+
+bus = EventBus()
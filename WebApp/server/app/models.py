@@ -30,3 +30,9 @@ class BundleResponse(BaseModel):
     fbx_url: Optional[str] = None
     point: Optional[dict] = None
     metadata: dict
+
+
+class SegmentationComplete(BaseModel):
+    organs_processed: list[str] = []
+    organs_failed: list[str] = []
+    timeline: Optional[dict] = None  # worker stages, see services.timeline
@@ -7,6 +7,9 @@ from app.routes.qr import router as qr_router
 from app.routes.bundle import router as bundle_router
 from app.routes.processing import router as processing_router
 from app.routes.ct_viewer import router as ct_viewer_router
+from app.routes.uploads import router as uploads_router
+from app.routes.events import router as events_router
+from app.routes.jobs import router as jobs_router
 
 all_routers = [
     scans_router,
@@ -16,4 +19,7 @@ all_routers = [
     bundle_router,
     processing_router,
     ct_viewer_router,
+    uploads_router,
+    events_router,
+    jobs_router,
 ]
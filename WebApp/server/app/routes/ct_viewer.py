@@ -13,18 +13,14 @@ subsequent slice requests are fast.
 """
 
 import io
-import zlib
-import zipfile
-import tempfile
 import logging
-from pathlib import Path
-from typing import Optional
 
 import numpy as np
 from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import Response
 
-from app.storage import get_scan_dir, scan_exists
+from app.storage import load_metadata, scan_exists
+from app.services.ct_volume import load_ct_volume
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/scans", tags=["ct_viewer"])
@@ -37,159 +33,11 @@ _volume_cache: dict[str, dict] = {}
 _MAX_CACHE = 2
 
 
-# ---------------------------------------------------------------------------
-# Loaders
-# ---------------------------------------------------------------------------
-
-_MHD_DTYPE_MAP = {
-    "MET_SHORT": np.int16,
-    "MET_USHORT": np.uint16,
-    "MET_INT": np.int32,
-    "MET_UINT": np.uint32,
-    "MET_FLOAT": np.float32,
-    "MET_DOUBLE": np.float64,
-    "MET_UCHAR": np.uint8,
-    "MET_CHAR": np.int8,
-}
-
-
-def _load_mhd(mhd_path: Path) -> tuple[np.ndarray, tuple, tuple]:
-    """Load a MetaImage (.mhd + .raw/.zraw) file pair."""
-    meta: dict[str, str] = {}
-    with open(mhd_path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if "=" in line:
-                key, value = line.split("=", 1)
-                meta[key.strip()] = value.strip()
-
-    dims = tuple(int(x) for x in meta["DimSize"].split())
-    spacing = tuple(float(x) for x in meta.get("ElementSpacing", "1 1 1").split())
-    origin = tuple(float(x) for x in meta.get("Offset", "0 0 0").split())
-    dtype = _MHD_DTYPE_MAP.get(meta.get("ElementType", "MET_SHORT"), np.int16)
-
-    data_file = meta.get("ElementDataFile", "")
-    data_path = mhd_path.parent / data_file
-    if not data_path.exists():
-        raise FileNotFoundError(f"Raw data file not found: {data_path}")
-
-    logger.info("Reading raw data from %s …", data_path.name)
-    with open(data_path, "rb") as f:
-        raw_bytes = f.read()
-
-    compressed = meta.get("CompressedData", "False").lower() in ("true", "1", "yes")
-    if compressed:
-        logger.info("Decompressing zlib data (%d bytes compressed) …", len(raw_bytes))
-        raw_bytes = zlib.decompress(raw_bytes)
-
-    total_voxels = dims[0] * dims[1] * dims[2]
-    expected = total_voxels * np.dtype(dtype).itemsize
-    if len(raw_bytes) < expected:
-        raise ValueError(
-            f"Data file too small: got {len(raw_bytes)} bytes, expected {expected}"
-        )
-
-    volume = np.frombuffer(raw_bytes, dtype=dtype, count=total_voxels)
-    # MHD stores x-fastest (column-major). In C-order that is (z, y, x).
-    volume = volume.reshape((dims[2], dims[1], dims[0]))
-    volume = np.transpose(volume, (2, 1, 0))  # → (x, y, z)
-
-    return volume, spacing, origin
-
-
-def _load_nifti(nii_path: Path) -> tuple[np.ndarray, tuple, tuple]:
-    """Load a NIfTI (`.nii` or `.nii.gz`) file."""
-    import nibabel as nib
-
-    img = nib.load(str(nii_path))
-    data = np.asarray(img.dataobj)
-    # Keep a reasonable dtype
-    if data.dtype == np.float64:
-        data = data.astype(np.float32)
-    spacing = tuple(float(s) for s in img.header.get_zooms()[:3])
-    origin = tuple(float(o) for o in img.affine[:3, 3])
-    return data, spacing, origin
-
-
 # ---------------------------------------------------------------------------
 # Volume loading & caching
 # ---------------------------------------------------------------------------
 
 
-def _find_and_load(scan_id: str) -> dict:
-    """Locate the CT file for *scan_id*, load and return volume+meta dict."""
-    scan_dir = get_scan_dir(scan_id)
-    ct_files = list(scan_dir.glob("ct_original_*"))
-    if not ct_files:
-        raise HTTPException(status_code=404, detail="No CT file found for this scan")
-
-    ct_path = ct_files[0]
-    temp_dir: Optional[tempfile.TemporaryDirectory] = None
-
-    try:
-        load_path = ct_path
-
-        # ── Handle ZIP archives ──────────────────────────────────
-        if ct_path.suffix.lower() == ".zip":
-            temp_dir = tempfile.TemporaryDirectory()
-            logger.info("Extracting ZIP %s …", ct_path.name)
-            with zipfile.ZipFile(ct_path, "r") as z:
-                z.extractall(temp_dir.name)
-
-            candidates = [
-                f
-                for f in Path(temp_dir.name).rglob("*")
-                if f.suffix.lower() in (".nii", ".gz", ".mhd", ".nrrd")
-            ]
-            if not candidates:
-                raise HTTPException(
-                    status_code=422,
-                    detail="No supported image file (.nii, .mhd, .nrrd) in ZIP",
-                )
-            mhds = [f for f in candidates if f.suffix.lower() == ".mhd"]
-            niftis = [f for f in candidates if ".nii" in f.name.lower()]
-            load_path = (mhds or niftis or candidates)[0]
-
-        # ── Dispatch by extension ────────────────────────────────
-        ext = load_path.suffix.lower()
-        name_lower = load_path.name.lower()
-
-        if ext == ".mhd":
-            volume, spacing, origin = _load_mhd(load_path)
-        elif ".nii" in name_lower:
-            volume, spacing, origin = _load_nifti(load_path)
-        else:
-            # Last resort: try SimpleITK if installed
-            try:
-                import SimpleITK as sitk
-
-                reader = sitk.ImageFileReader()
-                reader.SetFileName(str(load_path))
-                img = reader.Execute()
-                spacing = img.GetSpacing()
-                origin = img.GetOrigin()
-                arr = sitk.GetArrayFromImage(img)
-                del img
-                volume = np.transpose(arr, (2, 1, 0))
-            except ImportError:
-                raise HTTPException(
-                    status_code=422,
-                    detail=f"Unsupported format '{ext}'. Supported: .mhd, .nii, .nii.gz, .zip",
-                )
-
-        return {
-            "volume": volume,
-            "spacing": tuple(float(s) for s in spacing),
-            "origin": tuple(float(o) for o in origin),
-            "dimensions": (int(volume.shape[0]), int(volume.shape[1]), int(volume.shape[2])),
-            "min_value": float(np.nanmin(volume)),
-            "max_value": float(np.nanmax(volume)),
-        }
-    finally:
-        if temp_dir:
-            temp_dir.cleanup()
-
-
 def _get_volume(scan_id: str) -> dict:
     """Return cached volume or load + cache it."""
     if scan_id in _volume_cache:
@@ -199,7 +47,7 @@ def _get_volume(scan_id: str) -> dict:
         raise HTTPException(status_code=404, detail="Scan not found")
 
     try:
-        vol = _find_and_load(scan_id)
+        vol = load_ct_volume(scan_id)
     except HTTPException:
         raise
     except Exception as exc:
@@ -276,8 +124,26 @@ def _render_slice_jpeg(
 
 @router.get("/{scan_id}/ct/info")
 async def ct_info(scan_id: str):
-    """Return CT volume metadata for the viewer."""
-    vol = _get_volume(scan_id)
+    """
+    Return CT volume metadata for the viewer.
+
+    If the volume is not cached yet, the geometry sniffed at upload time
+    (``ct_header`` in the metadata) is returned without loading the file;
+    ``min_value`` / ``max_value`` are then ``null``.
+    """
+    vol = _volume_cache.get(scan_id)
+    if vol is None:
+        header = (load_metadata(scan_id) or {}).get("ct_header") if scan_exists(scan_id) else None
+        if header and len(header.get("dimensions", [])) == 3:
+            vol = {
+                "dimensions": tuple(header["dimensions"]),
+                "spacing": tuple(header["spacing"]),
+                "origin": tuple(header["origin"]),
+                "min_value": None,
+                "max_value": None,
+            }
+        else:
+            vol = _get_volume(scan_id)
     d = vol["dimensions"]
     return {
         "scan_id": scan_id,
@@ -0,0 +1,87 @@
+"""Live scan updates – Server-Sent Events instead of polling."""
+
+import asyncio
+import json
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.events import bus
+from app.storage import get_fbx_path, load_metadata, run_io, scan_exists
+
+router = APIRouter(prefix="/scans", tags=["events"])
+
+# Comment line sent on idle connections so proxies keep them open
+KEEPALIVE_INTERVAL = 15
+# Client reconnect delay (ms) announced to EventSource
+RETRY_MS = 5000
+
+
+def _sse(event: str, data, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _changes(previous: dict, current: dict) -> list[tuple[str, dict]]:
+    """Fine-grained events implied by a metadata write."""
+    changes = []
+    if current.get("status") != previous.get("status"):
+        changes.append(("status", {
+            "status": current.get("status"),
+            "previous": previous.get("status"),
+            "error": current.get("processing_error"),
+        }))
+    old_stls = previous.get("stl_files") or {}
+    for organ, info in (current.get("stl_files") or {}).items():
+        if organ not in old_stls or old_stls[organ] != info:
+            changes.append(("stl", {"organ": organ, **info}))
+    return changes
+
+
+@router.get("/{scan_id}/events")
+async def scan_events(scan_id: str):
+    """
+    Stream the changes of a scan as Server-Sent Events.
+
+    The stream opens with a ``snapshot`` event (the same document as
+    ``GET /scans/{id}``), then sends ``metadata`` with the full document
+    after every write, plus ``status`` on transitions, ``stl`` per organ
+    mesh that arrives and ``progress`` during post-processing.
+    """
+    if not scan_exists(scan_id):
+        raise HTTPException(status_code=404, detail="Scan not found")
+
+    async def stream():
+        # Subscribe before reading the snapshot so no write falls in between
+        with bus.subscribe(scan_id) as subscription:
+            metadata = await run_io(load_metadata, scan_id) or {}
+            metadata["has_fbx"] = await run_io(get_fbx_path, scan_id) is not None
+            event_id = 0
+            yield f"retry: {RETRY_MS}\n"
+            yield _sse("snapshot", metadata, event_id)
+
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(subscription.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event == "metadata":
+                    changes = _changes(metadata, data)
+                    metadata = data
+                    changes.append(("metadata", data))
+                else:
+                    changes = [(event, data)]
+                for name, payload in changes:
+                    event_id += 1
+                    yield _sse(name, payload, event_id)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # nginx must not buffer the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
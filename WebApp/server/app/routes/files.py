@@ -1,28 +1,64 @@
 """File upload / download routes – FBX, CT scan, STL."""
 
+import hashlib
 import os
+import time
+import uuid
 from datetime import datetime
+from pathlib import Path
+from typing import Optional
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
 
-from app.config import MAX_FILE_SIZE, MAX_STL_SIZE
+from app.config import MAX_FILE_SIZE, MAX_STL_SIZE, UPLOAD_CHUNK_SIZE
 from app.storage import (
+    AsyncFileWriter,
     get_scan_dir,
     load_metadata,
-    save_metadata,
+    metadata_lock,
+    run_io,
+    save_metadata_async,
     scan_exists,
     get_fbx_path,
     get_usdz_path,
 )
+from app.services.canonical import get_canonical_path, remove_canonical
+from app.services.downloads import file_download
+from app.services import timeline
+from app.services.ingest import schedule_ingest
+from app.services.jobs import job_queue
+from app.services.meshes import (
+    MeshError,
+    compat_stl,
+    find_mesh,
+    mesh_files,
+    mesh_format,
+    remove_other_formats,
+    triangle_count,
+    validate_ply,
+)
+from app.services.precompress import write_sidecars, write_sidecars_many
+from app.services.sniff import CTHeaderSniffer, UnsupportedUpload
+from app.services.stl_archive import iter_zip
+from app.services.stl_bundle import BundleError, StlBundleReceiver, commit_bundle, safe_organ_name
 
 router = APIRouter(prefix="/scans", tags=["files"])
 
 
+async def _remove_quietly(path: Path):
+    """Delete a partially written upload, ignoring a missing file."""
+    try:
+        await run_io(os.remove, path)
+    except FileNotFoundError:
+        pass
+
+
 # ── FBX ──────────────────────────────────────────────────────────────────
 
 @router.get("/{scan_id}/fbx")
-async def download_fbx(scan_id: str):
+async def download_fbx(scan_id: str, request: Request):
     """Download the FBX model file for a scan."""
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
@@ -34,15 +70,16 @@ async def download_fbx(scan_id: str):
             detail="FBX file not found. Scan may not be processed yet.",
         )
 
-    return FileResponse(
-        path=fbx_path,
+    return await file_download(
+        request,
+        fbx_path,
         filename=f"{scan_id}.fbx",
         media_type="application/octet-stream",
     )
 
 
 @router.get("/{scan_id}/usdz")
-async def download_usdz(scan_id: str):
+async def download_usdz(scan_id: str, request: Request):
     """Download the USDZ model file for a scan."""
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
@@ -54,8 +91,9 @@ async def download_usdz(scan_id: str):
             detail="USDZ file not found. Scan may not be processed yet.",
         )
 
-    return FileResponse(
-        path=usdz_path,
+    return await file_download(
+        request,
+        usdz_path,
         filename=f"{scan_id}.usdz",
         media_type="model/vnd.usdz+zip",
     )
@@ -72,47 +110,57 @@ async def upload_ct_for_scan(scan_id: str, file: UploadFile = File(...)):
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
 
+    started = time.time()
     original_filename = file.filename or "ct_scan"
     scan_dir = get_scan_dir(scan_id)
     ct_path = scan_dir / f"ct_original_{original_filename}"
 
+    sniffer = CTHeaderSniffer(original_filename)
+    await run_io(remove_canonical, scan_id)
+
     total_size = 0
     try:
-        with open(ct_path, "wb") as buffer:
-            while chunk := await file.read(1024 * 1024):
+        async with AsyncFileWriter(ct_path) as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
                 total_size += len(chunk)
                 if total_size > MAX_FILE_SIZE:
-                    buffer.close()
-                    if ct_path.exists():
-                        os.remove(ct_path)
                     raise HTTPException(
                         status_code=413,
                         detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024**2):.0f} MB",
                     )
-                buffer.write(chunk)
+                sniffer.feed(chunk)
+                await buffer.write(chunk)
+        ct_header = await run_io(sniffer.finish, ct_path)
+    except UnsupportedUpload as e:
+        await _remove_quietly(ct_path)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except HTTPException:
+        await _remove_quietly(ct_path)
         raise
     except Exception as e:
-        if ct_path.exists():
-            os.remove(ct_path)
+        await _remove_quietly(ct_path)
         raise HTTPException(status_code=500, detail=f"Failed to save CT: {str(e)}")
 
     metadata = load_metadata(scan_id)
     metadata["ct_filename"] = original_filename
     metadata["ct_size"] = total_size
+    metadata["ct_header"] = ct_header
     metadata["ct_uploaded_at"] = datetime.utcnow().isoformat() + "Z"
-    save_metadata(scan_id, metadata)
+    timeline.record(metadata, "upload", started, nbytes=total_size)
+    await save_metadata_async(scan_id, metadata)
+    ingest_job = await schedule_ingest(scan_id)
 
     return {
         "scan_id": scan_id,
         "message": "CT scan uploaded successfully",
         "filename": original_filename,
         "size": total_size,
+        "ingest_job_id": ingest_job["job_id"],
     }
 
 
 @router.get("/{scan_id}/ct")
-async def download_ct(scan_id: str):
+async def download_ct(scan_id: str, request: Request):
     """Download the raw CT scan file for a scan."""
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
@@ -126,18 +174,55 @@ async def download_ct(scan_id: str):
     ct_path = ct_files[0]
     original_filename = ct_path.name.replace("ct_original_", "")
 
-    return FileResponse(
-        path=ct_path,
+    return await file_download(
+        request,
+        ct_path,
         filename=original_filename,
         media_type="application/octet-stream",
     )
 
 
+@router.get("/{scan_id}/ct/canonical")
+async def download_ct_canonical(scan_id: str, request: Request):
+    """
+    Download the canonical CT (int16 NIfTI, fast gzip) built at ingest.
+    This is what the segmentation worker fetches.
+    """
+    if not scan_exists(scan_id):
+        raise HTTPException(status_code=404, detail="Scan not found")
+
+    canonical_path = get_canonical_path(scan_id)
+    if not canonical_path:
+        raise HTTPException(status_code=404, detail="Canonical CT not available")
+
+    return await file_download(
+        request,
+        canonical_path,
+        filename=f"{scan_id}.nii.gz",
+        media_type="application/octet-stream",
+    )
+
+
 # ── STL (organ segmentation) ────────────────────────────────────────────
 
 @router.post("/{scan_id}/stl/{organ}")
-async def upload_stl(scan_id: str, organ: str, file: UploadFile = File(...)):
-    """Upload an STL file for a specific organ segmentation."""
+async def upload_stl(
+    scan_id: str,
+    organ: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Upload the mesh of a specific organ: binary STL, or indexed binary PLY
+    when the file name ends in ``.ply`` (stored as ``<organ>.ply``; it
+    replaces an STL of the organ and vice versa).
+
+    The mesh is staged and renamed into place, so a failed upload never
+    replaces a good one.  A retry carrying the ``Idempotency-Key`` of an
+    upload that already succeeded is answered from the stored entry without
+    writing the file or queueing its preparation again.
+    """
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
 
@@ -148,83 +233,232 @@ async def upload_stl(scan_id: str, organ: str, file: UploadFile = File(...)):
     scan_dir = get_scan_dir(scan_id)
     stl_dir = scan_dir / "stl"
     stl_dir.mkdir(exist_ok=True)
-    stl_path = stl_dir / f"{safe_organ}.stl"
+    fmt = mesh_format(file.filename)
+    stl_path = stl_dir / f"{safe_organ}.{fmt}"
+
+    def response(entry: dict, replayed: bool = False) -> dict:
+        return {
+            "scan_id": scan_id,
+            "organ": safe_organ,
+            "size": entry["size"],
+            "sha256": entry.get("sha256"),
+            "format": entry.get("format", "stl"),
+            "replayed": replayed,
+            "message": "STL uploaded successfully",
+        }
+
+    def previous_upload(metadata: dict) -> Optional[dict]:
+        entry = (metadata.get("stl_files") or {}).get(safe_organ)
+        if idempotency_key and entry and entry.get("idempotency_key") == idempotency_key and stl_path.exists():
+            return entry
+        return None
+
+    entry = previous_upload(await run_io(load_metadata, scan_id))
+    if entry:
+        return response(entry, replayed=True)
 
+    part_path = stl_dir / f".{safe_organ}-{uuid.uuid4().hex}.part"
+    hasher = hashlib.sha256()
     total_size = 0
     try:
-        with open(stl_path, "wb") as buffer:
-            while chunk := await file.read(1024 * 1024):
+        async with AsyncFileWriter(part_path, hasher=hasher) as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
                 total_size += len(chunk)
                 if total_size > MAX_STL_SIZE:
-                    buffer.close()
-                    if stl_path.exists():
-                        os.remove(stl_path)
                     raise HTTPException(status_code=413, detail="STL file too large")
-                buffer.write(chunk)
+                await buffer.write(chunk)
     except HTTPException:
+        await _remove_quietly(part_path)
         raise
     except Exception as e:
-        if stl_path.exists():
-            os.remove(stl_path)
+        await _remove_quietly(part_path)
         raise HTTPException(status_code=500, detail=f"Failed to save STL: {str(e)}")
 
-    metadata = load_metadata(scan_id)
-    if "stl_files" not in metadata:
-        metadata["stl_files"] = {}
-    metadata["stl_files"][safe_organ] = {
-        "size": total_size,
-        "uploaded_at": datetime.utcnow().isoformat() + "Z",
-    }
-    metadata["status"] = "segmented"
-    save_metadata(scan_id, metadata)
+    if fmt == "ply":
+        try:
+            await run_io(validate_ply, part_path)
+        except MeshError as e:
+            await _remove_quietly(part_path)
+            raise HTTPException(status_code=400, detail=f"Invalid PLY: {e}")
+
+    async with metadata_lock(scan_id):
+        metadata = await run_io(load_metadata, scan_id)
+        entry = previous_upload(metadata)
+        if entry:  # a concurrent retry of the same upload won
+            await _remove_quietly(part_path)
+            return response(entry, replayed=True)
+
+        await run_io(os.replace, part_path, stl_path)
+        await run_io(remove_other_formats, stl_dir, safe_organ, stl_path)
+        entry = {
+            "size": total_size,
+            "sha256": hasher.hexdigest(),
+            "format": fmt,
+            "uploaded_at": datetime.utcnow().isoformat() + "Z",
+        }
+        if idempotency_key:
+            entry["idempotency_key"] = idempotency_key
+        # The status is left alone: "segmented" means all meshes are in,
+        # which only the worker's completion callback knows
+        metadata.setdefault("stl_files", {})[safe_organ] = entry
+        await save_metadata_async(scan_id, metadata)
+
+    background_tasks.add_task(write_sidecars, stl_path)
+    # Prepare this organ for the FBX assembly while the others arrive
+    await job_queue.submit(scan_id, kind="prepare")
+
+    return response(entry)
+
+
+@router.post("/{scan_id}/stl")
+async def upload_stl_bundle(scan_id: str, request: Request, background_tasks: BackgroundTasks):
+    """
+    Upload many organ meshes at once as a streamed tar / tar.gz / zip body.
+
+    Members named ``<organ>.stl`` or ``<organ>.ply`` are stored as that
+    organ (PLY is validated as for single uploads); an optional
+    ``manifest.json`` maps files to organs and carries sizes / SHA-256
+    checksums.  All meshes and their ``stl_files`` metadata are committed
+    together – a failed archive leaves the scan untouched.
+
+    For clients replacing meshes; like per-organ uploads it queues a
+    prepare job but never completes the segmentation – the worker uploads
+    per organ and finishes with the completion callback.
+    """
+    if not scan_exists(scan_id):
+        raise HTTPException(status_code=404, detail="Scan not found")
+
+    started = time.time()
+    receiver = await run_io(StlBundleReceiver, scan_id)
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await receiver.feed(chunk)
+        await receiver.finish()
+        # Per-organ uploads and prepare jobs update the same metadata
+        async with metadata_lock(scan_id):
+            stl_files = await run_io(
+                commit_bundle, scan_id, receiver.staged, receiver.manifest, started, receiver.received
+            )
+    except BundleError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ClientDisconnect:
+        raise HTTPException(status_code=400, detail="Client disconnected during upload")
+    finally:
+        await receiver.cleanup()
+
+    stl_dir = get_scan_dir(scan_id) / "stl"
+    background_tasks.add_task(write_sidecars_many, [stl_dir / f"{organ}.{info['format']}" for organ, info in stl_files.items()])
+
+    await job_queue.submit(scan_id, kind="prepare")
 
     return {
         "scan_id": scan_id,
-        "organ": safe_organ,
-        "size": total_size,
-        "message": "STL uploaded successfully",
+        "stl_files": stl_files,
+        "count": len(stl_files),
+        "size": receiver.received,
+        "message": f"{len(stl_files)} STL files uploaded successfully",
     }
 
 
+_MESH_MEDIA_TYPES = {".stl": "model/stl", ".ply": "application/ply"}
+_DOWNLOAD_FORMATS = "^(stl|native)$"
+
+
 @router.get("/{scan_id}/stl/{organ}")
-async def download_stl(scan_id: str, organ: str):
-    """Download an STL file for a specific organ."""
+async def download_stl(
+    scan_id: str,
+    organ: str,
+    request: Request,
+    format: str = Query("stl", pattern=_DOWNLOAD_FORMATS,
+                        description="stl (converted from PLY if needed) or native (as uploaded)"),
+):
+    """Download the mesh of a specific organ – STL unless ``format=native``."""
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
 
     safe_organ = "".join(c for c in organ if c.isalnum() or c in "_-").lower()
-    scan_dir = get_scan_dir(scan_id)
-    stl_path = scan_dir / "stl" / f"{safe_organ}.stl"
+    stl_dir = get_scan_dir(scan_id) / "stl"
+    if format == "native":
+        mesh_path = await run_io(find_mesh, stl_dir, safe_organ)
+    else:
+        mesh_path = await run_io(compat_stl, stl_dir, safe_organ)
 
-    if not stl_path.exists():
+    if mesh_path is None:
         raise HTTPException(
             status_code=404, detail=f"STL for organ '{organ}' not found"
         )
 
-    return FileResponse(
-        path=stl_path, filename=f"{safe_organ}.stl", media_type="model/stl"
+    suffix = mesh_path.suffix.lower()
+    return await file_download(
+        request, mesh_path, filename=f"{safe_organ}{suffix}", media_type=_MESH_MEDIA_TYPES[suffix]
     )
 
 
 @router.get("/{scan_id}/stl")
 async def list_stls(scan_id: str):
-    """List all available STL files for a scan."""
+    """List all available organ meshes (STL or PLY) for a scan."""
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
 
-    scan_dir = get_scan_dir(scan_id)
-    stl_dir = scan_dir / "stl"
+    def describe() -> list[dict]:
+        return [
+            {
+                "organ": organ,
+                "size": path.stat().st_size,
+                "format": path.suffix.lower().lstrip("."),
+                "triangles": triangle_count(path),
+                "url": f"/scans/{scan_id}/stl/{organ}",
+            }
+            for organ, path in mesh_files(get_scan_dir(scan_id) / "stl").items()
+        ]
+
+    stl_files = await run_io(describe)
+    return {"scan_id": scan_id, "stl_files": stl_files, "count": len(stl_files)}
 
-    if not stl_dir.exists():
-        return {"scan_id": scan_id, "stl_files": [], "count": 0}
 
-    stl_files = [
-        {
-            "organ": p.stem,
-            "size": p.stat().st_size,
-            "url": f"/scans/{scan_id}/stl/{p.stem}",
-        }
-        for p in stl_dir.glob("*.stl")
-    ]
+@router.get("/{scan_id}/stl.zip")
+async def download_stl_zip(
+    scan_id: str,
+    organs: Optional[str] = Query(None, description="Comma-separated organ names (default: all)"),
+    format: str = Query("stl", pattern=_DOWNLOAD_FORMATS,
+                        description="stl (PLY meshes converted) or native (as uploaded)"),
+):
+    """
+    Download all organ STLs of a scan as one ZIP, streamed as it is built.
+
+    Memory use is constant and no temporary file is written; see
+    ``services.stl_archive``.  Organs uploaded as PLY are converted to STL
+    (once, cached) unless ``format=native``.
+    """
+    if not scan_exists(scan_id):
+        raise HTTPException(status_code=404, detail="Scan not found")
+
+    stl_dir = get_scan_dir(scan_id) / "stl"
+    available = await run_io(mesh_files, stl_dir)
+
+    if organs:
+        wanted = list(dict.fromkeys(
+            safe_organ_name(o) for o in organs.split(",") if o.strip()
+        ))
+        missing = [o for o in wanted if o not in available]
+        if missing:
+            raise HTTPException(
+                status_code=404, detail=f"STL not found for organs: {', '.join(missing)}"
+            )
+        selected = [(o, available[o]) for o in wanted]
+    else:
+        selected = list(available.items())
+
+    if not selected:
+        raise HTTPException(status_code=404, detail="No STL files found for this scan")
+
+    if format == "stl":
+        selected = [(o, await run_io(compat_stl, stl_dir, o)) for o, _ in selected]
+
+    return StreamingResponse(
+        iter_zip([(f"{organ}{path.suffix.lower()}", path) for organ, path in selected]),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{scan_id}_stl.zip"'},
+    )
 
-    return {"scan_id": scan_id, "stl_files": stl_files, "count": len(stl_files)}
@@ -0,0 +1,30 @@
+"""Post-processing job routes – queue overview and per-job status / ETA."""
+
+from fastapi import APIRouter, HTTPException
+
+from app.services.jobs import job_queue
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("")
+async def list_jobs():
+    """Running and queued jobs, in the order they will run."""
+    await job_queue.start()
+    jobs = job_queue.active_jobs()
+    return {
+        "workers": job_queue.workers,
+        "ingest_workers": job_queue.ingest_workers,
+        "jobs": jobs,
+        "count": len(jobs),
+    }
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Status of one job, with queue position and ETA while it is pending."""
+    await job_queue.start()
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -5,7 +5,7 @@ from datetime import datetime
 from fastapi import APIRouter, HTTPException
 
 from app.models import Point3D
-from app.storage import load_metadata, save_metadata, scan_exists
+from app.storage import load_metadata, save_metadata_async, scan_exists
 
 router = APIRouter(prefix="/scans", tags=["points"])
 
@@ -27,7 +27,7 @@ async def set_point(scan_id: str, point: Point3D):
         "label": point.label,
         "set_at": datetime.utcnow().isoformat() + "Z",
     }
-    save_metadata(scan_id, metadata)
+    await save_metadata_async(scan_id, metadata)
 
     return {
         "scan_id": scan_id,
@@ -1,14 +1,15 @@
 """Processing routes – trigger segmentation, post-processing & status."""
 
 import logging
-from datetime import datetime
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 
-from app.config import API_BASE_URL, DEFAULT_ORGANS
-from app.storage import load_metadata, save_metadata, scan_exists
-from app.services.runpod import submit_segmentation_job
-from app.services import run_post_processing
+from app.models import SegmentationComplete
+from app.storage import load_metadata, save_metadata_async, scan_exists
+from app.services import complete_segmentation, timeline
+from app.services.canonical import get_canonical_path
+from app.services.ingest import schedule_ingest, submit_segmentation
+from app.services.jobs import job_queue
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +23,8 @@ async def start_processing(scan_id: str):
     """
     Trigger RunPod segmentation for an uploaded CT scan.
 
-    1.  Builds the CT download URL and callback URL from the scan_id.
-    2.  Submits an async job to RunPod.
+    1.  Claims the submission (status ``submitting``) under the metadata lock.
+    2.  Submits an async job to RunPod with the CT download and callback URLs.
     3.  Stores the RunPod job_id in the scan metadata so the client can poll.
     """
     if not scan_exists(scan_id):
@@ -33,7 +34,7 @@ async def start_processing(scan_id: str):
     if not metadata:
         raise HTTPException(status_code=404, detail="Scan metadata not found")
 
-    if metadata.get("status") in ("processing", "segmented", "post_processing", "completed"):
+    if metadata.get("status") in ("submitting", "processing", "segmented", "post_processing", "completed"):
         return {
             "scan_id": scan_id,
             "status": metadata["status"],
@@ -41,23 +42,31 @@ async def start_processing(scan_id: str):
             "message": f"Scan is already in status '{metadata['status']}'",
         }
 
-    ct_url = f"{API_BASE_URL}/scans/{scan_id}/ct"
-    callback_url = f"{API_BASE_URL}/scans/{scan_id}"
+    # Scans without a canonical CT (uploaded before it existed, or the upload's
+    # ingest job has not run yet) get it first – as a job, which then submits
+    if not get_canonical_path(scan_id):
+        job = await schedule_ingest(scan_id, submit=True)
+        return {
+            "scan_id": scan_id,
+            "status": metadata.get("status"),
+            "ingest_job_id": job["job_id"],
+            "message": "Preparing the CT – segmentation is submitted once it is ready",
+        }
 
-    result = await submit_segmentation_job(
-        file_url=ct_url,
-        organs=DEFAULT_ORGANS,
-        callback_url=callback_url,
-    )
+    # Claimed under the metadata lock – concurrent calls submit only once
+    result = await submit_segmentation(scan_id)
+    if result is None:
+        metadata = load_metadata(scan_id) or {}
+        return {
+            "scan_id": scan_id,
+            "status": metadata.get("status"),
+            "runpod_job_id": metadata.get("runpod_job_id"),
+            "message": f"Scan is already in status '{metadata.get('status')}'",
+        }
 
     if "error" in result:
         raise HTTPException(status_code=503, detail=result["error"])
 
-    metadata["status"] = "processing"
-    metadata["runpod_job_id"] = result["job_id"]
-    metadata["processing_started_at"] = datetime.utcnow().isoformat() + "Z"
-    save_metadata(scan_id, metadata)
-
     return {
         "scan_id": scan_id,
         "status": "processing",
@@ -84,11 +93,13 @@ async def reset_scan(scan_id: str):
     old_status = metadata.get("status")
     metadata["status"] = "uploaded"
     metadata.pop("runpod_job_id", None)
+    metadata.pop("submitting_since", None)
     metadata.pop("processing_started_at", None)
     metadata.pop("processing_completed_at", None)
     metadata.pop("processing_error", None)
     metadata.pop("organs_processed", None)
-    save_metadata(scan_id, metadata)
+    timeline.reset(metadata)
+    await save_metadata_async(scan_id, metadata)
 
     logger.info("Reset scan %s from '%s' to 'uploaded'", scan_id, old_status)
     return {
@@ -99,35 +110,45 @@ async def reset_scan(scan_id: str):
     }
 
 
-# ── Trigger post-processing independently ────────────────────────────────
+# ── Segmentation finished (worker callback) ──────────────────────────────
 
-@router.post("/{scan_id}/postprocess")
-async def start_post_processing(scan_id: str):
+@router.post("/{scan_id}/segmentation/complete", status_code=202)
+async def segmentation_complete(scan_id: str, body: SegmentationComplete):
     """
-    Trigger the STL → FBX post-processing pipeline.
+    Called by the segmentation worker after its last STL upload.
 
-    Can be called at any time – it does NOT require RunPod to have just
-    completed.  As long as there are STL files in the scan's stl/ directory,
-    Blender will convert them to an FBX.
+    Marks the scan as segmented and queues post-processing automatically.
     """
     if not scan_exists(scan_id):
         raise HTTPException(status_code=404, detail="Scan not found")
 
-    metadata = load_metadata(scan_id)
-    if not metadata:
-        raise HTTPException(status_code=404, detail="Scan metadata not found")
+    job = await complete_segmentation(
+        scan_id, body.organs_processed, body.organs_failed, body.timeline
+    )
+    return {**job_queue.describe(job), "message": "Post-processing queued"}
 
-    if metadata.get("status") == "post_processing":
-        return {
-            "scan_id": scan_id,
-            "status": "post_processing",
-            "message": "Post-processing is already running",
-        }
 
-    result = await run_post_processing(scan_id)
+# ── Trigger post-processing independently ────────────────────────────────
 
-    if "error" in result:
-        raise HTTPException(status_code=500, detail=result["error"])
+@router.post("/{scan_id}/postprocess", status_code=202)
+async def start_post_processing(
+    scan_id: str,
+    priority: int = Query(0, description="Higher runs first"),
+):
+    """
+    Queue the STL → FBX post-processing pipeline and return the job.
 
-    return result
+    Can be called at any time – it does NOT require RunPod to have just
+    completed.  As long as there are STL files in the scan's stl/ directory,
+    Blender will convert them to an FBX.  If a job for the scan is already
+    queued or running, that job is returned instead of a new one.  Follow
+    it via ``GET /jobs/{job_id}`` or ``/scans/{id}/events``.
+    """
+    if not scan_exists(scan_id):
+        raise HTTPException(status_code=404, detail="Scan not found")
 
+    job, created = await job_queue.submit(scan_id, priority)
+    return {
+        **job_queue.describe(job),
+        "message": "Post-processing queued" if created else f"Post-processing is already {job['status']}",
+    }
@@ -1,111 +1,89 @@
 """Scan CRUD routes – upload, get, list, delete."""
 
-import os
-import uuid
 import shutil
-from datetime import datetime
+import time
+import uuid
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException
 
-from app.config import MAX_FILE_SIZE
+from app.config import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE
 from app.storage import (
+    AsyncFileWriter,
     get_scan_dir,
     load_metadata,
-    save_metadata,
+    run_io,
+    save_metadata_async,
     scan_exists,
     get_fbx_path,
 )
+from app.services.ingest import (
+    ingest_target,
+    new_scan_metadata,
+    schedule_ingest,
+    upload_response,
+)
+from app.services import timeline
+from app.services.precompress import write_sidecars
+from app.services.sniff import CTHeaderSniffer, UnsupportedUpload
 
 router = APIRouter(prefix="/scans", tags=["scans"])
 
 
 @router.post("/upload")
-async def upload_scan(file: UploadFile = File(...)):
+async def upload_scan(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """
     Upload a CT scan or FBX file. Returns a unique scan_id for access.
     Supports: .fbx, .zip, .nii, .nii.gz, .mhd, .nrrd
     """
+    started = time.time()
     scan_id = str(uuid.uuid4())
     scan_dir = get_scan_dir(scan_id)
     scan_dir.mkdir(parents=True, exist_ok=True)
 
     original_filename = file.filename or "unnamed"
-    lower_filename = original_filename.lower()
+    file_path, status = ingest_target(scan_dir, original_filename)
 
-    if lower_filename.endswith(".fbx"):
-        file_path = scan_dir / "model.fbx"
-        status = "completed"
-    else:
-        file_path = scan_dir / f"ct_original_{original_filename}"
-        status = "uploaded"
+    # CT uploads are sniffed while streaming so unusable files are rejected
+    # before the rest of the body is stored.
+    sniffer = None if status == "completed" else CTHeaderSniffer(original_filename)
 
     total_size = 0
     try:
-        with open(file_path, "wb") as buffer:
-            while chunk := await file.read(1024 * 1024):
+        async with AsyncFileWriter(file_path) as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
                 total_size += len(chunk)
                 if total_size > MAX_FILE_SIZE:
-                    buffer.close()
-                    shutil.rmtree(scan_dir)
                     raise HTTPException(
                         status_code=413,
                         detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024**2):.0f} MB",
                     )
-                buffer.write(chunk)
+                if sniffer:
+                    sniffer.feed(chunk)
+                await buffer.write(chunk)
+        ct_header = await run_io(sniffer.finish, file_path) if sniffer else None
+    except UnsupportedUpload as e:
+        await run_io(shutil.rmtree, scan_dir, ignore_errors=True)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except HTTPException:
+        await run_io(shutil.rmtree, scan_dir, ignore_errors=True)
         raise
     except Exception as e:
-        if scan_dir.exists():
-            shutil.rmtree(scan_dir)
+        await run_io(shutil.rmtree, scan_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
-    metadata = {
-        "scan_id": scan_id,
-        "created_at": datetime.utcnow().isoformat() + "Z",
-        "original_filename": original_filename,
-        "file_size": total_size,
-        "status": status,
-        "point": None,
-        "has_fbx": lower_filename.endswith(".fbx"),
-    }
-    save_metadata(scan_id, metadata)
-
-    if not metadata["has_fbx"]:
-        from app.services.runpod import submit_segmentation_job
-        from app.config import API_BASE_URL, DEFAULT_ORGANS
-        import logging
-
-        logger = logging.getLogger(__name__)
-        try:
-            ct_url = f"{API_BASE_URL}/scans/{scan_id}/ct"
-            callback_url = f"{API_BASE_URL}/scans/{scan_id}"
-            result = await submit_segmentation_job(
-                file_url=ct_url,
-                organs=DEFAULT_ORGANS,
-                callback_url=callback_url,
-            )
-            if "job_id" in result:
-                metadata["status"] = "processing"
-                metadata["runpod_job_id"] = result["job_id"]
-                metadata["processing_started_at"] = datetime.utcnow().isoformat() + "Z"
-                save_metadata(scan_id, metadata)
-        except Exception:
-            logger.exception("Failed to auto-trigger RunPod for scan %s", scan_id)
-
-    return {
-        "scan_id": scan_id,
-        "filename": original_filename,
-        "size": total_size,
-        "status": status,
-        "has_fbx": metadata["has_fbx"],
-        "message": (
-            "FBX uploaded successfully"
-            if metadata["has_fbx"]
-            else "CT scan uploaded – segmentation submitted to RunPod"
-            if metadata.get("status") == "processing"
-            else "CT scan uploaded"
-        ),
-    }
+    metadata = new_scan_metadata(scan_id, original_filename, total_size, status)
+    if ct_header:
+        metadata["ct_header"] = ct_header
+    timeline.record(metadata, "upload", started, nbytes=total_size)
+    await save_metadata_async(scan_id, metadata)
+
+    ingest_job = None
+    if metadata["has_fbx"]:
+        background_tasks.add_task(write_sidecars, file_path)
+    else:
+        ingest_job = await schedule_ingest(scan_id, submit=True)
+
+    return upload_response(scan_id, metadata, status, ingest_job)
 
 
 @router.get("/{scan_id}")
@@ -129,5 +107,5 @@ async def delete_scan(scan_id: str):
         raise HTTPException(status_code=404, detail="Scan not found")
 
     scan_dir = get_scan_dir(scan_id)
-    shutil.rmtree(scan_dir)
+    await run_io(shutil.rmtree, scan_dir)
     return {"message": "Scan deleted successfully", "scan_id": scan_id}
@@ -0,0 +1,481 @@
+"""Resumable (tus-style) upload routes for large CT archives.
+
+Protocol
+--------
+POST   /uploads              Create an upload.  Headers: ``Upload-Length``
+                             and ``Upload-Metadata`` (comma-separated
+                             ``key base64(value)`` pairs: ``filename``,
+                             optional ``scan_id`` to replace the CT of an
+                             existing scan, optional ``sha256`` to verify).
+HEAD   /uploads/{upload_id}  Current ``Upload-Offset`` / ``Upload-Length``.
+PATCH  /uploads/{upload_id}  Append bytes at ``Upload-Offset``
+                             (``Content-Type: application/offset+octet-stream``).
+DELETE /uploads/{upload_id}  Abort and discard the upload.
+
+Every response about an unfinished upload carries ``Upload-Expires``: the
+upload is discarded ``UPLOAD_EXPIRY`` seconds after its last write (tus
+"expiration").  Expired uploads answer 410 and are removed by
+``upload_sweeper``.
+
+Bytes are written straight into the staging file while a SHA-256 is
+computed on the fly.  If the connection drops, everything received so far
+is kept and the client resumes from the offset reported by ``HEAD``.  Once
+the last byte arrives the file is moved into the normal scan layout and the
+same processing path as ``POST /scans/upload`` is triggered.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response
+from starlette.requests import ClientDisconnect
+
+from app.config import MAX_FILE_SIZE, UPLOAD_EXPIRY, UPLOAD_SWEEP_INTERVAL, UPLOADS_DIR
+from app.storage import (
+    AsyncFileWriter,
+    get_scan_dir,
+    get_upload_dir,
+    get_upload_data_path,
+    is_valid_scan_id,
+    load_metadata,
+    load_upload_info,
+    run_io,
+    save_metadata,
+    save_upload_info,
+    scan_exists,
+)
+from app.services.ingest import (
+    ingest_target,
+    new_scan_metadata,
+    schedule_ingest,
+    upload_response,
+)
+from app.services import timeline
+from app.services.canonical import remove_canonical
+from app.services.precompress import write_sidecars
+from app.services.sniff import CTHeaderSniffer, UnsupportedUpload
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/uploads", tags=["uploads"])
+
+TUS_VERSION = "1.0.0"
+TUS_HEADERS = {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store"}
+
+
+class _StreamState:
+    """Running SHA-256 and header sniffer for the bytes staged so far."""
+
+    def __init__(self, filename: str):
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        # FBX uploads are not CT volumes – nothing to sniff
+        self.sniffer = None if filename.lower().endswith(".fbx") else CTHeaderSniffer(filename)
+
+
+# Stream state per upload_id.  Lost on restart; rebuilt from the staged
+# bytes on the next PATCH.
+_streams: dict[str, _StreamState] = {}
+_locks: dict[str, asyncio.Lock] = {}
+
+
+# ── Helpers ──────────────────────────────────────────────────────────────
+
+def _parse_upload_metadata(header: str) -> dict[str, str]:
+    """Decode a tus ``Upload-Metadata`` header into a plain dict."""
+    result: dict[str, str] = {}
+    for pair in header.split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, value = pair.partition(" ")
+        try:
+            result[key] = base64.b64decode(value).decode("utf-8") if value else ""
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail=f"Invalid Upload-Metadata value for '{key}'")
+    return result
+
+
+def _get_info(upload_id: str) -> dict:
+    info = load_upload_info(upload_id)
+    if not info:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if info.get("expires_ts", float("inf")) < time.time():
+        raise HTTPException(status_code=410, detail="Upload expired")
+    return info
+
+
+def _extend(info: dict):
+    """Push the upload's expiry to ``UPLOAD_EXPIRY`` seconds from now."""
+    info["expires_ts"] = time.time() + UPLOAD_EXPIRY
+
+
+def _expiry_headers(info: dict) -> dict[str, str]:
+    if "expires_ts" not in info:
+        return {}
+    expires = datetime.fromtimestamp(info["expires_ts"], timezone.utc)
+    return {"Upload-Expires": format_datetime(expires, usegmt=True)}
+
+
+def _state_at(upload_id: str, info: dict) -> _StreamState:
+    """Return the stream state for the first ``info["offset"]`` staged bytes."""
+    offset = info["offset"]
+    cached = _streams.get(upload_id)
+    if cached and cached.offset == offset:
+        return cached
+
+    state = _StreamState(info["filename"])
+    remaining = offset
+    with open(get_upload_data_path(upload_id), "rb") as f:
+        while remaining > 0:
+            block = f.read(min(1024 * 1024, remaining))
+            if not block:
+                break
+            state.hasher.update(block)
+            if state.sniffer:
+                state.sniffer.feed(block)
+            remaining -= len(block)
+    state.offset = offset
+    return state
+
+
+def _record_upload(metadata: dict, info: dict):
+    """Upload stage from session creation to now – pauses and resumes included."""
+    started = timeline.parse_time(info.get("created_at"))
+    if started is not None:
+        timeline.record(metadata, "upload", started, nbytes=info["length"], resumable=True)
+
+
+def _finalize(upload_id: str, info: dict, state: _StreamState) -> dict:
+    """Move a completed upload into its scan directory and update metadata."""
+    digest = state.hasher.hexdigest()
+    expected = info.get("sha256")
+    if expected and expected.lower() != digest:
+        raise HTTPException(
+            status_code=460,
+            detail="Checksum mismatch – upload discarded",
+        )
+
+    data_path = get_upload_data_path(upload_id)
+    original_filename = info["filename"]
+    ct_header = state.sniffer.finish(data_path) if state.sniffer else None
+
+    if info.get("scan_id"):
+        scan_id = info["scan_id"]
+        if not scan_exists(scan_id):  # also rejects anything but a scan UUID
+            raise HTTPException(status_code=404, detail="Scan not found")
+        ct_path = get_scan_dir(scan_id) / f"ct_original_{original_filename}"
+        remove_canonical(scan_id)
+        os.replace(data_path, ct_path)
+
+        metadata = load_metadata(scan_id)
+        metadata["ct_filename"] = original_filename
+        metadata["ct_size"] = info["length"]
+        metadata["ct_sha256"] = digest
+        metadata["ct_header"] = ct_header
+        metadata["ct_uploaded_at"] = datetime.utcnow().isoformat() + "Z"
+        _record_upload(metadata, info)
+        save_metadata(scan_id, metadata)
+        return {"scan_id": scan_id, "metadata": metadata, "sha256": digest, "new_scan": False}
+
+    scan_id = str(uuid.uuid4())
+    scan_dir = get_scan_dir(scan_id)
+    scan_dir.mkdir(parents=True, exist_ok=True)
+    file_path, status = ingest_target(scan_dir, original_filename)
+    os.replace(data_path, file_path)
+
+    metadata = new_scan_metadata(scan_id, original_filename, info["length"], status)
+    metadata["sha256"] = digest
+    if ct_header:
+        metadata["ct_header"] = ct_header
+    _record_upload(metadata, info)
+    save_metadata(scan_id, metadata)
+    return {
+        "scan_id": scan_id,
+        "metadata": metadata,
+        "status": status,
+        "sha256": digest,
+        "new_scan": True,
+    }
+
+
+def _discard(upload_id: str):
+    _streams.pop(upload_id, None)
+    _locks.pop(upload_id, None)
+    shutil.rmtree(get_upload_dir(upload_id), ignore_errors=True)
+
+
+def _expired_uploads(now: float) -> list[str]:
+    """IDs of staged uploads past their expiry.  Blocking."""
+    expired = []
+    for path in UPLOADS_DIR.iterdir():
+        if not path.is_dir():
+            continue
+        try:
+            info = load_upload_info(path.name)
+        except ValueError:
+            info = None
+        expires = (info or {}).get("expires_ts")
+        if expires is None:  # unreadable or older bookkeeping: last write + expiry
+            expires = path.stat().st_mtime + UPLOAD_EXPIRY
+        if expires < now:
+            expired.append(path.name)
+    return expired
+
+
+async def sweep_expired_uploads() -> list[str]:
+    """Discard every expired upload no request is writing to.  Returns their IDs."""
+    removed = []
+    for upload_id in await run_io(_expired_uploads, time.time()):
+        lock = _locks.setdefault(upload_id, asyncio.Lock())
+        if lock.locked():
+            continue  # a PATCH is writing right now
+        async with lock:
+            await run_io(_discard, upload_id)
+        removed.append(upload_id)
+    if removed:
+        logger.info("Discarded %d expired upload(s)", len(removed))
+    return removed
+
+
+class UploadSweeper:
+    """Runs ``sweep_expired_uploads`` every *interval* seconds in the background."""
+
+    def __init__(self, interval: int = UPLOAD_SWEEP_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run(), name="upload-sweeper")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await sweep_expired_uploads()
+            except Exception:
+                logger.exception("Sweeping expired uploads failed")
+            await asyncio.sleep(self.interval)
+
+
+upload_sweeper = UploadSweeper()
+
+
+# ── Routes ───────────────────────────────────────────────────────────────
+
+@router.options("")
+async def upload_options():
+    """Advertise protocol capabilities."""
+    return Response(
+        status_code=204,
+        headers={
+            "Tus-Resumable": TUS_VERSION,
+            "Tus-Version": TUS_VERSION,
+            "Tus-Extension": "creation,termination,expiration",
+            "Tus-Max-Size": str(MAX_FILE_SIZE),
+        },
+    )
+
+
+@router.post("", status_code=201)
+async def create_upload(request: Request):
+    """Create a resumable upload and return its URL in ``Location``."""
+    try:
+        length = int(request.headers["Upload-Length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Missing or invalid Upload-Length header")
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="Upload-Length must be positive")
+    if length > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024**2):.0f} MB",
+        )
+
+    meta = _parse_upload_metadata(request.headers.get("Upload-Metadata", ""))
+    filename = Path(meta.get("filename") or "unnamed").name
+    scan_id: Optional[str] = meta.get("scan_id") or None
+    if scan_id and not is_valid_scan_id(scan_id):
+        raise HTTPException(status_code=400, detail="Invalid scan_id in Upload-Metadata")
+    if scan_id and not scan_exists(scan_id):
+        raise HTTPException(status_code=404, detail="Scan not found")
+
+    upload_id = uuid.uuid4().hex
+    await run_io(get_upload_dir(upload_id).mkdir, parents=True, exist_ok=True)
+    await run_io(get_upload_data_path(upload_id).touch)
+
+    info = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "length": length,
+        "offset": 0,
+        "scan_id": scan_id,
+        "sha256": meta.get("sha256"),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+    }
+    _extend(info)
+    await run_io(save_upload_info, upload_id, info)
+    _streams[upload_id] = _StreamState(filename)
+
+    location = f"/uploads/{upload_id}"
+    return Response(
+        status_code=201,
+        headers={**TUS_HEADERS, **_expiry_headers(info), "Location": location, "Upload-Offset": "0"},
+    )
+
+
+@router.head("/{upload_id}")
+async def upload_status(upload_id: str):
+    """Report how many bytes of the upload the server already holds."""
+    info = _get_info(upload_id)
+    return Response(
+        status_code=200,
+        headers={
+            **TUS_HEADERS,
+            **_expiry_headers(info),
+            "Upload-Offset": str(info["offset"]),
+            "Upload-Length": str(info["length"]),
+        },
+    )
+
+
+@router.patch("/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, background_tasks: BackgroundTasks):
+    """
+    Append the request body at ``Upload-Offset``.
+
+    Returns 204 while the upload is incomplete.  The request that delivers
+    the last byte finalises the scan and returns the same body as
+    ``POST /scans/upload`` (200).
+    """
+    info = _get_info(upload_id)
+
+    if request.headers.get("Content-Type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/offset+octet-stream")
+    try:
+        client_offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Missing or invalid Upload-Offset header")
+
+    lock = _locks.setdefault(upload_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=423, detail="Another request is writing to this upload")
+
+    async with lock:
+        offset = info["offset"]
+        if client_offset != offset:
+            raise HTTPException(status_code=409, detail=f"Offset mismatch – server is at {offset}")
+
+        try:
+            state = await run_io(_state_at, upload_id, info)
+        except UnsupportedUpload as e:
+            await run_io(_discard, upload_id)
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        length = info["length"]
+        disconnected = False
+        rejected: Optional[UnsupportedUpload] = None
+        try:
+            # Opening at *offset* drops any torn tail beyond the last
+            # acknowledged byte; the hasher sees exactly what hits the disk.
+            async with AsyncFileWriter(
+                get_upload_data_path(upload_id), offset=offset, hasher=state.hasher
+            ) as buffer:
+                try:
+                    async for chunk in request.stream():
+                        if not chunk:
+                            continue
+                        if offset + len(chunk) > length:
+                            raise HTTPException(status_code=413, detail="Upload exceeds declared Upload-Length")
+                        if state.sniffer:
+                            state.sniffer.feed(chunk)
+                        await buffer.write(chunk)
+                        offset += len(chunk)
+                except ClientDisconnect:
+                    disconnected = True
+        except UnsupportedUpload as e:
+            rejected = e
+        finally:
+            if rejected is None:
+                info["offset"] = offset
+                _extend(info)
+                state.offset = offset
+                _streams[upload_id] = state
+                await run_io(save_upload_info, upload_id, info)
+
+        if rejected is not None:
+            # Unusable format – no point in receiving the rest of the file
+            await run_io(_discard, upload_id)
+            raise HTTPException(status_code=rejected.status_code, detail=str(rejected))
+
+        if disconnected:
+            logger.info("Upload %s interrupted at %d/%d bytes", upload_id, offset, length)
+            return Response(status_code=204, headers={**TUS_HEADERS, **_expiry_headers(info),
+                                                      "Upload-Offset": str(offset)})
+
+        if offset < length:
+            return Response(status_code=204, headers={**TUS_HEADERS, **_expiry_headers(info),
+                                                      "Upload-Offset": str(offset)})
+
+        try:
+            result = await run_io(_finalize, upload_id, info, state)
+        except UnsupportedUpload as e:
+            await run_io(_discard, upload_id)
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except HTTPException as exc:
+            if exc.status_code == 460:
+                await run_io(_discard, upload_id)
+            raise
+        await run_io(_discard, upload_id)
+
+    scan_id = result["scan_id"]
+    metadata = result["metadata"]
+    digest = result["sha256"]
+    logger.info("Upload %s finalised into scan %s (sha256 %s)", upload_id, scan_id, digest)
+
+    # The canonical transcode runs as a job: a multi-minute final PATCH
+    # would time out and be retried by the client
+    if not result["new_scan"]:
+        ingest_job = await schedule_ingest(scan_id)
+        return {
+            "scan_id": scan_id,
+            "message": "CT scan uploaded successfully",
+            "filename": metadata["ct_filename"],
+            "size": metadata["ct_size"],
+            "sha256": digest,
+            "ingest_job_id": ingest_job["job_id"],
+        }
+
+    ingest_job = None
+    if metadata["has_fbx"]:
+        background_tasks.add_task(write_sidecars, get_scan_dir(scan_id) / "model.fbx")
+    else:
+        ingest_job = await schedule_ingest(scan_id, submit=True)
+
+    body = upload_response(scan_id, metadata, result["status"], ingest_job)
+    body["sha256"] = digest
+    return body
+
+
+@router.delete("/{upload_id}", status_code=204)
+async def delete_upload(upload_id: str):
+    """Abort an upload and discard the staged bytes."""
+    _get_info(upload_id)
+    await run_io(_discard, upload_id)
+    return Response(status_code=204, headers=TUS_HEADERS)
@@ -5,16 +5,36 @@ Usage:
     blender --background --python stl_to_fbx.py -- \
         --stl-dir /path/to/stl \
         --output  /path/to/model.fbx \
-        --colors  /path/to/organ_colors.json
+        --colors  /path/to/organ_colors.json \
+        [--prepared-dir /path/to/stl_prepared] \
+        [--timings-file /path/to/blender_timings.json]
 
-Each *.stl file in --stl-dir becomes a separate mesh object named after
-the organ (filename stem).  A distinct material with the colour and alpha
+    blender --background --python stl_to_fbx.py -- --prepare \
+        --stl-dir /path/to/stl \
+        --prepared-dir /path/to/stl_prepared \
+        --organs liver,spleen
+
+Each *.stl or *.ply (binary, indexed) file in --stl-dir becomes a separate
+mesh object named after the organ (filename stem); should an organ have
+both, the newer file wins.  A distinct material with the colour and alpha
 from the config is assigned to every object.  Unknown organs fall back to
 the "default" entry in the config.
+
+With --prepare the listed organs are only imported, normal-fixed and
+remeshed, and each mesh is saved as <organ>.blend in --prepared-dir.  The
+assembly loads a prepared mesh instead of redoing that work whenever it
+is at least as new as the organ's mesh file.
+
+--timings-file receives how long importing, remeshing and exporting took
+({"import": {"started", "finished", "seconds", "extra"}, ...}, epoch
+seconds) for the scan's timeline.
 """
 
+import os
+
 import sys
 import json
+import time
 import argparse
 from pathlib import Path
 
@@ -27,17 +47,49 @@ def parse_args() -> argparse.Namespace:
     """Parse arguments that come after Blender's own ``--`` separator."""
     argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
     parser = argparse.ArgumentParser(description="STL → FBX converter")
-    parser.add_argument("--stl-dir", required=True, help="Directory with .stl files")
-    parser.add_argument("--output", required=True, help="Output .fbx path")
+    parser.add_argument("--stl-dir", required=True, help="Directory with .stl / .ply files")
+    parser.add_argument("--output", default="", help="Output .fbx path")
     parser.add_argument("--usdz-output", default="", help="Output .usdz path")
-    parser.add_argument("--colors", required=True, help="organ_colors.json path")
+    parser.add_argument("--colors", default="", help="organ_colors.json path")
     parser.add_argument("--offset-file", default="",
                         help="Write the centering offset as JSON to this path")
-    return parser.parse_args(argv)
+    parser.add_argument("--prepared-dir", default="",
+                        help="Directory with per-organ prepared meshes (<organ>.blend)")
+    parser.add_argument("--prepare", action="store_true",
+                        help="Only prepare the --organs meshes into --prepared-dir")
+    parser.add_argument("--organs", default="", help="Comma-separated organs for --prepare")
+    parser.add_argument("--timings-file", default="",
+                        help="Write stage timings as JSON to this path")
+    args = parser.parse_args(argv)
+    if args.prepare and not args.prepared_dir:
+        parser.error("--prepare needs --prepared-dir")
+    if not args.prepare and not (args.output and args.colors):
+        parser.error("--output and --colors are required")
+    return args
 
 
 # ── Helpers ──────────────────────────────────────────────────────────────
 
+class StageTimings:
+    """Accumulates the time spent per stage across interleaved calls."""
+
+    def __init__(self):
+        self.stages: dict[str, dict] = {}
+
+    def add(self, name: str, started: float, **extra) -> None:
+        finished = time.time()
+        stage = self.stages.setdefault(name, {"started": started, "seconds": 0.0, "extra": {}})
+        stage["finished"] = finished
+        stage["seconds"] += finished - started
+        for key, value in extra.items():
+            stage["extra"][key] = stage["extra"].get(key, 0) + value
+
+    def write(self, path: str) -> None:
+        if path:
+            with open(path, "w") as f:
+                json.dump(self.stages, f)
+
+
 def clear_scene() -> None:
     """Remove every object, mesh, material and collection from the scene."""
     bpy.ops.object.select_all(action="SELECT")
@@ -78,13 +130,29 @@ def create_material(name: str, rgba: list[float]) -> bpy.types.Material:
     return mat
 
 
-def import_stl(filepath: str) -> bpy.types.Object | None:
-    """Import an STL and return the resulting object, or None if empty."""
-    file_size = Path(filepath).stat().st_size
-    if file_size <= 84:
-        return None
+MESH_SUFFIXES = (".ply", ".stl")
+
 
-    bpy.ops.wm.stl_import(filepath=filepath)
+def mesh_files(stl_dir: Path) -> list[Path]:
+    """One mesh file per organ in *stl_dir* (the newer one if both formats exist)."""
+    found: dict[str, Path] = {}
+    for path in stl_dir.iterdir():
+        if path.suffix.lower() not in MESH_SUFFIXES or path.name.startswith("."):
+            continue
+        other = found.get(path.stem)
+        if other is None or path.stat().st_mtime_ns > other.stat().st_mtime_ns:
+            found[path.stem] = path
+    return [found[organ] for organ in sorted(found)]
+
+
+def import_mesh(filepath: str) -> bpy.types.Object | None:
+    """Import an STL or PLY and return the resulting object, or None if empty."""
+    if filepath.lower().endswith(".ply"):
+        bpy.ops.wm.ply_import(filepath=filepath)
+    else:
+        if Path(filepath).stat().st_size <= 84:
+            return None
+        bpy.ops.wm.stl_import(filepath=filepath)
     obj = bpy.context.active_object
 
     if obj is None or obj.type != "MESH" or len(obj.data.vertices) == 0:
@@ -120,6 +188,61 @@ def remesh_and_smooth(obj: bpy.types.Object) -> None:
     bpy.ops.object.shade_smooth()
 
 
+def prepared_path(prepared_dir: str, stl_path: Path) -> Path | None:
+    """The prepared mesh for *stl_path* if one exists and is up to date."""
+    if not prepared_dir:
+        return None
+    path = Path(prepared_dir) / f"{stl_path.stem}.blend"
+    if path.exists() and path.stat().st_mtime_ns >= stl_path.stat().st_mtime_ns:
+        return path
+    return None
+
+
+def save_prepared(obj: bpy.types.Object, path: Path, source_mtime_ns: int) -> None:
+    """
+    Write the object's mesh (only) to a .blend library file, stamped with
+    the source STL's mtime – an STL replaced meanwhile is newer and the
+    prepared mesh counts as stale.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp.blend")
+    bpy.data.libraries.write(str(tmp), {obj.data}, fake_user=True)
+    os.utime(tmp, ns=(source_mtime_ns, source_mtime_ns))
+    os.replace(tmp, path)
+
+
+def load_prepared(path: Path, organ: str) -> bpy.types.Object | None:
+    """Append the mesh from a prepared .blend as a new object."""
+    with bpy.data.libraries.load(str(path)) as (data_from, data_to):
+        data_to.meshes = list(data_from.meshes[:1])
+    if not data_to.meshes:
+        return None
+    obj = bpy.data.objects.new(organ, data_to.meshes[0])
+    bpy.context.collection.objects.link(obj)
+    return obj
+
+
+def prepare_organs(stl_dir: Path, prepared_dir: Path, organs: list[str]) -> None:
+    """Normal-fix and remesh each organ once and save it for the assembly."""
+    for organ in organs:
+        candidates = [stl_dir / f"{organ}{suffix}" for suffix in MESH_SUFFIXES]
+        existing = [p for p in candidates if p.exists()]
+        if not existing:
+            continue
+        stl_path = max(existing, key=lambda p: p.stat().st_mtime_ns)
+        source_mtime_ns = stl_path.stat().st_mtime_ns
+        clear_scene()
+        obj = import_mesh(str(stl_path))
+        if obj is None:
+            continue
+        obj.name = organ
+        obj.data.name = organ
+        fix_normals(obj)
+        remesh_and_smooth(obj)
+        save_prepared(obj, prepared_dir / f"{organ}.blend", source_mtime_ns)
+        print(f"Prepared {organ}")
+
+
 def center_all_objects() -> list[float]:
     """
     Move all objects so their combined bounding box is centred at the
@@ -164,29 +287,45 @@ def main() -> None:
     args = parse_args()
 
     stl_dir = Path(args.stl_dir)
+    if args.prepare:
+        organs = [o for o in args.organs.split(",") if o]
+        prepare_organs(stl_dir, Path(args.prepared_dir), organs)
+        return
+
     output_path = Path(args.output)
     color_config = load_color_config(args.colors)
 
     default_rgba = color_config.get("default", {}).get("color", [0.8, 0.8, 0.8, 0.4])
     organ_colors = color_config.get("organs", {})
 
-    stl_files = sorted(stl_dir.glob("*.stl"))
+    stl_files = mesh_files(stl_dir)
     if not stl_files:
         sys.exit(1)
 
     clear_scene()
 
+    timings = StageTimings()
     imported_count = 0
+    prepared_count = 0
     for stl_path in stl_files:
         organ = stl_path.stem
 
-        obj = import_stl(str(stl_path))
-        if obj is None:
-            continue
-
-        obj.name = organ
-        fix_normals(obj)
-        remesh_and_smooth(obj)
+        t0 = time.time()
+        prepared = prepared_path(args.prepared_dir, stl_path)
+        obj = load_prepared(prepared, organ) if prepared else None
+        if obj is not None:
+            prepared_count += 1
+            timings.add("import", t0, organs=1, prepared=1)
+        else:
+            obj = import_mesh(str(stl_path))
+            timings.add("import", t0, organs=1)
+            if obj is None:
+                continue
+            obj.name = organ
+            t0 = time.time()
+            fix_normals(obj)
+            remesh_and_smooth(obj)
+            timings.add("remesh", t0, organs=1)
 
         organ_cfg = organ_colors.get(organ, {})
         rgba = organ_cfg.get("color", default_rgba)
@@ -202,6 +341,7 @@ def main() -> None:
 
     if imported_count == 0:
         sys.exit(1)
+    print(f"Imported {imported_count} organs ({prepared_count} already prepared)")
 
     centre_offset = center_all_objects()
 
@@ -213,6 +353,7 @@ def main() -> None:
         with open(offset_path, "w") as f:
             json.dump({"centre_offset": centre_offset}, f)
 
+    t0 = time.time()
     bpy.ops.object.select_all(action="SELECT")
     bpy.context.view_layer.objects.active = [
         o for o in bpy.data.objects if o.type == "MESH"
@@ -235,6 +376,9 @@ def main() -> None:
         usdz_path = Path(args.usdz_output)
         usdz_path.parent.mkdir(parents=True, exist_ok=True)
         bpy.ops.wm.usd_export(filepath=str(usdz_path), selected_objects_only=False)
+    timings.add("export", t0)
+
+    timings.write(args.timings_file)
 
 
 if __name__ == "__main__":
@@ -4,32 +4,55 @@ import asyncio
 import json
 import logging
 import subprocess
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 from app.config import ASSETS_DIR
-from app.storage import get_scan_dir, load_metadata, save_metadata
+from app.events import bus
+from app.services import timeline
+from app.services.meshes import mesh_files, triangle_count
+from app.storage import (
+    get_scan_dir,
+    load_metadata,
+    metadata_lock,
+    run_io,
+    save_metadata,
+    save_metadata_async,
+    update_metadata,
+)
 
 logger = logging.getLogger(__name__)
 
 BLENDER_BIN = "blender"
 STL_TO_FBX_SCRIPT = Path(__file__).parent.parent / "scripts" / "stl_to_fbx.py"
 ORGAN_COLORS_JSON = ASSETS_DIR / "organ_colors.json"
+# Per-organ meshes already normal-fixed / remeshed by Blender (<organ>.blend)
+PREPARED_DIR_NAME = "stl_prepared"
+# Stage timings written by the Blender script (see services.timeline)
+BLENDER_TIMINGS_NAME = "blender_timings.json"
+
+
+def _progress(scan_id: str, stage: str, message: str, **extra):
+    """Publish a post-processing step for live clients (``/scans/{id}/events``)."""
+    bus.publish(scan_id, "progress", {"stage": stage, "message": message, **extra})
 
 
 def _validate_stl_files(scan_id: str) -> list[Path]:
     """
-    Return a list of valid (non-empty) STL file paths for a scan.
+    Return a list of valid (non-empty) mesh file paths (STL or PLY) for a scan.
     Raises ValueError if the stl/ directory is missing or has no valid files.
     """
     stl_dir = get_scan_dir(scan_id) / "stl"
     if not stl_dir.exists():
         raise ValueError(f"STL directory does not exist: {stl_dir}")
 
-    all_stls = sorted(stl_dir.glob("*.stl"))
+    all_stls = list(mesh_files(stl_dir).values())
     if not all_stls:
         raise ValueError(f"No STL files found in {stl_dir}")
 
-    valid = [f for f in all_stls if f.stat().st_size > 84]
+    valid = [f for f in all_stls if triangle_count(f) > 0]
     skipped = len(all_stls) - len(valid)
     if skipped:
         logger.warning("Skipped %d empty STL file(s) for scan %s", skipped, scan_id)
@@ -61,6 +84,8 @@ async def _run_blender(scan_id: str) -> Path:
         "--usdz-output", str(output_usdz),
         "--colors", str(ORGAN_COLORS_JSON),
         "--offset-file", str(offset_file),
+        "--prepared-dir", str(scan_dir / PREPARED_DIR_NAME),
+        "--timings-file", str(scan_dir / BLENDER_TIMINGS_NAME),
     ]
 
     logger.info("Running Blender: %s", " ".join(cmd))
@@ -85,6 +110,132 @@ async def _run_blender(scan_id: str) -> Path:
     return output_fbx
 
 
+def _record_blender_timings(scan_id: str, metadata: dict):
+    """Add the ``blender_*`` stages the Blender script measured."""
+    path = get_scan_dir(scan_id) / BLENDER_TIMINGS_NAME
+    try:
+        with open(path, "r") as f:
+            stages = json.load(f)
+    except (OSError, ValueError):
+        return
+    for name, entry in stages.items():
+        try:
+            timeline.record(
+                metadata, f"blender_{name}", entry["started"], entry["finished"],
+                duration=entry["seconds"], **entry.get("extra", {}),
+            )
+        except (KeyError, TypeError):
+            logger.warning("Ignoring malformed Blender timing %r for scan %s", name, scan_id)
+
+
+# ── Per-organ preparation ────────────────────────────────────────────────
+
+def _stale_organs(scan_id: str) -> list[str]:
+    """Organs whose mesh (STL or PLY) has no prepared mesh, or a newer one than it."""
+    scan_dir = get_scan_dir(scan_id)
+    prepared_dir = scan_dir / PREPARED_DIR_NAME
+    stale = []
+    for organ, mesh in mesh_files(scan_dir / "stl").items():
+        if triangle_count(mesh) == 0:
+            continue
+        prepared = prepared_dir / f"{organ}.blend"
+        if not prepared.exists() or prepared.stat().st_mtime_ns < mesh.stat().st_mtime_ns:
+            stale.append(organ)
+    return stale
+
+
+async def run_preparation(scan_id: str) -> dict:
+    """
+    Prepare the organs that arrived since the last run (normals, remesh,
+    smoothing) so the final assembly only has to merge them.
+
+    Scheduled as ``prepare`` jobs while STLs are uploaded.  Failures are
+    harmless – the assembly prepares whatever is missing itself.
+    """
+    organs = await asyncio.to_thread(_stale_organs, scan_id)
+    if not organs:
+        return {"scan_id": scan_id, "prepared": 0}
+
+    scan_dir = get_scan_dir(scan_id)
+    cmd = [
+        BLENDER_BIN,
+        "--background",
+        "--python", str(STL_TO_FBX_SCRIPT),
+        "--",
+        "--prepare",
+        "--stl-dir", str(scan_dir / "stl"),
+        "--prepared-dir", str(scan_dir / PREPARED_DIR_NAME),
+        "--organs", ",".join(organs),
+    ]
+    logger.info("Preparing %d organ(s) for scan %s", len(organs), scan_id)
+
+    started = time.time()
+    try:
+        proc = await asyncio.to_thread(
+            subprocess.run,
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=300,
+        )
+    except subprocess.TimeoutExpired:
+        return {"error": "Organ preparation timed out"}
+
+    if proc.returncode != 0:
+        logger.error("Blender (prepare) stderr:\n%s", proc.stderr[-2000:] if proc.stderr else "(empty)")
+        return {"error": f"Blender exited with code {proc.returncode}"}
+
+    async with metadata_lock(scan_id):
+        await run_io(_record_preparation, scan_id, started, len(organs))
+    return {"scan_id": scan_id, "prepared": len(organs), "organs": organs}
+
+
+def _record_preparation(scan_id: str, started: float, count: int):
+    # Read-modify-write under metadata_lock: STL uploads keep writing metadata meanwhile
+    metadata = load_metadata(scan_id)
+    if metadata is not None:
+        previous = (metadata.get("timeline") or {}).get("blender_prepare", {})
+        timeline.record(
+            metadata, "blender_prepare", started, accumulate=True,
+            organs=previous.get("organs", 0) + count,
+        )
+        save_metadata(scan_id, metadata)
+
+
+async def complete_segmentation(
+    scan_id: str,
+    organs_processed: list[str],
+    organs_failed: Optional[list[str]] = None,
+    worker_timeline: Optional[dict] = None,
+) -> dict:
+    """
+    Record that the segmentation worker has delivered all meshes and queue
+    the FBX assembly.  Returns the post-processing job.
+
+    *worker_timeline* holds the stages the worker measured (download,
+    segmentation, meshing, ...) for the scan's timeline.
+    """
+    from app.services.jobs import job_queue
+
+    async with metadata_lock(scan_id):
+        metadata = await run_io(load_metadata, scan_id)
+        if metadata is not None and metadata.get("status") != "post_processing":
+            metadata["status"] = "segmented"
+            metadata["processing_completed_at"] = datetime.utcnow().isoformat() + "Z"
+            metadata["organs_processed"] = organs_processed
+            if organs_failed:
+                metadata["organs_failed"] = organs_failed
+            timeline.merge_worker(metadata, worker_timeline)
+            metadata.pop("processing_error", None)
+            await save_metadata_async(scan_id, metadata)
+
+    job, _ = await job_queue.submit(scan_id)
+    logger.info("Segmentation of scan %s complete – queued post-processing job %s", scan_id, job["job_id"])
+    return job
+
+
+# ── FBX assembly ─────────────────────────────────────────────────────────
+
 async def run_post_processing(scan_id: str) -> dict:
     """
     Full post-processing pipeline after STL files are available:
@@ -93,65 +244,94 @@ async def run_post_processing(scan_id: str) -> dict:
     2. Call Blender to merge STLs into a single FBX with per-organ materials.
     3. Update scan metadata.
 
+    Every metadata change is a fresh read-modify-write under
+    ``metadata_lock`` touching only the fields set here (status, model
+    files, offset, timeline, processing_error): STL uploads, points and
+    the reconciler keep writing the same document during the Blender run.
+
     Returns a summary dict.
     """
     logger.info("Post-processing started for scan %s", scan_id)
+    started = time.time()
 
-    metadata = load_metadata(scan_id)
-    if not metadata:
+    def mark_started(metadata: dict):
+        metadata["status"] = "post_processing"
+
+    if await update_metadata(scan_id, mark_started) is None:
         logger.error("Metadata not found for scan %s – aborting", scan_id)
         return {"error": "Metadata not found"}
 
-    metadata["status"] = "post_processing"
-    save_metadata(scan_id, metadata)
+    def mark_failed(message: str):
+        def update(metadata: dict):
+            metadata["status"] = "error"
+            metadata["processing_error"] = message
+            timeline.record(metadata, "post_processing", started, failed=True)
+        return update
 
     # Step 1 – validate STL files
+    _progress(scan_id, "validating", "Checking organ meshes")
     try:
-        stl_files = _validate_stl_files(scan_id)
+        stl_files = await run_io(_validate_stl_files, scan_id)
     except ValueError as exc:
         logger.error("STL validation failed for %s: %s", scan_id, exc)
-        metadata["status"] = "error"
-        metadata["processing_error"] = str(exc)
-        save_metadata(scan_id, metadata)
+        await update_metadata(scan_id, mark_failed(str(exc)))
         return {"error": str(exc)}
 
     logger.info("Validated %d STL file(s) for scan %s", len(stl_files), scan_id)
+    _progress(scan_id, "converting", "Building the 3D model", stl_count=len(stl_files))
 
     try:
         fbx_path = await _run_blender(scan_id)
     except Exception as exc:
         logger.exception("Blender conversion failed for scan %s", scan_id)
-        metadata["status"] = "error"
-        metadata["processing_error"] = f"FBX conversion failed: {exc}"
-        save_metadata(scan_id, metadata)
+        await update_metadata(scan_id, mark_failed(f"FBX conversion failed: {exc}"))
         return {"error": str(exc)}
 
-    metadata["status"] = "completed"
-    metadata["has_fbx"] = True
-    metadata["fbx_size"] = fbx_path.stat().st_size
-
+    _progress(scan_id, "finalising", "Saving the model")
     usdz_file = get_scan_dir(scan_id) / "model.usdz"
-    if usdz_file.exists():
-        metadata["has_usdz"] = True
-        metadata["usdz_size"] = usdz_file.stat().st_size
-    else:
-        metadata["has_usdz"] = False
-
-    # Load the centering offset written by Blender so we can transform
-    # annotation points into FBX-model coordinate space later.
-    offset_file = get_scan_dir(scan_id) / "model_offset.json"
-    if offset_file.exists():
-        try:
-            with open(offset_file, "r") as f:
-                offset_data = json.load(f)
-            metadata["fbx_centre_offset"] = offset_data.get("centre_offset", [0, 0, 0])
-            logger.info("Stored FBX centre offset for %s: %s", scan_id, metadata["fbx_centre_offset"])
-        except Exception as exc:
-            logger.warning("Failed to read model_offset.json for %s: %s", scan_id, exc)
-
-    # Clear any stale error from previous failed attempts
-    metadata.pop("processing_error", None)
-    save_metadata(scan_id, metadata)
+
+    def mark_completed(metadata: dict):
+        metadata["status"] = "completed"
+        metadata["has_fbx"] = True
+        metadata["fbx_size"] = fbx_path.stat().st_size
+
+        if usdz_file.exists():
+            metadata["has_usdz"] = True
+            metadata["usdz_size"] = usdz_file.stat().st_size
+        else:
+            metadata["has_usdz"] = False
+            metadata.pop("usdz_size", None)
+
+        # Load the centering offset written by Blender so we can transform
+        # annotation points into FBX-model coordinate space later.
+        offset_file = get_scan_dir(scan_id) / "model_offset.json"
+        if offset_file.exists():
+            try:
+                with open(offset_file, "r") as f:
+                    offset_data = json.load(f)
+                metadata["fbx_centre_offset"] = offset_data.get("centre_offset", [0, 0, 0])
+                logger.info("Stored FBX centre offset for %s: %s", scan_id, metadata["fbx_centre_offset"])
+            except Exception as exc:
+                logger.warning("Failed to read model_offset.json for %s: %s", scan_id, exc)
+
+        _record_blender_timings(scan_id, metadata)
+        timeline.record(
+            metadata, "post_processing", started,
+            nbytes=metadata["fbx_size"] + metadata.get("usdz_size", 0),
+            stl_count=len(stl_files),
+        )
+
+        # Clear any stale error from previous failed attempts
+        metadata.pop("processing_error", None)
+
+    metadata = await update_metadata(scan_id, mark_completed)
+    if metadata is None:
+        logger.error("Metadata of scan %s disappeared during post-processing", scan_id)
+        return {"error": "Metadata not found"}
+
+    # Precompress the models for download (see services.precompress)
+    from app.services.precompress import write_sidecars_many
+    await asyncio.to_thread(write_sidecars_many, [fbx_path, usdz_file])
 
     summary = {
         "scan_id": scan_id,
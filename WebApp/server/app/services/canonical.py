@@ -0,0 +1,160 @@
+"""Canonical CT – one compact int16 NIfTI per scan for the segmentation worker.
+
+Uploads arrive as ZIP'd MetaImage pairs, NRRD, plain or gzipped NIfTI.
+TotalSegmentator only reads NIfTI, so the original file is transcoded once
+at ingest into ``ct_canonical.nii.gz``: int16 voxels, RAS affine, gzip at
+``CANONICAL_GZIP_LEVEL`` (fast – the GPU worker hands the file to
+TotalSegmentator unchanged, so compressing harder only costs ingest time).
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.config import CANONICAL_GZIP_LEVEL, UPLOAD_CHUNK_SIZE
+from app.storage import get_scan_dir
+from app.services.ct_volume import ct_image_path, find_ct_original, load_image
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_CT_NAME = "ct_canonical.nii.gz"
+
+_INT16 = np.iinfo(np.int16)
+
+
+def get_canonical_path(scan_id: str) -> Optional[Path]:
+    """Path of the canonical CT, or ``None`` if it has not been built."""
+    path = get_scan_dir(scan_id) / CANONICAL_CT_NAME
+    return path if path.exists() else None
+
+
+def remove_canonical(scan_id: str):
+    """Drop a stale canonical CT (e.g. before the original is replaced)."""
+    try:
+        os.remove(get_scan_dir(scan_id) / CANONICAL_CT_NAME)
+    except FileNotFoundError:
+        pass
+
+
+def _to_int16(volume: np.ndarray) -> np.ndarray:
+    """Convert HU values to int16, rounding floats and clipping the range."""
+    if volume.dtype == np.int16:
+        return volume
+    if np.can_cast(volume.dtype, np.int16):
+        return volume.astype(np.int16)
+    if np.issubdtype(volume.dtype, np.floating):
+        volume = np.nan_to_num(np.rint(volume), copy=False, nan=_INT16.min)
+        return np.clip(volume, _INT16.min, _INT16.max).astype(np.int16)
+    if np.issubdtype(volume.dtype, np.unsignedinteger):
+        return np.minimum(volume, _INT16.max).astype(np.int16)
+    return np.clip(volume, _INT16.min, _INT16.max).astype(np.int16)
+
+
+def _nifti_is_int16(path: Path) -> bool:
+    """True if *path* is a NIfTI whose stored voxels already are unscaled int16."""
+    import nibabel as nib
+
+    img = nib.load(str(path))
+    slope, inter = img.header.get_slope_inter()
+    return (
+        img.header.get_data_dtype() == np.int16
+        and len(img.shape) == 3
+        and slope in (None, 1.0)
+        and inter in (None, 0.0)
+    )
+
+
+def _write_nifti(volume: np.ndarray, affine: np.ndarray, dst: Path):
+    import nibabel as nib
+    from nibabel.fileholders import FileHolder
+
+    img = nib.Nifti1Image(_to_int16(volume), affine)
+    img.header.set_xyzt_units("mm")
+    img.set_qform(affine, code=1)
+    img.set_sform(affine, code=1)
+    with gzip.open(dst, "wb", compresslevel=CANONICAL_GZIP_LEVEL) as f:
+        holder = FileHolder(fileobj=f)
+        img.to_file_map({"header": holder, "image": holder})
+
+
+def _gzip_copy(src: Path, dst: Path):
+    with open(src, "rb") as fin, gzip.open(dst, "wb", compresslevel=CANONICAL_GZIP_LEVEL) as fout:
+        shutil.copyfileobj(fin, fout, UPLOAD_CHUNK_SIZE)
+
+
+def _link_or_copy(src: Path, dst: Path):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_canonical_ct(scan_id: str) -> dict:
+    """
+    Build ``ct_canonical.nii.gz`` from the scan's original CT.
+
+    Blocking and CPU-heavy – call it off the event loop.  Returns the
+    ``ct_canonical`` metadata entry.
+    """
+    src = find_ct_original(scan_id)
+    scan_dir = get_scan_dir(scan_id)
+    dst = scan_dir / CANONICAL_CT_NAME
+    tmp = scan_dir / f".canonical.{uuid.uuid4().hex}.tmp"
+
+    t0 = time.monotonic()
+    name = src.name.lower()
+    try:
+        if name.endswith(".nii.gz") and _nifti_is_int16(src):
+            # Already what the worker wants – share the bytes
+            _link_or_copy(src, tmp)
+            mode = "linked"
+        elif name.endswith(".nii") and _nifti_is_int16(src):
+            _gzip_copy(src, tmp)
+            mode = "compressed"
+        else:
+            with ct_image_path(src) as load_path:
+                volume, _spacing, _origin, affine = load_image(load_path)
+            _write_nifti(volume, affine, tmp)
+            del volume
+            mode = "transcoded"
+        # The worker verifies its streamed download against this
+        sha256 = _sha256(tmp)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+    elapsed = time.monotonic() - t0
+    size = dst.stat().st_size
+    logger.info(
+        "Canonical CT for %s: %s %s → %s (%.1f MB, %.1fs)",
+        scan_id, mode, src.name, CANONICAL_CT_NAME, size / (1024 * 1024), elapsed,
+    )
+    return {
+        "filename": CANONICAL_CT_NAME,
+        "size": size,
+        "sha256": sha256,
+        "dtype": "int16",
+        "compression": f"gzip-{CANONICAL_GZIP_LEVEL}",
+        "mode": mode,
+        "source": src.name,
+        "seconds": round(elapsed, 2),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+    }
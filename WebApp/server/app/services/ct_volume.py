@@ -0,0 +1,232 @@
+"""CT volume loading – shared by the slice viewer and the ingest transcoder.
+
+Volumes are returned as NumPy arrays in (x, y, z) order together with
+spacing / origin in the file's own world frame and a 4×4 RAS affine
+(the frame NIfTI uses, identical to what SimpleITK writes on conversion).
+"""
+
+import logging
+import tempfile
+import zipfile
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.storage import get_scan_dir
+
+logger = logging.getLogger(__name__)
+
+# ITK / MetaImage / NRRD world coordinates are LPS, NIfTI is RAS
+LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+_MHD_DTYPE_MAP = {
+    "MET_SHORT": np.int16,
+    "MET_USHORT": np.uint16,
+    "MET_INT": np.int32,
+    "MET_UINT": np.uint32,
+    "MET_FLOAT": np.float32,
+    "MET_DOUBLE": np.float64,
+    "MET_UCHAR": np.uint8,
+    "MET_CHAR": np.int8,
+}
+
+
+def lps_affine_to_ras(spacing, origin, direction=None) -> np.ndarray:
+    """
+    Build the RAS voxel→world affine for an LPS image.
+
+    *direction* is the 3×3 ITK direction matrix (columns = axis directions);
+    identity if omitted.
+    """
+    direction = np.eye(3) if direction is None else np.asarray(direction, dtype=float).reshape(3, 3)
+    affine = np.eye(4)
+    affine[:3, :3] = direction * np.asarray(spacing, dtype=float)[:3]
+    affine[:3, 3] = np.asarray(origin, dtype=float)[:3]
+    return LPS_TO_RAS @ affine
+
+
+# ---------------------------------------------------------------------------
+# Loaders
+# ---------------------------------------------------------------------------
+
+
+def load_mhd(mhd_path: Path) -> tuple[np.ndarray, tuple, tuple, np.ndarray]:
+    """Load a MetaImage (.mhd + .raw/.zraw) file pair."""
+    meta: dict[str, str] = {}
+    with open(mhd_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if "=" in line:
+                key, value = line.split("=", 1)
+                meta[key.strip()] = value.strip()
+
+    dims = tuple(int(x) for x in meta["DimSize"].split())
+    spacing = tuple(float(x) for x in meta.get("ElementSpacing", "1 1 1").split())
+    origin = tuple(float(x) for x in meta.get("Offset", "0 0 0").split())
+    dtype = _MHD_DTYPE_MAP.get(meta.get("ElementType", "MET_SHORT"), np.int16)
+
+    # MetaIO stores the direction cosines axis by axis (ITK reads each
+    # consecutive triple as one column of the direction matrix).
+    direction = None
+    if "TransformMatrix" in meta:
+        values = [float(x) for x in meta["TransformMatrix"].split()]
+        if len(values) == 9:
+            direction = np.array(values).reshape(3, 3).T
+
+    data_file = meta.get("ElementDataFile", "")
+    data_path = mhd_path.parent / data_file
+    if not data_path.exists():
+        raise FileNotFoundError(f"Raw data file not found: {data_path}")
+
+    logger.info("Reading raw data from %s …", data_path.name)
+    with open(data_path, "rb") as f:
+        raw_bytes = f.read()
+
+    compressed = meta.get("CompressedData", "False").lower() in ("true", "1", "yes")
+    if compressed:
+        logger.info("Decompressing zlib data (%d bytes compressed) …", len(raw_bytes))
+        raw_bytes = zlib.decompress(raw_bytes)
+
+    total_voxels = dims[0] * dims[1] * dims[2]
+    expected = total_voxels * np.dtype(dtype).itemsize
+    if len(raw_bytes) < expected:
+        raise ValueError(
+            f"Data file too small: got {len(raw_bytes)} bytes, expected {expected}"
+        )
+
+    volume = np.frombuffer(raw_bytes, dtype=dtype, count=total_voxels)
+    # MHD stores x-fastest (column-major). In C-order that is (z, y, x).
+    volume = volume.reshape((dims[2], dims[1], dims[0]))
+    volume = np.transpose(volume, (2, 1, 0))  # → (x, y, z)
+
+    return volume, spacing, origin, lps_affine_to_ras(spacing, origin, direction)
+
+
+def load_nifti(nii_path: Path) -> tuple[np.ndarray, tuple, tuple, np.ndarray]:
+    """Load a NIfTI (`.nii` or `.nii.gz`) file."""
+    import nibabel as nib
+
+    img = nib.load(str(nii_path))
+    data = np.asarray(img.dataobj)
+    # Keep a reasonable dtype
+    if data.dtype == np.float64:
+        data = data.astype(np.float32)
+    spacing = tuple(float(s) for s in img.header.get_zooms()[:3])
+    origin = tuple(float(o) for o in img.affine[:3, 3])
+    return data, spacing, origin, np.asarray(img.affine, dtype=float)
+
+
+def load_with_sitk(path: Path) -> tuple[np.ndarray, tuple, tuple, np.ndarray]:
+    """Last-resort loader (NRRD etc.) via SimpleITK, if installed."""
+    import SimpleITK as sitk
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(str(path))
+    img = reader.Execute()
+    spacing = img.GetSpacing()
+    origin = img.GetOrigin()
+    direction = np.array(img.GetDirection()).reshape(3, 3)
+    arr = sitk.GetArrayFromImage(img)
+    del img
+    volume = np.transpose(arr, (2, 1, 0))
+    return volume, spacing, origin, lps_affine_to_ras(spacing, origin, direction)
+
+
+# ---------------------------------------------------------------------------
+# Locating the CT image of a scan
+# ---------------------------------------------------------------------------
+
+
+def find_ct_original(scan_id: str) -> Path:
+    """Return the path of the uploaded CT file (``ct_original_*``)."""
+    ct_files = list(get_scan_dir(scan_id).glob("ct_original_*"))
+    if not ct_files:
+        raise HTTPException(status_code=404, detail="No CT file found for this scan")
+    return ct_files[0]
+
+
+@contextmanager
+def ct_image_path(ct_path: Path) -> Iterator[Path]:
+    """
+    Yield the path of the image file to load for *ct_path*.
+
+    ZIP archives are extracted into a temporary directory that is removed
+    when the context exits.
+    """
+    temp_dir: Optional[tempfile.TemporaryDirectory] = None
+    try:
+        load_path = ct_path
+
+        if ct_path.suffix.lower() == ".zip":
+            temp_dir = tempfile.TemporaryDirectory()
+            logger.info("Extracting ZIP %s …", ct_path.name)
+            with zipfile.ZipFile(ct_path, "r") as z:
+                z.extractall(temp_dir.name)
+
+            candidates = [
+                f
+                for f in Path(temp_dir.name).rglob("*")
+                if f.suffix.lower() in (".nii", ".gz", ".mhd", ".nrrd")
+            ]
+            if not candidates:
+                from app.services.dicom import find_dicom_files
+
+                if find_dicom_files(Path(temp_dir.name)):
+                    # DICOM series – the whole extracted folder is the image
+                    yield Path(temp_dir.name)
+                    return
+                raise HTTPException(
+                    status_code=422,
+                    detail="No supported image file (.nii, .mhd, .nrrd, DICOM) in ZIP",
+                )
+            mhds = [f for f in candidates if f.suffix.lower() == ".mhd"]
+            niftis = [f for f in candidates if ".nii" in f.name.lower()]
+            load_path = (mhds or niftis or candidates)[0]
+
+        yield load_path
+    finally:
+        if temp_dir:
+            temp_dir.cleanup()
+
+
+def load_image(load_path: Path) -> tuple[np.ndarray, tuple, tuple, np.ndarray]:
+    """Dispatch to the right loader by extension (a directory is a DICOM series)."""
+    ext = load_path.suffix.lower()
+    name_lower = load_path.name.lower()
+
+    if load_path.is_dir():
+        from app.services.dicom import load_dicom_series
+
+        return load_dicom_series(load_path)
+    if ext == ".mhd":
+        return load_mhd(load_path)
+    if ".nii" in name_lower:
+        return load_nifti(load_path)
+    try:
+        return load_with_sitk(load_path)
+    except ImportError:
+        logger.error("SimpleITK is not installed – cannot read %s (NRRD needs it)", load_path.name)
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unsupported format '{ext}'. Supported: .mhd, .nii, .nii.gz, .zip (incl. DICOM)",
+        )
+
+
+def load_ct_volume(scan_id: str) -> dict:
+    """Locate the CT file for *scan_id*, load and return volume+meta dict."""
+    with ct_image_path(find_ct_original(scan_id)) as load_path:
+        volume, spacing, origin, affine = load_image(load_path)
+
+    return {
+        "volume": volume,
+        "spacing": tuple(float(s) for s in spacing),
+        "origin": tuple(float(o) for o in origin),
+        "affine": affine,
+        "dimensions": (int(volume.shape[0]), int(volume.shape[1]), int(volume.shape[2])),
+        "min_value": float(np.nanmin(volume)),
+        "max_value": float(np.nanmax(volume)),
+    }
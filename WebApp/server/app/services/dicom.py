@@ -0,0 +1,243 @@
+"""DICOM series ingest – a zipped folder of slices becomes one CT volume.
+
+Slice headers are read first (no pixel data) to pick the series, order the
+slices along the slice normal and derive spacing / origin / direction.
+Pixel data is then decoded in a process pool – decompressing JPEG / RLE
+slices is CPU-bound and parallelises per slice – and stacked into an int16
+HU volume in (x, y, z) order, the same layout the other loaders return.
+
+Needs ``pydicom`` (plus ``pylibjpeg`` / ``gdcm`` for compressed transfer
+syntaxes).
+"""
+
+import logging
+import math
+import multiprocessing
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from app.config import DICOM_DECODE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_INT16 = np.iinfo(np.int16)
+
+# Below this many slices the pool start-up / IPC costs more than it saves
+_MIN_PARALLEL_SLICES = 32
+
+_decode_pools: dict[int, ProcessPoolExecutor] = {}
+
+
+class DicomSeriesError(ValueError):
+    """Raised when a set of files does not form a usable CT series."""
+
+
+def has_dicom_preamble(head: bytes) -> bool:
+    """True if *head* (the first 132 bytes of a file) is a DICOM Part 10 file."""
+    return len(head) >= 132 and head[128:132] == b"DICM"
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool shared by all decodes (spawned once per size, lazily)."""
+    pool = _decode_pools.get(workers)
+    if pool is None:
+        # spawn, not fork – the server process runs threads
+        pool = _decode_pools[workers] = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return pool
+
+
+# ── Series geometry ──────────────────────────────────────────────────────
+
+def plan_series(headers: list[tuple[Any, Any]]) -> dict:
+    """
+    Choose the series and slice order from ``(key, dataset)`` pairs.
+
+    Datasets only need their headers.  Returns a plan with the ordered
+    ``keys`` plus ``dimensions``, ``spacing``, ``origin`` (LPS, of the
+    first slice), 3×3 ``direction`` (columns = x, y, slice axes), ``dtype``
+    and ``warnings``.
+    """
+    images = [(k, ds) for k, ds in headers if "Rows" in ds and "Columns" in ds]
+    if not images:
+        raise DicomSeriesError("No DICOM images found")
+
+    warnings: list[str] = []
+    series: dict[str, list] = {}
+    for key, ds in images:
+        series.setdefault(str(ds.get("SeriesInstanceUID", "")), []).append((key, ds))
+    uid, slices = max(series.items(), key=lambda item: len(item[1]))
+    if len(series) > 1:
+        warnings.append(
+            f"{len(series)} DICOM series found – using the largest ({len(slices)} slices)"
+        )
+
+    first = slices[0][1]
+    rows, cols = int(first.Rows), int(first.Columns)
+    mismatched = [k for k, ds in slices if (int(ds.Rows), int(ds.Columns)) != (rows, cols)]
+    if mismatched:
+        raise DicomSeriesError(f"{len(mismatched)} slices differ in size from {cols}×{rows}")
+
+    pixel_spacing = [float(v) for v in first.get("PixelSpacing", [1.0, 1.0])]
+    orientation = first.get("ImageOrientationPatient")
+    if orientation is not None and all("ImagePositionPatient" in ds for _, ds in slices):
+        iop = np.array([float(v) for v in orientation])
+        row_dir, col_dir = iop[:3], iop[3:]
+        normal = np.cross(row_dir, col_dir)
+        positions = {k: np.array([float(v) for v in ds.ImagePositionPatient]) for k, ds in slices}
+        slices.sort(key=lambda item: float(positions[item[0]] @ normal))
+        distances = np.array([positions[k] @ normal for k, _ in slices])
+        origin = positions[slices[0][0]].tolist()
+    else:
+        warnings.append("Slices lack position/orientation – ordered by InstanceNumber")
+        row_dir, col_dir, normal = np.eye(3)
+        slices.sort(key=lambda item: int(item[1].get("InstanceNumber", 0) or 0))
+        distances = np.array([])
+        origin = [0.0, 0.0, 0.0]
+
+    gaps = np.diff(distances)
+    if gaps.size:
+        slice_spacing = float(np.median(gaps))
+        if np.any(gaps <= 1e-6):
+            raise DicomSeriesError("Series contains slices at duplicate positions")
+        if np.ptp(gaps) > 0.01 * abs(slice_spacing):
+            warnings.append(
+                f"Uneven slice spacing ({gaps.min():.3f}–{gaps.max():.3f} mm) – using the median"
+            )
+    else:
+        slice_spacing = float(first.get("SpacingBetweenSlices", 0) or first.get("SliceThickness", 1) or 1)
+
+    signed = int(first.get("PixelRepresentation", 0)) == 1
+    bits = int(first.get("BitsAllocated", 16))
+    return {
+        "series_uid": uid,
+        "keys": [k for k, _ in slices],
+        "dimensions": [cols, rows, len(slices)],
+        "spacing": [pixel_spacing[1], pixel_spacing[0], slice_spacing],
+        "origin": origin,
+        "direction": np.column_stack([row_dir, col_dir, normal]),
+        "dtype": f"{'int' if signed else 'uint'}{bits}",
+        "warnings": warnings,
+    }
+
+
+# ── Pixel decoding ───────────────────────────────────────────────────────
+
+def _to_hu(ds) -> np.ndarray:
+    """Decode one slice and apply the rescale to int16 HU."""
+    pixels = ds.pixel_array
+    slope = float(ds.get("RescaleSlope", 1) or 1)
+    intercept = float(ds.get("RescaleIntercept", 0) or 0)
+    if slope == 1 and intercept.is_integer():
+        hu = pixels.astype(np.int32) + int(intercept)
+    else:
+        hu = np.rint(pixels * slope + intercept)
+    return np.clip(hu, _INT16.min, _INT16.max).astype(np.int16)
+
+
+def decode_slices(paths: list[str]) -> np.ndarray:
+    """Decode a batch of slice files to an int16 ``(n, rows, cols)`` stack."""
+    import pydicom
+
+    return np.stack([_to_hu(pydicom.dcmread(p)) for p in paths])
+
+
+def decode_series(paths: list[str], workers: Optional[int] = None) -> np.ndarray:
+    """
+    Decode *paths* (already in slice order) to an int16 ``(n, rows, cols)``
+    stack, spreading batches of slices over the process pool.
+    """
+    workers = DICOM_DECODE_WORKERS if workers is None else workers
+    if workers <= 1 or len(paths) < _MIN_PARALLEL_SLICES:
+        return decode_slices(paths)
+
+    # A few batches per worker keeps the pool busy without per-slice IPC
+    batch = max(1, math.ceil(len(paths) / (workers * 4)))
+    batches = [paths[i:i + batch] for i in range(0, len(paths), batch)]
+    stack = None
+    pos = 0
+    for block in _get_pool(workers).map(decode_slices, batches):
+        if stack is None:
+            stack = np.empty((len(paths), *block.shape[1:]), dtype=np.int16)
+        stack[pos:pos + len(block)] = block
+        pos += len(block)
+    return stack
+
+
+# ── Entry points ─────────────────────────────────────────────────────────
+
+def find_dicom_files(directory: Path) -> list[Path]:
+    """All DICOM Part 10 files below *directory*."""
+    found = []
+    for path in sorted(directory.rglob("*")):
+        if not path.is_file() or "__MACOSX" in path.parts:
+            continue
+        with open(path, "rb") as f:
+            if has_dicom_preamble(f.read(132)):
+                found.append(path)
+    return found
+
+
+def load_dicom_series(
+    directory: Path, workers: Optional[int] = None
+) -> tuple[np.ndarray, tuple, tuple, np.ndarray]:
+    """
+    Load the DICOM series below *directory*.
+
+    Returns ``(volume, spacing, origin, affine_ras)`` like the other loaders
+    in ``ct_volume``; spacing / origin are in the DICOM (LPS) frame.
+    """
+    import pydicom
+
+    from app.services.ct_volume import lps_affine_to_ras
+
+    files = find_dicom_files(directory)
+    headers = [(str(p), pydicom.dcmread(p, stop_before_pixels=True)) for p in files]
+    plan = plan_series(headers)
+    for warning in plan["warnings"]:
+        logger.warning("DICOM %s: %s", directory.name, warning)
+
+    stack = decode_series(plan["keys"], workers)
+    volume = np.transpose(stack, (2, 1, 0))  # (slice, row, col) → (x, y, z)
+    spacing = tuple(plan["spacing"])
+    origin = tuple(plan["origin"])
+    return volume, spacing, origin, lps_affine_to_ras(spacing, origin, plan["direction"])
+
+
+def sniff_dicom_zip(zf, names: list[str]) -> Optional[dict]:
+    """
+    Header-only inspection of a ZIP that may hold a DICOM series.
+
+    Returns a ``ct_header``-style dict, or ``None`` if the archive contains
+    no DICOM files.
+    """
+    members = []
+    for name in names:
+        with zf.open(name) as f:
+            if has_dicom_preamble(f.read(132)):
+                members.append(name)
+    if not members:
+        return None
+
+    import pydicom
+
+    headers = []
+    for name in members:
+        with zf.open(name) as f:
+            headers.append((name, pydicom.dcmread(f, stop_before_pixels=True)))
+    plan = plan_series(headers)
+    return {
+        "format": "dicom",
+        "inner_file": posixpath.dirname(plan["keys"][0]) or ".",
+        "dimensions": plan["dimensions"],
+        "spacing": plan["spacing"],
+        "origin": plan["origin"],
+        "dtype": plan["dtype"],
+        "warnings": plan["warnings"],
+    }
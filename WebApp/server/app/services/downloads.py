@@ -0,0 +1,201 @@
+"""Cache-aware file downloads – ETag / Last-Modified, 304 and Range / 206.
+
+Every large artefact (FBX, USDZ, CT, STL) is served through
+``file_download`` so that clients only transfer what changed or what is
+missing:
+
+* ``ETag`` is a strong validator derived from the file's version – inode,
+  modification time (ns) and size.  All writers either replace files
+  atomically or rewrite them, so any content change yields a new tag.
+* ``If-None-Match`` (or, without it, ``If-Modified-Since``) → 304.
+* Precompressed sidecars (see ``precompress``) are chosen from
+  ``Accept-Encoding`` and sent with ``Content-Encoding``; each encoding
+  is its own representation with its own ETag and byte ranges.
+* A single ``Range: bytes=…`` → 206 with ``Content-Range``; an
+  unsatisfiable range → 416.  ``If-Range`` falls back to the full body when
+  the file changed.  Multi-range requests get the full file (RFC 9110
+  allows ignoring ``Range``).
+"""
+
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.services.precompress import available_encodings, fresh_sidecar
+from app.storage import run_io
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def make_etag(st: os.stat_result, encoding: Optional[str] = None) -> str:
+    """Strong ETag for the file version described by *st* (and its encoding)."""
+    suffix = f"-{encoding}" if encoding else ""
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}{suffix}"'
+
+
+def _accepted_encodings(header: str) -> list[str]:
+    """Sidecar encodings acceptable per ``Accept-Encoding``, best first."""
+    weights: dict[str, float] = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding.strip().lower()] = q
+    wildcard = weights.get("*", 0.0)
+    ranked = [
+        (weights.get(enc, wildcard), -i, enc)
+        for i, enc in enumerate(available_encodings())
+    ]
+    return [enc for q, _, enc in sorted(ranked, reverse=True) if q > 0]
+
+
+def _select_representation(request: Request, path: Path, st: os.stat_result):
+    """Pick the sidecar to send: ``(path, stat, encoding or None)``."""
+    header = request.headers.get("accept-encoding")
+    if header:
+        for encoding in _accepted_encodings(header):
+            sidecar = fresh_sidecar(path, st, encoding)
+            if sidecar is not None:
+                return sidecar[0], sidecar[1], encoding
+    return path, st, None
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """Compare an ``If-None-Match`` / ``If-Range`` list against *etag*."""
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag, weak=True)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a single ``bytes=`` range into inclusive ``(start, end)``.
+
+    Returns ``None`` when the header should be ignored (malformed, other
+    unit, several ranges) and raises ``ValueError`` if it is unsatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first or last) or not all(p == "" or p.isdigit() for p in (first, last)):
+        return None
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("empty suffix range")
+        start, end = max(0, size - suffix), size - 1
+    if start >= size:
+        raise ValueError("range starts beyond end of file")
+    return start, end
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+async def _send_file(path: Path, start: int, length: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def file_download(
+    request: Request,
+    path: Path,
+    filename: str,
+    media_type: str,
+) -> Response:
+    """Serve *path* with validators, conditional GET and byte-range support."""
+    st = await run_io(os.stat, path)
+    body_path, body_st, encoding = await run_io(_select_representation, request, path, st)
+    size = body_st.st_size
+    etag = make_etag(st, encoding)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        # Always revalidate – cheap with the ETag, and never serves a stale model
+        "Cache-Control": "no-cache",
+        "Content-Disposition": _content_disposition(filename),
+        "Vary": "Accept-Encoding",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header:
+        if_range = request.headers.get("if-range")
+        if if_range is None or _etag_matches(if_range, etag, weak=False) or if_range == headers["Last-Modified"]:
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                return Response(
+                    status_code=416,
+                    headers={**headers, "Content-Range": f"bytes */{size}"},
+                )
+
+    if byte_range is None:
+        start, length, status = 0, size, 200
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+
+    return StreamingResponse(
+        _send_file(body_path, start, length),
+        status_code=status,
+        media_type=media_type,
+        headers=headers,
+    )
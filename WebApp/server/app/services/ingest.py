@@ -0,0 +1,228 @@
+"""Ingest helpers – turn a fully received upload into a scan."""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from app.config import API_BASE_URL, DEFAULT_ORGANS, INGEST_WORKERS
+from app.services import timeline
+from app.storage import load_metadata, metadata_lock, run_io, save_metadata_async
+
+logger = logging.getLogger(__name__)
+
+# Ingest jobs have their own workers (see services.jobs); the priority
+# orders them among themselves only
+INGEST_PRIORITY = 10
+
+# The CPU-heavy transcode runs here, not on the upload I/O pool (``run_io``)
+_ingest_executor = ThreadPoolExecutor(max_workers=max(1, INGEST_WORKERS), thread_name_prefix="ar4ct-ingest")
+
+
+def ingest_target(scan_dir: Path, original_filename: str) -> tuple[Path, str]:
+    """
+    Decide where an uploaded file lives inside *scan_dir*.
+
+    FBX uploads become the finished model; everything else is stored as
+    the original CT.  Returns ``(path, initial_status)``.
+    """
+    if original_filename.lower().endswith(".fbx"):
+        return scan_dir / "model.fbx", "completed"
+    return scan_dir / f"ct_original_{original_filename}", "uploaded"
+
+
+def new_scan_metadata(
+    scan_id: str,
+    original_filename: str,
+    file_size: int,
+    status: str,
+) -> dict:
+    """Build the initial metadata dict for a freshly uploaded scan."""
+    return {
+        "scan_id": scan_id,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "original_filename": original_filename,
+        "file_size": file_size,
+        "status": status,
+        "point": None,
+        "has_fbx": original_filename.lower().endswith(".fbx"),
+    }
+
+
+async def prepare_canonical(scan_id: str, metadata: dict) -> None:
+    """
+    Transcode the uploaded CT into the canonical worker format and record
+    it as ``ct_canonical``.
+
+    Decoding a large volume takes seconds to minutes – call this from an
+    ``ingest`` job (``schedule_ingest``), not from a request handler.
+    Failures are logged; the worker then gets the original.  The result is
+    saved into the current metadata under ``metadata_lock`` and *metadata*
+    is refreshed from it.
+    """
+    from app.services.canonical import build_canonical_ct
+
+    started = time.time()
+    try:
+        loop = asyncio.get_running_loop()
+        canonical = await loop.run_in_executor(_ingest_executor, build_canonical_ct, scan_id)
+    except Exception:
+        logger.exception("Failed to build canonical CT for scan %s", scan_id)
+        canonical = None
+
+    async with metadata_lock(scan_id):
+        current = await run_io(load_metadata, scan_id)
+        if current is None:
+            return
+        if canonical:
+            timeline.record(current, "ingest", started, nbytes=canonical["size"], mode=canonical["mode"])
+            current["ct_canonical"] = canonical
+        else:
+            timeline.record(current, "ingest", started, failed=True)
+            current.pop("ct_canonical", None)
+        await save_metadata_async(scan_id, current)
+    metadata.clear()
+    metadata.update(current)
+
+
+async def run_ingest(scan_id: str, submit: bool = False) -> dict:
+    """
+    Job runner for ``ingest`` jobs: build the canonical CT, then – with
+    *submit*, and only if the scan is still ``uploaded`` – submit it to
+    RunPod.
+    """
+    metadata = await run_io(load_metadata, scan_id)
+    if not metadata:
+        return {"error": "Scan not found"}
+    await prepare_canonical(scan_id, metadata)
+    status = metadata.get("status")
+    # Only a scan still "uploaded" – someone may have started processing
+    # while the CT was transcoded.  Failures leave it "uploaded" for /process.
+    if submit:
+        result = await submit_segmentation(scan_id, ("uploaded",))
+        if result and "error" in result:
+            logger.warning("Auto-submission of scan %s to RunPod failed: %s", scan_id, result["error"])
+        elif result:
+            status = "processing"
+    return {"canonical": "ct_canonical" in metadata, "status": status}
+
+
+async def schedule_ingest(scan_id: str, submit: bool = False) -> dict:
+    """Queue an ``ingest`` job for *scan_id* (see ``run_ingest``) and return it."""
+    from app.services.jobs import job_queue
+
+    options = {"submit": True} if submit else None
+    job, _ = await job_queue.submit(scan_id, INGEST_PRIORITY, kind="ingest", options=options)
+    return job
+
+
+def ct_download_url(scan_id: str) -> str:
+    """URL the segmentation worker downloads the CT from."""
+    from app.services.canonical import get_canonical_path
+
+    if get_canonical_path(scan_id):
+        return f"{API_BASE_URL}/scans/{scan_id}/ct/canonical"
+    return f"{API_BASE_URL}/scans/{scan_id}/ct"
+
+
+def ct_download_sha256(scan_id: str, metadata: dict) -> Optional[str]:
+    """SHA-256 of the file behind ``ct_download_url`` if known (the worker verifies it)."""
+    from app.services.canonical import get_canonical_path
+
+    if get_canonical_path(scan_id):
+        return (metadata.get("ct_canonical") or {}).get("sha256")
+    return None
+
+
+# Statuses a scan may be submitted to RunPod from
+SUBMITTABLE_STATES = ("uploaded", "error")
+# A "submitting" claim older than this was left behind by a crashed server
+_SUBMIT_CLAIM_TIMEOUT = 600
+
+
+async def _claim_submission(scan_id: str, statuses: tuple) -> Optional[str]:
+    """Mark the scan ``submitting``; returns its previous status, or None if it is not in *statuses*."""
+    async with metadata_lock(scan_id):
+        metadata = await run_io(load_metadata, scan_id)
+        if not metadata:
+            return None
+        status = metadata.get("status")
+        stale = status == "submitting" and time.time() - metadata.get("submitting_since", 0) > _SUBMIT_CLAIM_TIMEOUT
+        if status not in statuses and not stale:
+            return None
+        metadata["status"] = "submitting"
+        metadata["submitting_since"] = time.time()
+        await save_metadata_async(scan_id, metadata)
+    return "uploaded" if stale else status
+
+
+async def submit_segmentation(scan_id: str, statuses: tuple = SUBMITTABLE_STATES) -> Optional[dict]:
+    """
+    Submit the scan's CT to RunPod – once, however many requests and
+    ingest jobs ask at the same time.
+
+    The submission is claimed under ``metadata_lock`` (status
+    ``submitting``) before RunPod is called.  Returns RunPod's result
+    (``{"job_id": …}`` or ``{"error": …}``), or ``None`` when the scan is
+    not in *statuses* – already submitting or further along.  After an
+    error the scan goes back to its previous status.
+    """
+    from app.services.runpod import submit_segmentation_job
+
+    previous = await _claim_submission(scan_id, statuses)
+    if previous is None:
+        return None
+    try:
+        metadata = await run_io(load_metadata, scan_id) or {}
+        result = await submit_segmentation_job(
+            file_url=ct_download_url(scan_id),
+            organs=DEFAULT_ORGANS,
+            callback_url=f"{API_BASE_URL}/scans/{scan_id}",
+            file_sha256=ct_download_sha256(scan_id, metadata),
+        )
+    except Exception as exc:
+        logger.exception("Failed to submit scan %s to RunPod", scan_id)
+        result = {"error": str(exc)}
+
+    async with metadata_lock(scan_id):
+        metadata = await run_io(load_metadata, scan_id)
+        # A reset meanwhile owns the status
+        if metadata is not None and metadata.get("status") == "submitting":
+            metadata.pop("submitting_since", None)
+            if "job_id" in result:
+                metadata["status"] = "processing"
+                metadata["runpod_job_id"] = result["job_id"]
+                metadata["processing_started_at"] = datetime.utcnow().isoformat() + "Z"
+                metadata.pop("processing_completed_at", None)  # a retry after an error
+            else:
+                metadata["status"] = previous
+            await save_metadata_async(scan_id, metadata)
+    return result
+
+
+def upload_response(scan_id: str, metadata: dict, status: str, ingest_job: Optional[dict] = None) -> dict:
+    """
+    Response body shared by the single-shot and resumable upload routes.
+    ``status`` is the status the file was stored with; *ingest_job* the
+    queued ``ingest`` job that prepares and submits the CT.
+    """
+    body = {
+        "scan_id": scan_id,
+        "filename": metadata["original_filename"],
+        "size": metadata["file_size"],
+        "status": status,
+        "has_fbx": metadata["has_fbx"],
+        "message": (
+            "FBX uploaded successfully"
+            if metadata["has_fbx"]
+            else "CT scan uploaded – segmentation is submitted once the CT is prepared"
+            if ingest_job
+            else "CT scan uploaded"
+        ),
+    }
+    if ingest_job:
+        body["ingest_job_id"] = ingest_job["job_id"]
+    return body
@@ -0,0 +1,349 @@
+"""Post-processing job queue – bounded, prioritised, persistent.
+
+``POST /scans/{id}/postprocess`` only enqueues a job and returns its id;
+``POSTPROCESS_WORKERS`` asyncio workers run one Blender job at a time
+each, so at most that many Blender processes exist at once.  Ingest jobs
+have ``INGEST_WORKERS`` workers of their own, so a fresh upload never
+waits behind another scan's Blender run.  Three kinds of job:
+
+* ``post_processing`` – ``run_post_processing``, the FBX assembly.
+* ``prepare`` – ``run_preparation``, per-organ mesh preparation queued as
+  STLs arrive, so the assembly finds most organs already prepared.
+* ``ingest`` – ``run_ingest``, the canonical CT transcode of a fresh
+  upload (and its RunPod submission), so upload requests return as soon
+  as the original is stored.
+
+* Higher ``priority`` runs first; equal priorities run in submission order.
+* One active job per scan and kind: a second trigger while a job is
+  queued or running returns that job (and may raise its priority).  A
+  ``prepare`` trigger while one runs queues another, since new organs
+  may have arrived; queued ``prepare`` jobs are skipped once the scan's
+  assembly starts.
+* A scan's ``prepare`` and ``post_processing`` jobs never run at the same
+  time (with several workers): whichever starts second waits for the
+  other to finish.
+* Every job is a JSON file in ``JOBS_DIR``.  On start-up queued jobs are
+  re-queued and jobs that were running when the server stopped are run
+  again; finished jobs are kept for ``JOB_RETENTION`` seconds.
+* ETAs come from the mean duration of recent jobs.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from app.config import INGEST_WORKERS, JOB_RETENTION, JOBS_DIR, POSTPROCESS_WORKERS
+from app.events import bus
+from app.storage import run_io
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = ("queued", "running")
+
+JOB_KINDS = ("post_processing", "prepare", "ingest")
+
+# Worker pool of each kind; each pool has its own queue and workers
+_POOLS = {"blender": ("post_processing", "prepare"), "ingest": ("ingest",)}
+_POOL_OF = {kind: pool for pool, kinds in _POOLS.items() for kind in kinds}
+
+# Assumed job duration until a few jobs have finished
+_DEFAULT_DURATION = {"post_processing": 120.0, "prepare": 60.0, "ingest": 30.0}
+_DURATION_SAMPLES = 20
+
+# Kinds that write the scan's prepared meshes
+_MESH_KINDS = ("post_processing", "prepare")
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _job_path(job_id: str):
+    return JOBS_DIR / f"{job_id}.json"
+
+
+def _save_job(job: dict):
+    path = _job_path(job["job_id"])
+    tmp_path = path.with_name(f".{job['job_id']}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _load_jobs() -> list[dict]:
+    jobs = []
+    for path in JOBS_DIR.glob("*.json"):
+        try:
+            with open(path, "r") as f:
+                jobs.append(json.load(f))
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable job file %s", path.name)
+    return jobs
+
+
+class JobQueue:
+    def __init__(self, workers: int = POSTPROCESS_WORKERS, ingest_workers: int = INGEST_WORKERS):
+        self.workers = max(1, workers)
+        self.ingest_workers = max(1, ingest_workers)
+        self._pool_size = {"blender": self.workers, "ingest": self.ingest_workers}
+        self._jobs: dict[str, dict] = {}
+        self._active: dict[tuple[str, str], str] = {}  # (scan_id, kind) → job_id
+        # Per pool: (-priority, seq, job_id)
+        self._heaps: dict[str, list[tuple[int, int, str]]] = {pool: [] for pool in _POOLS}
+        self._seq = itertools.count()
+        self._started_at: dict[str, float] = {}  # job_id → monotonic start
+        self._durations: dict[str, list[float]] = {kind: [] for kind in JOB_KINDS}
+        self._mesh_locks: dict[str, asyncio.Lock] = {}  # scan_id → held by its running mesh job
+        self._wakeup: dict[str, asyncio.Condition] = {}
+        self._ready: Optional[asyncio.Future] = None
+        self._tasks: list[asyncio.Task] = []
+
+    # ── Lifecycle ────────────────────────────────────────────────────────
+
+    async def start(self):
+        """Load persisted jobs and start the workers (idempotent)."""
+        if self._ready is None:
+            self._ready = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._ready)
+
+    async def _start(self):
+        self._wakeup = {pool: asyncio.Condition() for pool in _POOLS}
+        jobs = await run_io(_load_jobs)
+        cutoff = time.time() - JOB_RETENTION
+        for job in sorted(jobs, key=lambda j: j["created_at"]):
+            if job["status"] in ACTIVE_STATES:
+                if job["status"] == "running":
+                    logger.warning("Re-queuing job %s interrupted by a restart", job["job_id"])
+                job["status"] = "queued"
+                job.pop("started_at", None)
+                self._add(job)
+                await run_io(_save_job, job)
+            elif job.get("finished_ts", 0) < cutoff:
+                await run_io(_job_path(job["job_id"]).unlink, missing_ok=True)
+            else:
+                self._jobs[job["job_id"]] = job
+                if job.get("duration") and job["status"] == "completed":
+                    self._durations[job["type"]].append(job["duration"])
+        for kind, samples in self._durations.items():
+            self._durations[kind] = samples[-_DURATION_SAMPLES:]
+
+        self._tasks = [
+            asyncio.create_task(self._worker(i, pool), name=f"{pool}-{i}")
+            for pool, size in self._pool_size.items()
+            for i in range(size)
+        ]
+        logger.info(
+            "Job queue started: %d Blender / %d ingest worker(s), %d queued job(s)",
+            self.workers, self.ingest_workers, sum(len(heap) for heap in self._heaps.values()),
+        )
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._ready = None
+
+    # ── Submitting / querying ────────────────────────────────────────────
+
+    def _add(self, job: dict):
+        self._jobs[job["job_id"]] = job
+        self._active[job["scan_id"], job["type"]] = job["job_id"]
+        heapq.heappush(self._heaps[_POOL_OF[job["type"]]], (-job["priority"], next(self._seq), job["job_id"]))
+
+    async def submit(
+        self, scan_id: str, priority: int = 0, kind: str = "post_processing",
+        options: Optional[dict] = None,
+    ) -> tuple[dict, bool]:
+        """
+        Enqueue a *kind* job for *scan_id*.  *options* are stored with the
+        job and passed to its runner as keyword arguments.
+
+        Returns ``(job, created)``; ``created`` is False when an active job
+        of that kind for the scan already existed.
+        """
+        await self.start()
+        existing = self._jobs.get(self._active.get((scan_id, kind), ""))
+        rerun = kind == "prepare" and existing and existing["status"] == "running"
+        if existing and existing["status"] in ACTIVE_STATES and not rerun:
+            changed = False
+            if existing["status"] == "queued" and options:
+                merged = {**existing.get("options", {}), **options}
+                changed = merged != existing.get("options", {})
+                existing["options"] = merged
+            if existing["status"] == "queued" and priority > existing["priority"]:
+                existing["priority"] = priority
+                # Re-push; the stale heap entry is skipped when popped
+                heapq.heappush(self._heaps[_POOL_OF[kind]], (-priority, next(self._seq), existing["job_id"]))
+                changed = True
+            if changed:
+                await run_io(_save_job, existing)
+            return existing, False
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "scan_id": scan_id,
+            "type": kind,
+            "priority": priority,
+            "status": "queued",
+            "created_at": _now(),
+        }
+        if options:
+            job["options"] = options
+        self._add(job)
+        await run_io(_save_job, job)
+        self._publish(job)
+        wakeup = self._wakeup[_POOL_OF[kind]]
+        async with wakeup:
+            wakeup.notify()
+        return job, True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return self.describe(job) if job else None
+
+    def active_jobs(self) -> list[dict]:
+        running = [j for j in self._jobs.values() if j["status"] == "running"]
+        queued = [j for pool in _POOLS for j in self._queued(pool)]
+        return [self.describe(j) for j in running + queued]
+
+    def _queued(self, pool: str) -> list[dict]:
+        """Queued jobs of *pool* in the order they will run."""
+        seen, ordered = set(), []
+        for _, _, job_id in sorted(self._heaps[pool]):
+            job = self._jobs[job_id]
+            if job["status"] == "queued" and job_id not in seen:
+                seen.add(job_id)
+                ordered.append(job)
+        return ordered
+
+    def _mean_duration(self, kind: str) -> float:
+        samples = self._durations[kind]
+        if not samples:
+            return _DEFAULT_DURATION[kind]
+        return sum(samples) / len(samples)
+
+    def describe(self, job: dict) -> dict:
+        """The stored job plus its queue ``position`` and ``eta_seconds``."""
+        info = dict(job)
+        info.pop("finished_ts", None)
+        mean = self._mean_duration(job["type"])
+        now = time.monotonic()
+        if job["status"] == "running":
+            elapsed = now - self._started_at.get(job["job_id"], now)
+            info["eta_seconds"] = round(max(mean - elapsed, 0.0))
+        elif job["status"] == "queued":
+            pool = _POOL_OF[job["type"]]
+            queued = self._queued(pool)
+            position = next(i for i, j in enumerate(queued) if j is job)
+            remaining = sum(
+                max(self._mean_duration(self._jobs[job_id]["type"]) - (now - started), 0.0)
+                for job_id, started in self._started_at.items()
+                if _POOL_OF[self._jobs[job_id]["type"]] == pool
+            )
+            ahead = sum(self._mean_duration(j["type"]) for j in queued[:position])
+            # Jobs ahead share the pool's workers; then this job runs itself
+            wait = (remaining + ahead) / self._pool_size[pool]
+            info["position"] = position + 1
+            info["eta_seconds"] = round(wait + mean)
+        return info
+
+    # ── Workers ──────────────────────────────────────────────────────────
+
+    def _publish(self, job: dict):
+        bus.publish(job["scan_id"], "job", self.describe(job))
+
+    async def _next_job(self, pool: str) -> dict:
+        heap, wakeup = self._heaps[pool], self._wakeup[pool]
+        async with wakeup:
+            while True:
+                while heap:
+                    neg_priority, _, job_id = heapq.heappop(heap)
+                    job = self._jobs[job_id]
+                    if job["status"] == "queued" and job["priority"] == -neg_priority:
+                        return job
+                await wakeup.wait()
+
+    async def _skip_queued_preparation(self, scan_id: str):
+        """The assembly prepares whatever is missing itself."""
+        job = self._jobs.get(self._active.get((scan_id, "prepare"), ""))
+        if job and job["status"] == "queued":
+            job["status"] = "skipped"
+            job["finished_at"] = _now()
+            job["finished_ts"] = time.time()
+            del self._active[scan_id, "prepare"]
+            await self._save(job)
+
+    async def _save(self, job: dict):
+        """Persist *job*; a failed write is logged, never fatal to the worker."""
+        try:
+            await run_io(_save_job, job)
+        except Exception:
+            logger.exception("Failed to save job %s", job["job_id"])
+
+    async def _run(self, job: dict, runner) -> dict:
+        """Run *job*; a scan's prepare and assembly jobs take turns."""
+        if job["type"] not in _MESH_KINDS:
+            return await runner(job["scan_id"], **job.get("options", {}))
+        lock = self._mesh_locks.setdefault(job["scan_id"], asyncio.Lock())
+        if lock.locked():
+            logger.info("Job %s waits for the running mesh job of scan %s", job["job_id"], job["scan_id"])
+        async with lock:
+            return await runner(job["scan_id"], **job.get("options", {}))
+
+    async def _worker(self, index: int, pool: str):
+        from app.services import run_post_processing, run_preparation
+        from app.services.ingest import run_ingest
+
+        runners = {"post_processing": run_post_processing, "prepare": run_preparation, "ingest": run_ingest}
+        while True:
+            job = await self._next_job(pool)
+            if job["type"] == "post_processing":
+                await self._skip_queued_preparation(job["scan_id"])
+            job["status"] = "running"
+            job["started_at"] = _now()
+            job["attempts"] = job.get("attempts", 0) + 1
+            self._started_at[job["job_id"]] = time.monotonic()
+            await self._save(job)
+            self._publish(job)
+            logger.info(
+                "%s worker %d running %s job %s (scan %s)",
+                pool.capitalize(), index, job["type"], job["job_id"], job["scan_id"],
+            )
+
+            try:
+                result = await self._run(job, runners[job["type"]])
+            except asyncio.CancelledError:
+                # Shutting down – leave the job "running" so start-up re-queues it
+                raise
+            except Exception as exc:
+                logger.exception("Job %s failed", job["job_id"])
+                result = {"error": str(exc)}
+
+            duration = time.monotonic() - self._started_at.pop(job["job_id"])
+            job["finished_at"] = _now()
+            job["finished_ts"] = time.time()
+            job["duration"] = round(duration, 1)
+            if "error" in result:
+                job["status"] = "failed"
+                job["error"] = result["error"]
+            else:
+                job["status"] = "completed"
+                job["result"] = result
+                samples = self._durations[job["type"]]
+                self._durations[job["type"]] = (samples + [duration])[-_DURATION_SAMPLES:]
+            key = (job["scan_id"], job["type"])
+            if self._active.get(key) == job["job_id"]:
+                del self._active[key]
+            await self._save(job)
+            self._publish(job)
+
+
+job_queue = JobQueue()
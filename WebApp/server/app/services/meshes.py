@@ -0,0 +1,229 @@
+"""Organ meshes in a scan's ``stl/`` directory – binary STL or binary PLY.
+
+The segmentation worker uploads each organ either as binary STL (one
+50-byte record per triangle) or as indexed little-endian binary PLY
+(float32 vertices stored once, int32 triangle indices), which is about
+2.5× smaller.  An organ has one mesh file, ``<organ>.stl`` or
+``<organ>.ply``; storing one format removes the other.
+
+Blender imports both.  STL stays the download format for clients:
+``compat_stl`` converts a PLY once into ``stl_compat/<organ>.stl`` and
+rebuilds it whenever the PLY is newer.
+"""
+
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+MESH_SUFFIXES = (".ply", ".stl")
+COMPAT_DIR_NAME = "stl_compat"
+
+_STL_HEADER_SIZE = 84
+_STL_RECORD = np.dtype([("normal", "<f4", (3,)), ("vectors", "<f4", (3, 3)), ("attr", "<u2")])
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+_MAX_PLY_HEADER = 64 * 1024
+
+
+class MeshError(ValueError):
+    """A mesh file that cannot be read."""
+
+
+def mesh_format(filename: Optional[str]) -> str:
+    """``"ply"`` or ``"stl"`` for an uploaded file name (STL unless it ends in .ply)."""
+    return "ply" if (filename or "").lower().endswith(".ply") else "stl"
+
+
+def mesh_files(stl_dir: Path) -> dict[str, Path]:
+    """``{organ: mesh path}`` for every organ in *stl_dir*, sorted by organ."""
+    found: dict[str, Path] = {}
+    if not stl_dir.exists():
+        return found
+    for path in stl_dir.iterdir():
+        if path.suffix.lower() not in MESH_SUFFIXES or path.name.startswith("."):
+            continue
+        other = found.get(path.stem)
+        # Only one format should exist; if both do, the newer upload wins
+        if other is None or path.stat().st_mtime_ns > other.stat().st_mtime_ns:
+            found[path.stem] = path
+    return dict(sorted(found.items()))
+
+
+def find_mesh(stl_dir: Path, organ: str) -> Optional[Path]:
+    """The mesh file of *organ*, or ``None``."""
+    candidates = [stl_dir / f"{organ}{suffix}" for suffix in MESH_SUFFIXES]
+    existing = [p for p in candidates if p.exists()]
+    if not existing:
+        return None
+    return max(existing, key=lambda p: p.stat().st_mtime_ns)
+
+
+def remove_other_formats(stl_dir: Path, organ: str, keep: Path):
+    """Drop the organ's mesh in the other format (and derived STL copies)."""
+    from app.services.precompress import remove_sidecars
+
+    for suffix in MESH_SUFFIXES:
+        path = stl_dir / f"{organ}{suffix}"
+        if path != keep and path.exists():
+            path.unlink()
+            remove_sidecars(path)
+    compat = stl_dir.parent / COMPAT_DIR_NAME / f"{organ}.stl"
+    if compat.exists():
+        compat.unlink()
+        remove_sidecars(compat)
+
+
+# ── PLY ──────────────────────────────────────────────────────────────────
+
+def ply_header(path: Path) -> dict:
+    """
+    Parse a binary little-endian PLY header.
+
+    Returns ``{"size": header bytes, "vertex": (count, dtype),
+    "face": (count, dtype or None)}``; the face dtype is ``None`` unless the
+    faces are a plain ``list <count type> <index type>`` property.  Raises
+    ``MeshError`` for anything else.
+    """
+    with open(path, "rb") as f:
+        head = f.read(_MAX_PLY_HEADER)
+    end = head.find(b"end_header\n")
+    if not head.startswith(b"ply\n") or end < 0:
+        raise MeshError("not a PLY file")
+    size = end + len(b"end_header\n")
+
+    elements: list[list] = []  # [name, count, [(name, type or list types)]]
+    fmt = None
+    for line in head[:end].decode("ascii", "replace").splitlines()[1:]:
+        words = line.split()
+        if not words or words[0] in ("comment", "obj_info"):
+            continue
+        if words[0] == "format":
+            fmt = words[1] if len(words) > 1 else None
+        elif words[0] == "element" and len(words) == 3:
+            elements.append([words[1], int(words[2]), []])
+        elif words[0] == "property" and elements:
+            elements[-1][2].append(words[1:])
+    if fmt != "binary_little_endian":
+        raise MeshError(f"unsupported PLY format {fmt!r} (binary_little_endian only)")
+
+    result: dict = {"size": size}
+    for name, count, props in elements:
+        if name == "vertex":
+            try:
+                dtype = np.dtype([(p[1], "<" + _PLY_TYPES[p[0]]) for p in props])
+            except (KeyError, IndexError):
+                raise MeshError("unsupported PLY vertex properties")
+            if not {"x", "y", "z"} <= set(dtype.names or ()):
+                raise MeshError("PLY vertices need x, y and z")
+            result["vertex"] = (count, dtype)
+        elif name == "face":
+            dtype = None
+            if len(props) == 1 and len(props[0]) == 4 and props[0][0] == "list":
+                try:
+                    dtype = np.dtype([
+                        ("count", "<" + _PLY_TYPES[props[0][1]]),
+                        ("indices", "<" + _PLY_TYPES[props[0][2]], (3,)),
+                    ])
+                except KeyError:
+                    pass
+            result["face"] = (count, dtype)
+        elif "vertex" not in result or "face" not in result:
+            raise MeshError(f"unsupported PLY element {name!r} before vertices / faces")
+    if "vertex" not in result or "face" not in result:
+        raise MeshError("PLY needs vertex and face elements")
+    return result
+
+
+def validate_ply(path: Path) -> int:
+    """Check that *path* is a complete triangle PLY.  Returns its face count."""
+    header = ply_header(path)
+    vertices, vertex_dtype = header["vertex"]
+    faces, face_dtype = header["face"]
+    if face_dtype is None:
+        raise MeshError("PLY faces must be a single 'list <type> <type> vertex_indices' property")
+    expected = header["size"] + vertices * vertex_dtype.itemsize + faces * face_dtype.itemsize
+    if path.stat().st_size != expected:
+        raise MeshError("PLY body does not match its header (truncated or not all triangles)")
+    _, indices = read_ply(path)
+    if indices.size and (indices.min() < 0 or indices.max() >= vertices):
+        raise MeshError("PLY face index out of range")
+    return faces
+
+
+def read_ply(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """``(vertices (n, 3) float32, faces (m, 3))`` of a triangle PLY."""
+    header = ply_header(path)
+    vertices, vertex_dtype = header["vertex"]
+    faces, face_dtype = header["face"]
+    if face_dtype is None:
+        raise MeshError("PLY faces must be a single list property")
+    with open(path, "rb") as f:
+        f.seek(header["size"])
+        vertex = np.fromfile(f, dtype=vertex_dtype, count=vertices)
+        face = np.fromfile(f, dtype=face_dtype, count=faces)
+    if len(vertex) != vertices or len(face) != faces or np.any(face["count"] != 3):
+        raise MeshError("PLY body does not match its header (truncated or not all triangles)")
+    verts = np.stack([vertex["x"], vertex["y"], vertex["z"]], axis=1).astype(np.float32, copy=False)
+    return verts, face["indices"]
+
+
+def write_stl(path: Path, verts: np.ndarray, faces: np.ndarray):
+    """Write an indexed mesh as binary STL (vectorised)."""
+    tris = verts[faces]
+    normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    records = np.zeros(len(tris), dtype=_STL_RECORD)
+    records["vectors"] = tris
+    records["normal"] = normals
+    with open(path, "wb") as f:
+        f.write(b"AR4CT binary STL".ljust(80, b"\0"))
+        f.write(np.array(len(records), dtype="<u4").tobytes())
+        records.tofile(f)
+
+
+# ── Format-independent helpers ───────────────────────────────────────────
+
+def triangle_count(path: Path) -> int:
+    """Triangles in a mesh file (0 for an unreadable one)."""
+    try:
+        if path.suffix.lower() == ".ply":
+            return ply_header(path)["face"][0]
+        return max(path.stat().st_size - _STL_HEADER_SIZE, 0) // _STL_RECORD.itemsize
+    except (OSError, MeshError, ValueError):
+        return 0
+
+
+def compat_stl(stl_dir: Path, organ: str) -> Optional[Path]:
+    """
+    The organ's mesh as binary STL: the uploaded file itself, or the STL
+    converted from its PLY (rebuilt when the PLY is newer).  Blocking.
+    """
+    mesh = find_mesh(stl_dir, organ)
+    if mesh is None or mesh.suffix.lower() == ".stl":
+        return mesh
+
+    compat_dir = stl_dir.parent / COMPAT_DIR_NAME
+    compat = compat_dir / f"{organ}.stl"
+    mesh_st = mesh.stat()
+    if compat.exists() and compat.stat().st_mtime_ns >= mesh_st.st_mtime_ns:
+        return compat
+
+    compat_dir.mkdir(exist_ok=True)
+    tmp = compat_dir / f".{organ}.{uuid.uuid4().hex}.tmp"
+    try:
+        verts, faces = read_ply(mesh)
+        write_stl(tmp, verts, faces)
+        os.utime(tmp, ns=(mesh_st.st_mtime_ns, mesh_st.st_mtime_ns))
+        os.replace(tmp, compat)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return compat
@@ -0,0 +1,144 @@
+"""Precompressed sidecars – ``model.fbx.gz`` / ``model.fbx.br`` next to artefacts.
+
+Artefacts are compressed once, right after they are written, and
+``file_download`` serves the best sidecar the client accepts with the
+matching ``Content-Encoding``.  Nothing is compressed per request.
+
+Each sidecar carries its artefact's modification time and is only used
+while the two match, so a rewritten artefact whose sidecars have not been
+regenerated yet is served uncompressed rather than stale.  Brotli needs
+the optional ``brotli`` package; without it only gzip sidecars are made.
+"""
+
+import gzip
+import logging
+import os
+import uuid
+import zlib
+from pathlib import Path
+from typing import Iterable, Optional
+
+from app.config import SIDECAR_BROTLI_QUALITY, SIDECAR_GZIP_LEVEL, UPLOAD_CHUNK_SIZE
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Preference order when a client accepts several encodings
+ENCODINGS = ("br", "gzip")
+_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+# Skip artefacts that do not shrink below this ratio (ZIPs, .nii.gz …)
+_MIN_SAVING = 0.9
+_PROBE_SIZE = 1024 * 1024
+
+
+def sidecar_path(path: Path, encoding: str) -> Path:
+    return path.with_name(path.name + _SUFFIX[encoding])
+
+
+def available_encodings() -> tuple[str, ...]:
+    return ENCODINGS if brotli is not None else ("gzip",)
+
+
+def fresh_sidecar(path: Path, st: os.stat_result, encoding: str) -> Optional[tuple[Path, os.stat_result]]:
+    """Return the sidecar for *encoding* if it exists and belongs to the version *st*."""
+    candidate = sidecar_path(path, encoding)
+    try:
+        side_st = candidate.stat()
+    except FileNotFoundError:
+        return None
+    if side_st.st_mtime_ns != st.st_mtime_ns:
+        return None
+    return candidate, side_st
+
+
+def _compressible(path: Path) -> bool:
+    """Cheap probe: does the first MB shrink meaningfully?"""
+    with open(path, "rb") as f:
+        probe = f.read(_PROBE_SIZE)
+    if not probe:
+        return False
+    return len(zlib.compress(probe, 1)) < _MIN_SAVING * len(probe)
+
+
+def _write_gzip(src: Path, dst: Path):
+    # mtime=0 keeps the output byte-identical for identical input
+    with open(src, "rb") as fin, open(dst, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=SIDECAR_GZIP_LEVEL, mtime=0) as fout:
+            while block := fin.read(UPLOAD_CHUNK_SIZE):
+                fout.write(block)
+
+
+def _write_brotli(src: Path, dst: Path):
+    compressor = brotli.Compressor(quality=SIDECAR_BROTLI_QUALITY)
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        while block := fin.read(UPLOAD_CHUNK_SIZE):
+            fout.write(compressor.process(block))
+        fout.write(compressor.finish())
+
+
+_WRITERS = {"gzip": _write_gzip, "br": _write_brotli}
+
+
+def remove_sidecars(path: Path):
+    for encoding in ENCODINGS:
+        try:
+            os.remove(sidecar_path(path, encoding))
+        except FileNotFoundError:
+            pass
+
+
+def write_sidecars(path: Path) -> dict[str, int]:
+    """
+    (Re)generate the sidecars of *path*.  Blocking and CPU-bound.
+
+    Returns ``{encoding: size}`` for the sidecars written; empty if the
+    artefact does not compress.
+    """
+    remove_sidecars(path)
+    if not path.exists() or not _compressible(path):
+        return {}
+
+    st = path.stat()
+    original = st.st_size
+    written = {}
+    for encoding in available_encodings():
+        dst = sidecar_path(path, encoding)
+        tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            _WRITERS[encoding](path, tmp)
+            size = tmp.stat().st_size
+            if size >= _MIN_SAVING * original:
+                continue
+            # Stamp with the source version; a source rewritten meanwhile
+            # gets a new mtime and the sidecar is ignored.
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp, dst)
+            written[encoding] = size
+        except Exception:
+            logger.exception("Failed to write %s sidecar for %s", encoding, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    if written:
+        logger.info(
+            "Sidecars for %s (%d KB): %s",
+            path.name,
+            original // 1024,
+            ", ".join(f"{enc} {size // 1024} KB" for enc, size in written.items()),
+        )
+    return written
+
+
+def write_sidecars_many(paths: Iterable[Path]):
+    """``write_sidecars`` for several artefacts (for background tasks)."""
+    for path in paths:
+        try:
+            write_sidecars(path)
+        except Exception:
+            logger.exception("Failed to write sidecars for %s", path)
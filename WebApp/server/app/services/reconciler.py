@@ -0,0 +1,170 @@
+"""RunPod reconciler – settles scans whose segmentation outcome was missed.
+
+Scans normally leave ``processing`` through the worker's completion
+callback (per-organ uploads do not change the status).  If the worker
+crashes, times out or its completion callback is lost, nothing would ever
+move them on.  Scans still carrying a ``runpod_job_id`` without a recorded
+completion are in flight – including ``segmented`` scans written before
+uploads stopped setting that status.  Every ``RUNPOD_RECONCILE_INTERVAL`` seconds the
+reconciler checks the RunPod status of all in-flight jobs (concurrently,
+over the shared client in ``services.runpod``) and
+
+* COMPLETED  → completes the segmentation (queues post-processing), or
+  marks the scan ``error`` if the worker returned an error / no meshes;
+* FAILED / CANCELLED / TIMED_OUT / unknown to RunPod → ``error``;
+* IN_QUEUE / IN_PROGRESS, or RunPod unreachable → left alone.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+import httpx
+
+from app.config import RUNPOD_RECONCILE_INTERVAL
+from app.services import complete_segmentation
+from app.services.meshes import mesh_files
+from app.services.runpod import is_configured, poll_job_status
+from app.storage import get_scan_dir, list_scan_ids, load_metadata, metadata_lock, run_io, save_metadata_async
+
+logger = logging.getLogger(__name__)
+
+# Status checks in flight at once
+_CONCURRENCY = 8
+
+_FAILED_STATES = {"FAILED", "CANCELLED", "TIMED_OUT", "NOT_FOUND"}
+
+# Statuses of a scan whose segmentation may still be outstanding
+_WAITING_STATES = ("processing", "segmented")
+
+
+def _awaiting(metadata: Optional[dict], job_id: Optional[str] = None) -> bool:
+    """Does *metadata* describe a RunPod job (*job_id* if given) with no completion recorded?"""
+    if not metadata or not metadata.get("runpod_job_id"):
+        return False
+    if job_id is not None and metadata["runpod_job_id"] != job_id:
+        return False
+    return metadata.get("status") in _WAITING_STATES and not metadata.get("processing_completed_at")
+
+
+def _in_flight() -> list[tuple[str, str]]:
+    """``(scan_id, runpod_job_id)`` of every scan still waiting for its segmentation."""
+    found = []
+    for scan_id in list_scan_ids():
+        try:
+            metadata = load_metadata(scan_id)
+        except ValueError:
+            continue
+        if _awaiting(metadata):
+            found.append((scan_id, metadata["runpod_job_id"]))
+    return found
+
+
+def _has_stls(scan_id: str) -> bool:
+    stl_dir = get_scan_dir(scan_id) / "stl"
+    return bool(mesh_files(stl_dir))
+
+
+async def _fail(scan_id: str, job_id: str, message: str):
+    # Re-read under the lock: a callback may have moved the scan on since the scan
+    async with metadata_lock(scan_id):
+        metadata = await run_io(load_metadata, scan_id)
+        if not _awaiting(metadata, job_id):
+            return
+        metadata["status"] = "error"
+        metadata["processing_error"] = message
+        metadata["processing_completed_at"] = datetime.utcnow().isoformat() + "Z"
+        await save_metadata_async(scan_id, metadata)
+    logger.warning("Scan %s (RunPod job %s) marked as error: %s", scan_id, job_id, message)
+
+
+async def _settle(scan_id: str, job_id: str, status: dict) -> Optional[str]:
+    """Apply one job's RunPod status; returns what was done (or None)."""
+    state = status.get("status")
+    if state == "COMPLETED":
+        output = status.get("output") or {}
+        if isinstance(output, dict) and output.get("error"):
+            await _fail(scan_id, job_id, f"Segmentation failed: {output['error']}")
+            return "error"
+        if not await run_io(_has_stls, scan_id):
+            await _fail(scan_id, job_id, "Segmentation finished but no STL files were received")
+            return "error"
+        metadata = await run_io(load_metadata, scan_id)
+        if not _awaiting(metadata, job_id):
+            return None
+        if not isinstance(output, dict):
+            output = {}
+        await complete_segmentation(
+            scan_id,
+            output.get("organs_processed") or sorted(metadata.get("stl_files", {})),
+            output.get("organs_failed"),
+            output.get("timeline"),
+        )
+        return "completed"
+    if state in _FAILED_STATES:
+        message = f"RunPod job {state.replace('_', ' ').lower()}"
+        if status.get("error"):
+            message += f": {status['error']}"
+        await _fail(scan_id, job_id, message)
+        return "error"
+    return None
+
+
+async def reconcile_once() -> dict[str, str]:
+    """Check every in-flight job once.  Returns ``{scan_id: action}``."""
+    if not is_configured():
+        return {}
+    jobs = await run_io(_in_flight)
+    if not jobs:
+        return {}
+
+    semaphore = asyncio.Semaphore(_CONCURRENCY)
+    actions: dict[str, str] = {}
+
+    async def check(scan_id: str, job_id: str):
+        async with semaphore:
+            try:
+                status = await poll_job_status(job_id)
+            except httpx.HTTPError as exc:
+                logger.warning("RunPod status of job %s unavailable: %r", job_id, exc)
+                return
+        if "error" in status and "status" not in status:
+            logger.warning("RunPod status of job %s unavailable: %s", job_id, status["error"])
+            return
+        action = await _settle(scan_id, job_id, status)
+        if action:
+            actions[scan_id] = action
+
+    await asyncio.gather(*(check(scan_id, job_id) for scan_id, job_id in jobs))
+    logger.info("Reconciled %d in-flight RunPod job(s): %s", len(jobs), actions or "no changes")
+    return actions
+
+
+class Reconciler:
+    """Runs ``reconcile_once`` every *interval* seconds in the background."""
+
+    def __init__(self, interval: int = RUNPOD_RECONCILE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0 and is_configured():
+            self._task = asyncio.create_task(self._run(), name="runpod-reconciler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await reconcile_once()
+            except Exception:
+                logger.exception("RunPod reconciliation failed")
+            await asyncio.sleep(self.interval)
+
+
+reconciler = Reconciler()
@@ -1,15 +1,31 @@
-"""RunPod integration – submit segmentation jobs and poll for results."""
+"""RunPod integration – submit segmentation jobs and poll for results.
 
+All calls share one long-lived ``httpx.AsyncClient`` (connection pool,
+keep-alive) and retry transient failures with exponential backoff: status
+polls retry transport errors, 429 and 5xx; job submission only retries
+failures where RunPod cannot have accepted the job (connection never
+established, 429), since a resubmitted ``/run`` starts a second paid job.
+"""
+
+import asyncio
 import logging
+import random
 from typing import Optional
 
 import httpx
 
-from app.config import RUNPOD_API_KEY, RUNPOD_ENDPOINT_ID
+from app.config import RUNPOD_API_KEY, RUNPOD_BASE_URL, RUNPOD_ENDPOINT_ID, RUNPOD_MAX_RETRIES
 
 logger = logging.getLogger(__name__)
 
-RUNPOD_BASE = "https://api.runpod.ai/v2"
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Non-idempotent requests (POST /run): only failures before RunPod saw the request
+_SAFE_RETRY_STATUSES = {429}
+_SAFE_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+_BACKOFF_BASE = 0.5
+_BACKOFF_MAX = 30.0
+
+_client: Optional[httpx.AsyncClient] = None
 
 
 def _headers() -> dict:
@@ -19,11 +35,90 @@ def _headers() -> dict:
     }
 
 
+def is_configured() -> bool:
+    return bool(RUNPOD_API_KEY and RUNPOD_ENDPOINT_ID)
+
+
+# ── Shared client ────────────────────────────────────────────────────────
+
+def get_client() -> httpx.AsyncClient:
+    """The process-wide RunPod client (created on first use)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=RUNPOD_BASE_URL,
+            headers=_headers(),
+            timeout=httpx.Timeout(30, connect=10),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+
+def set_client(client: Optional[httpx.AsyncClient]):
+    """Replace the shared client, e.g. with one bound to a fake RunPod app."""
+    global _client
+    _client = client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    if response is not None:
+        retry_after = response.headers.get("retry-after", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), _BACKOFF_MAX)
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(_BACKOFF_BASE * 2 ** attempt, _BACKOFF_MAX))
+
+
+async def _request(method: str, path: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared client, retrying transient failures.
+
+    With ``idempotent=False`` only errors raised before the request reached
+    RunPod (connect / pool) and 429 are retried – a timeout or 5xx may come
+    after the request was acted on.
+
+    Raises ``httpx.HTTPError`` once ``RUNPOD_MAX_RETRIES`` retries are used
+    up on transport errors, or at once on a non-retryable one; retryable
+    status codes return the last response.
+    """
+    client = get_client()
+    retry_errors = httpx.TransportError if idempotent else _SAFE_RETRY_ERRORS
+    retry_statuses = _RETRY_STATUSES if idempotent else _SAFE_RETRY_STATUSES
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, path, **kwargs)
+        except retry_errors as exc:
+            if attempt == RUNPOD_MAX_RETRIES:
+                raise
+            response, error = None, repr(exc)
+        else:
+            if response.status_code not in retry_statuses or attempt == RUNPOD_MAX_RETRIES:
+                return response
+            error = f"HTTP {response.status_code}"
+
+        delay = _retry_delay(attempt, response)
+        attempt += 1
+        logger.warning(
+            "RunPod %s %s failed (%s) – retry %d/%d in %.1fs",
+            method, path, error, attempt, RUNPOD_MAX_RETRIES, delay,
+        )
+        await asyncio.sleep(delay)
+
+
 async def submit_segmentation_job(
     file_url: str,
     organs: list[str],
     callback_url: Optional[str] = None,
     fast: bool = False,
+    file_sha256: Optional[str] = None,
 ) -> dict:
     """
     Submit an async segmentation job to RunPod.
@@ -33,12 +128,13 @@ async def submit_segmentation_job(
         organs:       List of organ names to segment.
         callback_url: Base scan URL; RunPod uploads STLs to {callback_url}/stl/{organ}.
         fast:         Use fast (3 mm) mode.
+        file_sha256:  Checksum of the CT file; the worker verifies its download.
 
     Returns:
         {"job_id": "...", "status": "IN_QUEUE"} on success,
         {"error": "..."} on failure.
     """
-    if not RUNPOD_API_KEY or not RUNPOD_ENDPOINT_ID:
+    if not is_configured():
         logger.warning("RunPod credentials not configured – skipping job submission")
         return {"error": "RunPod is not configured on this server"}
 
@@ -51,14 +147,21 @@ async def submit_segmentation_job(
     }
     if callback_url:
         payload["input"]["callback_url"] = callback_url
+    if file_sha256:
+        payload["input"]["file_sha256"] = file_sha256
 
-    url = f"{RUNPOD_BASE}/{RUNPOD_ENDPOINT_ID}/run"
-    logger.info("Submitting RunPod job to %s", url)
+    path = f"/{RUNPOD_ENDPOINT_ID}/run"
+    logger.info("Submitting RunPod job to %s%s", RUNPOD_BASE_URL, path)
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(url, headers=_headers(), json=payload)
+    try:
+        # Not retried once RunPod may have accepted it: a duplicate job costs GPU time
+        # and races the first one's callbacks
+        resp = await _request("POST", path, idempotent=False, json=payload)
+        body = resp.json()
+    except (httpx.HTTPError, ValueError) as exc:
+        logger.error("RunPod submission failed: %r", exc)
+        return {"error": f"Could not reach RunPod: {exc}"}
 
-    body = resp.json()
     if resp.status_code != 200 or "id" not in body:
         logger.error("RunPod submission failed: %s", body)
         return {"error": body.get("error", "Failed to submit RunPod job"), "details": body}
@@ -74,13 +177,21 @@ async def poll_job_status(job_id: str) -> dict:
         {"status": "COMPLETED", "output": {...}}
         {"status": "IN_PROGRESS"}
         {"status": "FAILED", "error": "..."}
+
+    A job RunPod no longer knows (results expire) gives
+    ``{"status": "NOT_FOUND"}``.  Raises ``httpx.HTTPError`` if RunPod
+    cannot be reached.
     """
-    if not RUNPOD_API_KEY or not RUNPOD_ENDPOINT_ID:
+    if not is_configured():
         return {"error": "RunPod is not configured on this server"}
 
-    url = f"{RUNPOD_BASE}/{RUNPOD_ENDPOINT_ID}/status/{job_id}"
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.get(url, headers=_headers())
-
-    return resp.json()
+    resp = await _request("GET", f"/{RUNPOD_ENDPOINT_ID}/status/{job_id}")
+    if resp.status_code == 404:
+        return {"status": "NOT_FOUND"}
+    try:
+        body = resp.json()
+    except ValueError:
+        body = {}
+    if resp.status_code != 200:
+        return {"error": body.get("error", f"HTTP {resp.status_code}"), "status_code": resp.status_code}
+    return body
@@ -0,0 +1,551 @@
+"""Ingest-time format sniffing for CT uploads.
+
+``CTHeaderSniffer`` is fed the upload stream chunk by chunk.  As soon as
+the first bytes arrive it decides what the file is (ZIP, NIfTI-1/2 – plain
+or gzipped –, MetaImage, NRRD) and rejects anything unsupported before the
+rest of the body is transferred.  ZIPs may also hold a DICOM series.  When the last byte has landed on disk,
+``finish()`` checks that the file is complete (ZIP end-of-central-directory,
+NIfTI voxel payload / gzip trailer, raw data length) and returns the volume
+geometry, which is persisted into the scan metadata as ``ct_header``::
+
+    {"format": "nifti", "container": "zip", "inner_file": "ct/scan.nii.gz",
+     "dimensions": [512, 512, 300], "spacing": [0.8, 0.8, 1.0],
+     "origin": [...], "dtype": "int16", "warnings": []}
+
+Only headers are parsed; voxel data is never decoded here.
+"""
+
+import math
+import posixpath
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Optional
+
+# Bytes of the stream head kept in memory – enough for any header we parse.
+HEAD_SIZE = 64 * 1024
+
+_NIFTI_DTYPES = {
+    2: "uint8", 4: "int16", 8: "int32", 16: "float32", 64: "float64",
+    256: "int8", 512: "uint16", 768: "uint32", 1024: "int64", 1280: "uint64",
+}
+
+_MHD_DTYPES = {
+    "MET_UCHAR": ("uint8", 1), "MET_CHAR": ("int8", 1),
+    "MET_USHORT": ("uint16", 2), "MET_SHORT": ("int16", 2),
+    "MET_UINT": ("uint32", 4), "MET_INT": ("int32", 4),
+    "MET_FLOAT": ("float32", 4), "MET_DOUBLE": ("float64", 8),
+}
+
+_NRRD_DTYPES = {
+    "uchar": ("uint8", 1), "unsigned char": ("uint8", 1), "uint8": ("uint8", 1), "uint8_t": ("uint8", 1),
+    "signed char": ("int8", 1), "int8": ("int8", 1), "int8_t": ("int8", 1),
+    "short": ("int16", 2), "short int": ("int16", 2), "signed short": ("int16", 2),
+    "signed short int": ("int16", 2), "int16": ("int16", 2), "int16_t": ("int16", 2),
+    "ushort": ("uint16", 2), "unsigned short": ("uint16", 2), "unsigned short int": ("uint16", 2),
+    "uint16": ("uint16", 2), "uint16_t": ("uint16", 2),
+    "int": ("int32", 4), "signed int": ("int32", 4), "int32": ("int32", 4), "int32_t": ("int32", 4),
+    "uint": ("uint32", 4), "unsigned int": ("uint32", 4), "uint32": ("uint32", 4), "uint32_t": ("uint32", 4),
+    "float": ("float32", 4), "double": ("float64", 8),
+}
+
+_SUPPORTED_IN_ZIP = (".mhd", ".nii", ".nii.gz", ".nrrd")
+
+
+class UnsupportedUpload(ValueError):
+    """Raised when an upload is not a usable CT volume.
+
+    ``status_code`` is 415 for unknown formats and 422 for recognised but
+    broken (truncated, incomplete) files.
+    """
+
+    def __init__(self, message: str, status_code: int = 422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# ── Header parsers ───────────────────────────────────────────────────────
+
+def _nifti_from_bytes(data: bytes) -> Optional[dict]:
+    """
+    Parse a NIfTI-1 or NIfTI-2 header from the start of *data*.
+    Returns None if *data* does not start with a NIfTI header.
+    """
+    if len(data) < 4:
+        return None
+
+    for endian in ("<", ">"):
+        (sizeof_hdr,) = struct.unpack(endian + "i", data[:4])
+        if sizeof_hdr == 348 and len(data) >= 348 and data[344:347] in (b"n+1", b"ni1"):
+            return _parse_nifti1(data, endian)
+        if sizeof_hdr == 540 and len(data) >= 540 and data[4:7] in (b"n+2", b"ni2"):
+            return _parse_nifti2(data, endian)
+    return None
+
+
+def _nifti_geometry(dims, pixdim, qform_code, sform_code, qoffset, srows) -> tuple[list, list, list]:
+    ndim = max(1, min(int(dims[0]), 7))
+    shape = [int(d) for d in dims[1:1 + ndim]] + [1] * max(0, 3 - ndim)
+    spacing = [abs(float(p)) or 1.0 for p in pixdim[1:4]]
+    if sform_code > 0:
+        origin = [float(srows[0][3]), float(srows[1][3]), float(srows[2][3])]
+    elif qform_code > 0:
+        origin = [float(o) for o in qoffset]
+    else:
+        # nibabel's fallback affine: centred volume, x flipped
+        origin = [
+            (shape[0] - 1) / 2 * spacing[0],
+            -(shape[1] - 1) / 2 * spacing[1],
+            -(shape[2] - 1) / 2 * spacing[2],
+        ]
+    return shape, spacing, origin
+
+
+def _parse_nifti1(data: bytes, e: str) -> dict:
+    dims = struct.unpack(e + "8h", data[40:56])
+    datatype, bitpix = struct.unpack(e + "hh", data[70:74])
+    pixdim = struct.unpack(e + "8f", data[76:108])
+    (vox_offset,) = struct.unpack(e + "f", data[108:112])
+    qform_code, sform_code = struct.unpack(e + "hh", data[252:256])
+    qoffset = struct.unpack(e + "3f", data[268:280])
+    srows = [struct.unpack(e + "4f", data[o:o + 16]) for o in (280, 296, 312)]
+    shape, spacing, origin = _nifti_geometry(dims, pixdim, qform_code, sform_code, qoffset, srows)
+    return {
+        "format": "nifti",
+        "version": 1,
+        "dims": [int(d) for d in dims[1:1 + max(1, min(dims[0], 7))]],
+        "dimensions": shape[:3],
+        "spacing": spacing,
+        "origin": origin,
+        "dtype": _NIFTI_DTYPES.get(datatype, f"nifti:{datatype}"),
+        "bitpix": int(bitpix),
+        "vox_offset": int(vox_offset) if vox_offset > 0 else 352,
+    }
+
+
+def _parse_nifti2(data: bytes, e: str) -> dict:
+    datatype, bitpix = struct.unpack(e + "hh", data[12:16])
+    dims = struct.unpack(e + "8q", data[16:80])
+    pixdim = struct.unpack(e + "8d", data[104:168])
+    (vox_offset,) = struct.unpack(e + "q", data[168:176])
+    qform_code, sform_code = struct.unpack(e + "ii", data[344:352])
+    qoffset = struct.unpack(e + "3d", data[376:400])
+    srows = [struct.unpack(e + "4d", data[o:o + 32]) for o in (400, 432, 464)]
+    shape, spacing, origin = _nifti_geometry(dims, pixdim, qform_code, sform_code, qoffset, srows)
+    return {
+        "format": "nifti",
+        "version": 2,
+        "dims": [int(d) for d in dims[1:1 + max(1, min(dims[0], 7))]],
+        "dimensions": shape[:3],
+        "spacing": spacing,
+        "origin": origin,
+        "dtype": _NIFTI_DTYPES.get(datatype, f"nifti:{datatype}"),
+        "bitpix": int(bitpix),
+        "vox_offset": int(vox_offset) if vox_offset > 0 else 544,
+    }
+
+
+def _nifti_payload_size(header: dict) -> int:
+    return header["vox_offset"] + math.prod(header["dims"]) * header["bitpix"] // 8
+
+
+def _split_text_header(data: bytes, terminator_key: Optional[str] = None) -> Optional[tuple[list[str], int]]:
+    """
+    Split the ASCII header at the start of *data* into lines.
+
+    Stops at the first blank line (NRRD) or after the line whose key is
+    *terminator_key* (MetaImage ``ElementDataFile``).  Returns the lines and
+    the byte length of the header, or None if the end was not seen yet.
+    """
+    pos = 0
+    lines = []
+    while True:
+        nl = data.find(b"\n", pos)
+        if nl < 0:
+            return None
+        raw = data[pos:nl]
+        pos = nl + 1
+        try:
+            line = raw.decode("ascii").rstrip("\r")
+        except UnicodeDecodeError:
+            raise UnsupportedUpload("Header contains non-ASCII bytes", status_code=415)
+        if terminator_key is None and not line.strip():
+            return lines, pos
+        lines.append(line)
+        if terminator_key and line.split("=", 1)[0].strip() == terminator_key:
+            return lines, pos
+
+
+def _parse_mhd(lines: list[str]) -> dict:
+    meta: dict[str, str] = {}
+    for line in lines:
+        if "=" in line:
+            key, value = line.split("=", 1)
+            meta[key.strip()] = value.strip()
+
+    if "DimSize" not in meta:
+        raise UnsupportedUpload("MetaImage header has no DimSize")
+    dims = [int(x) for x in meta["DimSize"].split()]
+    if len(dims) < 3:
+        raise UnsupportedUpload(f"MetaImage has {len(dims)} dimensions, expected 3")
+    spacing = meta.get("ElementSpacing") or meta.get("ElementSize") or "1 1 1"
+    origin = meta.get("Offset") or meta.get("Origin") or meta.get("Position") or "0 0 0"
+    element_type = meta.get("ElementType", "MET_SHORT")
+    dtype, itemsize = _MHD_DTYPES.get(element_type, (element_type, 0))
+    return {
+        "format": "mhd",
+        "dimensions": dims[:3],
+        "spacing": [float(x) for x in spacing.split()][:3],
+        "origin": [float(x) for x in origin.split()][:3],
+        "dtype": dtype,
+        "itemsize": itemsize,
+        "data_file": meta.get("ElementDataFile", ""),
+        "compressed": meta.get("CompressedData", "False").lower() in ("true", "1", "yes"),
+        "header_size": int(meta.get("HeaderSize", "0") or 0),
+    }
+
+
+def _parse_nrrd(lines: list[str]) -> dict:
+    fields: dict[str, str] = {}
+    for line in lines[1:]:
+        if line.startswith("#") or ":=" in line:
+            continue
+        if ":" in line:
+            key, value = line.split(":", 1)
+            fields[key.strip().lower()] = value.strip()
+
+    if "sizes" not in fields:
+        raise UnsupportedUpload("NRRD header has no sizes field")
+    dims = [int(x) for x in fields["sizes"].split()]
+    if len(dims) < 3:
+        raise UnsupportedUpload(f"NRRD has {len(dims)} dimensions, expected 3")
+
+    spacing = [1.0, 1.0, 1.0]
+    if "space directions" in fields:
+        vectors = [v for v in fields["space directions"].replace(" ", "").split(")(") if v.strip("()") != "none"]
+        norms = []
+        for v in vectors:
+            comps = [float(c) for c in v.strip("()").split(",")]
+            norms.append(math.sqrt(sum(c * c for c in comps)))
+        spacing = norms[:3] or spacing
+    elif "spacings" in fields:
+        spacing = [float(x) for x in fields["spacings"].split() if x.lower() != "nan"][:3] or spacing
+
+    origin = [0.0, 0.0, 0.0]
+    if "space origin" in fields:
+        origin = [float(c) for c in fields["space origin"].strip("()").split(",")][:3]
+
+    dtype, itemsize = _NRRD_DTYPES.get(fields.get("type", "").lower(), (fields.get("type", "?"), 0))
+    return {
+        "format": "nrrd",
+        "dimensions": dims[:3],
+        "spacing": spacing,
+        "origin": origin,
+        "dtype": dtype,
+        "itemsize": itemsize,
+        "encoding": fields.get("encoding", "raw").lower(),
+        "data_file": fields.get("data file") or fields.get("datafile") or "",
+    }
+
+
+def _public(header: dict) -> dict:
+    """Strip parser internals, keep what goes into metadata."""
+    keep = ("format", "container", "inner_file", "dimensions", "spacing", "origin", "dtype", "warnings")
+    result = {k: header[k] for k in keep if k in header}
+    for key in ("spacing", "origin"):
+        result[key] = [round(float(v), 6) for v in result.get(key, [])]
+    return result
+
+
+# ── Streaming sniffer ────────────────────────────────────────────────────
+
+class CTHeaderSniffer:
+    """
+    Incremental format detection for an upload stream.
+
+    Call ``feed()`` with every chunk in order – it raises
+    ``UnsupportedUpload`` as soon as the head of the stream shows the file
+    cannot be used.  After the complete file is on disk call
+    ``finish(path)`` to verify completeness and obtain the ``ct_header``.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.size = 0
+        self.kind: Optional[str] = None
+        self.header: Optional[dict] = None
+        self._head = bytearray()
+        self._gunzip = None
+        self._gunzipped = bytearray()
+
+    # -- streaming ---------------------------------------------------------
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if len(self._head) < HEAD_SIZE:
+            self._head += chunk[: HEAD_SIZE - len(self._head)]
+            self._detect()
+
+    def _detect(self, final: bool = False):
+        head = bytes(self._head)
+        if self.kind is None:
+            if len(head) < 4 and not final:
+                return
+            self.kind = self._classify(head)
+
+        if self.header is not None:
+            return
+
+        if self.kind == "nifti":
+            self.header = _nifti_from_bytes(head)
+            if self.header is None and (final or len(head) >= 540):
+                raise UnsupportedUpload("File looks like NIfTI but the header is invalid")
+        elif self.kind == "nifti_gz":
+            self._gunzip_head(head)
+            self.header = _nifti_from_bytes(bytes(self._gunzipped))
+            if self.header is None and (final or len(self._gunzipped) >= 540):
+                raise UnsupportedUpload(
+                    "Gzip file does not contain a NIfTI volume (only .nii.gz is supported)",
+                    status_code=415,
+                )
+        elif self.kind == "mhd":
+            split = _split_text_header(head, terminator_key="ElementDataFile")
+            if split is not None:
+                lines, header_len = split
+                self.header = _parse_mhd(lines)
+                self.header["header_len"] = header_len
+                if self.header["data_file"].upper() != "LOCAL":
+                    raise UnsupportedUpload(
+                        "A .mhd header references a separate data file "
+                        f"('{self.header['data_file']}') – upload a ZIP containing both files"
+                    )
+            elif final or len(head) >= HEAD_SIZE:
+                raise UnsupportedUpload("MetaImage header is incomplete")
+        elif self.kind == "nrrd":
+            split = _split_text_header(head)
+            if split is not None:
+                lines, header_len = split
+                self.header = _parse_nrrd(lines)
+                self.header["header_len"] = header_len
+                if self.header["data_file"]:
+                    raise UnsupportedUpload(
+                        "Detached NRRD header – upload a ZIP with the header and its data file"
+                    )
+            elif final or len(head) >= HEAD_SIZE:
+                raise UnsupportedUpload("NRRD header is incomplete")
+
+    def _classify(self, head: bytes) -> str:
+        name = self.filename.lower()
+        if head[:4] == b"PK\x03\x04":
+            return "zip"
+        if head[:4] in (b"PK\x05\x06", b"PK\x07\x08"):
+            raise UnsupportedUpload("ZIP archive is empty or split", status_code=415)
+        if head[:2] == b"\x1f\x8b":
+            return "nifti_gz"
+        if head[:7] == b"NRRD000":
+            return "nrrd"
+        if head[:4] in (struct.pack("<i", 348), struct.pack(">i", 348),
+                        struct.pack("<i", 540), struct.pack(">i", 540)):
+            return "nifti"
+        if name.endswith((".mhd", ".mha")) or head.lstrip().startswith((b"ObjectType", b"NDims")):
+            return "mhd"
+        raise UnsupportedUpload(
+            "Unsupported file format. Supported: .zip, .nii, .nii.gz, .mhd (in ZIP), .nrrd, DICOM series (in ZIP)",
+            status_code=415,
+        )
+
+    def _gunzip_head(self, head: bytes):
+        if self._gunzip is None:
+            self._gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._gunzip_pos = 0
+        if len(self._gunzipped) >= 540:
+            return
+        new = self._gunzip.unconsumed_tail + head[self._gunzip_pos:]
+        self._gunzip_pos = len(head)
+        try:
+            self._gunzipped += self._gunzip.decompress(new, 4096)
+        except zlib.error as exc:
+            raise UnsupportedUpload(f"Corrupt gzip stream: {exc}")
+
+    # -- completion --------------------------------------------------------
+
+    def finish(self, path: Path) -> dict:
+        """
+        Verify the complete file at *path* and return the ``ct_header``.
+        Raises ``UnsupportedUpload`` for truncated or unusable files.
+        """
+        self._detect(final=True)
+        if self.kind == "zip":
+            header = self._finish_zip(path)
+        else:
+            header = dict(self.header)
+            header["container"] = None
+            self._check_complete(header, path)
+        header.setdefault("warnings", [])
+        return _public(header)
+
+    def _check_complete(self, header: dict, path: Path):
+        if self.kind == "nifti":
+            expected = _nifti_payload_size(header)
+            if self.size < expected:
+                raise UnsupportedUpload(
+                    f"NIfTI file is truncated: {self.size} of {expected} bytes received"
+                )
+        elif self.kind == "nifti_gz":
+            expected = _nifti_payload_size(header)
+            with open(path, "rb") as f:
+                f.seek(max(0, self.size - 4))
+                trailer = f.read(4)
+            isize = struct.unpack("<I", trailer)[0] if len(trailer) == 4 else -1
+            if isize != expected % (1 << 32):
+                raise UnsupportedUpload(
+                    "Gzipped NIfTI is truncated or corrupt (gzip trailer does not match the header)"
+                )
+        elif self.kind in ("mhd", "nrrd"):
+            itemsize = header.get("itemsize") or 0
+            raw = header.get("encoding", "raw") == "raw" and not header.get("compressed")
+            if itemsize and raw:
+                expected = header["header_len"] + math.prod(header["dimensions"]) * itemsize
+                if self.size < expected:
+                    raise UnsupportedUpload(
+                        f"{header['format'].upper()} data is truncated: {self.size} of {expected} bytes received"
+                    )
+            elif not itemsize:
+                header.setdefault("warnings", []).append(f"Unknown element type '{header['dtype']}'")
+
+    def _finish_zip(self, path: Path) -> dict:
+        entries = _read_zip_directory(path, self.size)
+        names = [n for n in entries if not n.endswith("/") and "__MACOSX" not in n]
+        candidates = [n for n in names if n.lower().endswith(_SUPPORTED_IN_ZIP)]
+        if not candidates:
+            header = self._finish_dicom_zip(path, names)
+            if header is None:
+                raise UnsupportedUpload(
+                    "No supported image file (.nii, .mhd, .nrrd, DICOM) in ZIP", status_code=415
+                )
+            return header
+        mhds = [n for n in candidates if n.lower().endswith(".mhd")]
+        niftis = [n for n in candidates if ".nii" in n.lower()]
+        chosen = (mhds or niftis or candidates)[0]
+
+        with zipfile.ZipFile(path) as zf:
+            header = _zip_member_header(zf, chosen, names)
+
+        header["container"] = "zip"
+        header["inner_file"] = chosen
+        warnings = header.setdefault("warnings", [])
+        if len(candidates) > 1:
+            warnings.append(f"ZIP contains {len(candidates)} image files – using '{chosen}'")
+        return header
+
+
+    def _finish_dicom_zip(self, path: Path, names: list[str]) -> Optional[dict]:
+        from app.services.dicom import DicomSeriesError, sniff_dicom_zip
+
+        try:
+            with zipfile.ZipFile(path) as zf:
+                header = sniff_dicom_zip(zf, names)
+        except DicomSeriesError as exc:
+            raise UnsupportedUpload(f"DICOM series is unusable: {exc}")
+        except ImportError:
+            raise UnsupportedUpload("DICOM uploads are not supported on this server", status_code=415)
+        if header is not None:
+            header["container"] = "zip"
+        return header
+
+
+def _read_zip_directory(path: Path, size: int) -> dict[str, int]:
+    """
+    Locate and parse the ZIP central directory from the end of the file.
+    Returns ``{name: uncompressed_size}``; raises if the archive is truncated.
+    """
+    tail_len = min(size, 65535 + 22)
+    with open(path, "rb") as f:
+        f.seek(size - tail_len)
+        tail = f.read(tail_len)
+        eocd = tail.rfind(b"PK\x05\x06")
+        if eocd < 0 or len(tail) - eocd < 22:
+            raise UnsupportedUpload("ZIP archive is truncated (no end-of-central-directory record)")
+        _, _, _, _, count, cd_size, cd_offset, _ = struct.unpack("<4sHHHHIIH", tail[eocd:eocd + 22])
+
+        if 0xFFFFFFFF in (cd_size, cd_offset) or count == 0xFFFF:
+            locator = tail.rfind(b"PK\x06\x07", 0, eocd)
+            if locator < 0:
+                raise UnsupportedUpload("ZIP64 archive is missing its locator record")
+            (zip64_eocd_offset,) = struct.unpack("<Q", tail[locator + 8:locator + 16])
+            f.seek(zip64_eocd_offset)
+            record = f.read(56)
+            if record[:4] != b"PK\x06\x06":
+                raise UnsupportedUpload("ZIP64 archive is truncated or corrupt")
+            count, _, cd_size, cd_offset = struct.unpack("<QQQQ", record[24:56])
+
+        if cd_offset + cd_size > size:
+            raise UnsupportedUpload("ZIP archive is truncated (central directory beyond end of file)")
+        f.seek(cd_offset)
+        directory = f.read(cd_size)
+
+    entries: dict[str, int] = {}
+    pos = 0
+    for _ in range(count):
+        if directory[pos:pos + 4] != b"PK\x01\x02":
+            raise UnsupportedUpload("ZIP central directory is corrupt")
+        (comp_size, uncomp_size, name_len, extra_len, comment_len) = struct.unpack(
+            "<IIHHH", directory[pos + 20:pos + 34]
+        )
+        (local_offset,) = struct.unpack("<I", directory[pos + 42:pos + 46])
+        name = directory[pos + 46:pos + 46 + name_len].decode("utf-8", errors="replace")
+        if local_offset != 0xFFFFFFFF and comp_size != 0xFFFFFFFF and local_offset + comp_size > size:
+            raise UnsupportedUpload(f"ZIP entry '{name}' is truncated")
+        entries[name] = uncomp_size
+        pos += 46 + name_len + extra_len + comment_len
+    return entries
+
+
+def _zip_member_header(zf: zipfile.ZipFile, name: str, names: list[str]) -> dict:
+    """Parse the header of the chosen image inside a ZIP (headers only)."""
+    lower = name.lower()
+    if lower.endswith(".mhd"):
+        with zf.open(name) as f:
+            text = f.read(HEAD_SIZE)
+        split = _split_text_header(text + b"\n", terminator_key="ElementDataFile")
+        if split is None:
+            raise UnsupportedUpload(f"MetaImage header '{name}' is incomplete")
+        header = _parse_mhd(split[0])
+        data_file = header["data_file"]
+        if data_file.upper() != "LOCAL":
+            data_name = posixpath.join(posixpath.dirname(name), data_file.replace("\\", "/"))
+            if data_name not in names:
+                raise UnsupportedUpload(f"ZIP is missing '{data_file}' referenced by '{name}'")
+            itemsize = header.get("itemsize") or 0
+            if itemsize and not header["compressed"]:
+                expected = math.prod(header["dimensions"]) * itemsize
+                actual = zf.getinfo(data_name).file_size - header["header_size"]
+                if actual < expected:
+                    raise UnsupportedUpload(
+                        f"'{data_file}' is truncated: {actual} of {expected} bytes"
+                    )
+        return header
+
+    if lower.endswith(".nrrd"):
+        with zf.open(name) as f:
+            text = f.read(HEAD_SIZE)
+        split = _split_text_header(text)
+        if split is None:
+            raise UnsupportedUpload(f"NRRD header '{name}' is incomplete")
+        return _parse_nrrd(split[0])
+
+    with zf.open(name) as f:
+        raw = f.read(4096)
+    if raw[:2] == b"\x1f\x8b":
+        try:
+            raw = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(raw, 4096)
+        except zlib.error as exc:
+            raise UnsupportedUpload(f"'{name}' in ZIP is not a valid gzip file: {exc}")
+    header = _nifti_from_bytes(raw)
+    if header is None:
+        raise UnsupportedUpload(f"'{name}' in ZIP is not a valid NIfTI file")
+    info = zf.getinfo(name)
+    if not lower.endswith(".gz") and info.file_size < _nifti_payload_size(header):
+        raise UnsupportedUpload(f"'{name}' in ZIP is truncated")
+    return header
@@ -0,0 +1,63 @@
+"""Streaming ZIP export – all organ STLs of a scan in one response.
+
+The archive is produced on the fly while the response is sent: each STL
+is copied in ``CHUNK_SIZE`` blocks into a ``zipfile.ZipFile`` writing to
+an unseekable sink, and whatever the sink holds is yielded after every
+block.  Memory stays at about one block regardless of the number or size
+of the meshes, and nothing is written to disk.
+
+Entries are stored, not deflated – binary STLs shrink little and the
+export should run at disk speed.  Because the sink cannot seek,
+``zipfile`` emits data descriptors after each entry (general purpose
+bit 3), which every unzip tool understands.
+"""
+
+import zipfile
+from pathlib import Path
+from typing import Iterator
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _Sink:
+    """Write-only file object that collects what ``zipfile`` writes."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def iter_zip(files: list[tuple[str, Path]]) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive of *files* (``(arcname, path)`` pairs) piece by piece.
+
+    Blocking file I/O – iterate it off the event loop (``StreamingResponse``
+    does so for plain iterators).
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_STORED
+            force_zip64 = info.file_size >= zipfile.ZIP64_LIMIT
+            with open(path, "rb") as src, zf.open(info, "w", force_zip64=force_zip64) as dst:
+                while block := src.read(CHUNK_SIZE):
+                    dst.write(block)
+                    if data := sink.drain():
+                        yield data
+            if data := sink.drain():
+                yield data
+    # Central directory
+    if data := sink.drain():
+        yield data
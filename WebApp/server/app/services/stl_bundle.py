@@ -0,0 +1,524 @@
+"""Bulk STL ingest – all organ meshes of a scan in one streamed archive.
+
+Clients send a single tar (optionally gzipped) or zip containing
+``<organ>.stl`` or ``<organ>.ply`` members plus an optional
+``manifest.json``::
+
+    {"files": [{"organ": "liver", "file": "liver.ply",
+                "size": 1234567, "sha256": "…"}, …]}
+
+Tar archives are parsed while the body streams in, so every member is
+written straight to a staged part file in ``stl/``.  ZIP needs its central
+directory, so the body is spooled to disk first and extracted in one pass.
+Nothing becomes visible until ``commit_bundle`` has checked the manifest,
+renamed every part into place and written ``stl_files`` with a single
+metadata save.  PLY members are validated like single-file uploads, and
+each organ keeps one format: committing a mesh removes the organ's file in
+the other format.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import posixpath
+import uuid
+import zipfile
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from app.config import MAX_STL_BUNDLE_SIZE, MAX_STL_SIZE, UPLOAD_CHUNK_SIZE
+from app.services import timeline
+from app.services.meshes import MESH_SUFFIXES, MeshError, remove_other_formats, validate_ply
+from app.storage import AsyncFileWriter, get_scan_dir, load_metadata, run_io, save_metadata
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+_MAX_MANIFEST_SIZE = 1024 * 1024
+_BLOCK = 512
+
+
+class BundleError(ValueError):
+    """Raised for archives that cannot be ingested (``status_code`` 400/413/415/422)."""
+
+    def __init__(self, message: str, status_code: int = 422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def safe_organ_name(name: str) -> str:
+    """Same sanitising as the single-file STL route."""
+    return "".join(c for c in name if c.isalnum() or c in "_-").lower()
+
+
+def _mesh_suffix(name: str) -> Optional[str]:
+    """``".stl"`` / ``".ply"`` for a mesh member, ``None`` for anything else."""
+    suffix = posixpath.splitext(name)[1].lower()
+    return suffix if suffix in MESH_SUFFIXES else None
+
+
+def _check_member(name: str, part: dict):
+    """Reject a staged PLY member that ``validate_ply`` refuses.  Blocking."""
+    if part["suffix"] != ".ply":
+        return
+    try:
+        validate_ply(part["path"])
+    except MeshError as e:
+        raise BundleError(f"{name}: invalid PLY: {e}", 400)
+
+
+# ── Streaming tar parser ─────────────────────────────────────────────────
+
+class TarStreamParser:
+    """
+    Incremental ustar / pax / GNU tar reader.
+
+    ``feed()`` takes arbitrary slices of the archive and returns events:
+    ``("file", name, size)``, ``("data", bytes)`` and ``("end",)`` for
+    regular files.  Directories, links and other entries are skipped.
+    """
+
+    def __init__(self):
+        self._header = bytearray()
+        self._remaining = 0
+        self._pad = 0
+        self._kind: Optional[bytes] = None
+        self._meta = bytearray()
+        self._next_name: Optional[str] = None
+        self.done = False
+
+    def feed(self, data: bytes) -> list[tuple]:
+        events: list[tuple] = []
+        view = memoryview(data)
+        pos, n = 0, len(view)
+        while pos < n and not self.done:
+            if self._remaining:
+                take = min(self._remaining, n - pos)
+                self._member_data(bytes(view[pos:pos + take]), events)
+                pos += take
+                self._remaining -= take
+                if not self._remaining:
+                    self._member_end(events)
+                continue
+            if self._pad:
+                take = min(self._pad, n - pos)
+                pos += take
+                self._pad -= take
+                continue
+            take = min(_BLOCK - len(self._header), n - pos)
+            self._header += view[pos:pos + take]
+            pos += take
+            if len(self._header) == _BLOCK:
+                header = bytes(self._header)
+                self._header.clear()
+                self._member_start(header, events)
+        return events
+
+    def close(self):
+        """Raise if the stream ended in the middle of a member."""
+        if self._remaining or self._header:
+            raise BundleError("Truncated tar archive")
+
+    def _member_start(self, header: bytes, events: list):
+        if header == bytes(_BLOCK):
+            # First end-of-archive block – anything after it is padding
+            self.done = True
+            return
+
+        try:
+            stored = int(header[148:156].strip(b"\0 ") or b"0", 8)
+        except ValueError:
+            raise BundleError("Not a tar archive", 415)
+        if stored != sum(header[:148]) + 8 * 32 + sum(header[156:]):
+            raise BundleError("Corrupt tar header (checksum mismatch)")
+
+        size_field = header[124:136]
+        if size_field[0] & 0x80:
+            size = int.from_bytes(size_field[1:], "big")
+        else:
+            size = int(size_field.strip(b"\0 ") or b"0", 8)
+
+        kind = header[156:157]
+        name = header[0:100].split(b"\0", 1)[0].decode("utf-8", "replace")
+        if header[257:262] == b"ustar":
+            prefix = header[345:500].split(b"\0", 1)[0].decode("utf-8", "replace")
+            if prefix:
+                name = f"{prefix}/{name}"
+
+        if kind in (b"0", b"\0", b"7"):
+            self._kind = b"0"
+            name = self._next_name or name
+            self._next_name = None
+            events.append(("file", name, size))
+        elif kind in (b"x", b"L"):
+            if size > _MAX_MANIFEST_SIZE:
+                raise BundleError("Oversized tar extended header")
+            self._kind = kind
+            self._meta.clear()
+        else:
+            self._kind = None  # directory, link, global pax header …
+
+        self._remaining = size
+        self._pad = -size % _BLOCK
+        if not size:
+            self._member_end(events)
+
+    def _member_data(self, chunk: bytes, events: list):
+        if self._kind == b"0":
+            events.append(("data", chunk))
+        elif self._kind is not None:
+            self._meta += chunk
+
+    def _member_end(self, events: list):
+        if self._kind == b"0":
+            events.append(("end",))
+        elif self._kind == b"L":
+            self._next_name = self._meta.split(b"\0", 1)[0].decode("utf-8", "replace")
+        elif self._kind == b"x":
+            path = _pax_path(bytes(self._meta))
+            if path:
+                self._next_name = path
+        self._kind = None
+
+
+def _pax_path(data: bytes) -> Optional[str]:
+    """Extract the ``path`` record from a pax extended header."""
+    pos = 0
+    while pos < len(data):
+        space = data.find(b" ", pos)
+        if space < 0:
+            break
+        try:
+            length = int(data[pos:space])
+        except ValueError:
+            break
+        record = data[space + 1:pos + length - 1]
+        key, _, value = record.partition(b"=")
+        if key == b"path":
+            return value.decode("utf-8", "replace")
+        pos += length
+    return None
+
+
+# ── Receiving ────────────────────────────────────────────────────────────
+
+class StlBundleReceiver:
+    """
+    Consume an archive request body chunk by chunk and stage its members.
+
+        receiver = StlBundleReceiver(scan_id)
+        async for chunk in request.stream():
+            await receiver.feed(chunk)
+        await receiver.finish()
+        result = await run_io(commit_bundle, scan_id, receiver.staged, receiver.manifest)
+        ...
+        await receiver.cleanup()   # always, also after errors
+    """
+
+    def __init__(self, scan_id: str):
+        self.stl_dir = get_scan_dir(scan_id) / "stl"
+        self.stl_dir.mkdir(exist_ok=True)
+        self.token = uuid.uuid4().hex
+        self.staged: dict[str, dict] = {}
+        self.manifest: Optional[dict] = None
+        self.received = 0
+        self._parts = itertools.count()
+        self._superseded: list[Path] = []  # parts of members repeated later in the archive
+
+        self._head = b""
+        self._mode: Optional[str] = None  # "tar" | "zip"
+        self._gunzip = None
+        self._unpacked = 0
+        self._tar: Optional[TarStreamParser] = None
+        self._spool: Optional[Path] = None
+        self._spool_writer: Optional[AsyncFileWriter] = None
+        self._member: Optional[dict] = None
+        self._writer: Optional[AsyncFileWriter] = None
+        self._manifest_buf: Optional[bytearray] = None
+
+    def _part_path(self) -> Path:
+        return self.stl_dir / f".bundle-{self.token}-{next(self._parts)}.part"
+
+    def _stage(self, name: str, part: dict):
+        """Record a member; a repeated name replaces the earlier one, as in tar."""
+        previous = self.staged.get(name)
+        if previous is not None:
+            logger.info("Archive member %s appears again – the later copy wins", name)
+            self._superseded.append(previous["path"])
+        self.staged[name] = part
+
+    async def feed(self, chunk: bytes):
+        self.received += len(chunk)
+        if self.received > MAX_STL_BUNDLE_SIZE:
+            raise BundleError("STL archive too large", 413)
+
+        if self._mode is None:
+            self._head += chunk
+            if len(self._head) < 4:
+                return
+            chunk, self._head = self._head, b""
+            await self._start(chunk)
+
+        if self._mode == "zip":
+            await self._spool_writer.write(chunk)
+            return
+
+        if self._gunzip is not None:
+            chunk = self._gunzip.decompress(chunk)
+            self._unpacked += len(chunk)
+            if self._unpacked > MAX_STL_BUNDLE_SIZE:
+                raise BundleError("STL archive too large", 413)
+        await self._feed_tar(chunk)
+
+    async def _start(self, head: bytes):
+        if head.startswith(b"PK\x03\x04"):
+            self._mode = "zip"
+            self._spool = self.stl_dir / f".bundle-{self.token}.zip"
+            self._spool_writer = AsyncFileWriter(self._spool)
+            await self._spool_writer.__aenter__()
+        else:
+            self._mode = "tar"
+            self._tar = TarStreamParser()
+            if head.startswith(b"\x1f\x8b"):
+                self._gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    async def _feed_tar(self, data: bytes):
+        for event in self._tar.feed(data):
+            kind = event[0]
+            if kind == "file":
+                await self._open_member(event[1], event[2])
+            elif kind == "data":
+                if self._manifest_buf is not None:
+                    self._manifest_buf += event[1]
+                elif self._writer is not None:
+                    await self._writer.write(event[1])
+            else:
+                await self._close_member()
+
+    async def _open_member(self, name: str, size: int):
+        base = posixpath.basename(name)
+        if base == MANIFEST_NAME:
+            if size > _MAX_MANIFEST_SIZE:
+                raise BundleError("manifest.json too large")
+            self._manifest_buf = bytearray()
+            return
+        suffix = _mesh_suffix(base)
+        if suffix is None:
+            logger.info("Skipping non-mesh archive member %s", name)
+            return
+        if size > MAX_STL_SIZE:
+            raise BundleError(f"{name}: mesh file too large", 413)
+        part = self._part_path()
+        self._member = {"name": name, "path": part, "suffix": suffix, "size": size, "sha256": hashlib.sha256()}
+        self._writer = AsyncFileWriter(part, hasher=self._member["sha256"])
+        await self._writer.__aenter__()
+
+    async def _close_member(self):
+        if self._manifest_buf is not None:
+            self.manifest = _parse_manifest(bytes(self._manifest_buf))
+            self._manifest_buf = None
+        elif self._writer is not None:
+            await self._writer.__aexit__(None, None, None)
+            member = self._member
+            part = {
+                "path": member["path"],
+                "suffix": member["suffix"],
+                "size": member["size"],
+                "sha256": member["sha256"].hexdigest(),
+            }
+            self._stage(member["name"], part)
+            self._writer = None
+            self._member = None
+            await run_io(_check_member, member["name"], part)
+
+    async def finish(self):
+        """Complete the archive after the last body chunk."""
+        if self._mode is None:
+            if not self._head:
+                raise BundleError("Empty request body", 400)
+            chunk, self._head = self._head, b""
+            await self._start(chunk)
+            if self._mode == "zip":
+                await self._spool_writer.write(chunk)
+            else:
+                await self._feed_tar(chunk)
+
+        if self._mode == "zip":
+            await self._spool_writer.__aexit__(None, None, None)
+            self._spool_writer = None
+            await run_io(self._extract_zip)
+            return
+
+        if self._gunzip is not None:
+            if not self._gunzip.eof:
+                raise BundleError("Truncated gzip stream")
+            await self._feed_tar(self._gunzip.flush())
+        self._tar.close()
+
+    def _extract_zip(self):
+        try:
+            archive = zipfile.ZipFile(self._spool)
+        except zipfile.BadZipFile:
+            raise BundleError("Corrupt ZIP archive")
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                base = posixpath.basename(info.filename)
+                if base == MANIFEST_NAME:
+                    if info.file_size > _MAX_MANIFEST_SIZE:
+                        raise BundleError("manifest.json too large")
+                    self.manifest = _parse_manifest(archive.read(info))
+                    continue
+                suffix = _mesh_suffix(base)
+                if suffix is None:
+                    continue
+                if info.file_size > MAX_STL_SIZE:
+                    raise BundleError(f"{info.filename}: mesh file too large", 413)
+
+                part = self._part_path()
+                hasher = hashlib.sha256()
+                size = 0
+                with archive.open(info) as src, open(part, "wb") as dst:
+                    while block := src.read(UPLOAD_CHUNK_SIZE):
+                        size += len(block)
+                        if size > MAX_STL_SIZE:
+                            raise BundleError(f"{info.filename}: mesh file too large", 413)
+                        hasher.update(block)
+                        dst.write(block)
+                staged = {"path": part, "suffix": suffix, "size": size, "sha256": hasher.hexdigest()}
+                self._stage(info.filename, staged)
+                _check_member(info.filename, staged)
+        self._spool.unlink()
+        self._spool = None
+
+    async def cleanup(self):
+        """Close open files and remove every part that was not committed."""
+        for writer in (self._writer, self._spool_writer):
+            if writer is not None:
+                try:
+                    await writer.__aexit__(None, None, None)
+                except OSError:
+                    pass
+        self._writer = self._spool_writer = None
+        await run_io(self._remove_leftovers)
+
+    def _remove_leftovers(self):
+        paths = [self._spool, *(s["path"] for s in self.staged.values()), *self._superseded]
+        if self._member is not None:
+            paths.append(self._member["path"])
+        for path in paths:
+            if path is None:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _parse_manifest(data: bytes) -> dict:
+    try:
+        manifest = json.loads(data)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise BundleError("manifest.json is not valid JSON")
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), list):
+        raise BundleError("manifest.json must contain a 'files' list")
+    return manifest
+
+
+# ── Commit ───────────────────────────────────────────────────────────────
+
+def _resolve(staged: dict[str, dict], manifest: Optional[dict]) -> dict[str, dict]:
+    """Map organ name → staged part, validated against the manifest."""
+    by_base = {posixpath.basename(name): part for name, part in staged.items()}
+    organs: dict[str, dict] = {}
+
+    if manifest is None:
+        for name, part in staged.items():
+            organ = safe_organ_name(posixpath.splitext(posixpath.basename(name))[0])
+            if organ:
+                organs[organ] = part
+        return organs
+
+    for entry in manifest["files"]:
+        file_name = entry.get("file") if isinstance(entry, dict) else None
+        if not file_name or not isinstance(file_name, str):
+            raise BundleError("manifest.json entries need a 'file' name")
+        size, sha256, organ = entry.get("size"), entry.get("sha256"), entry.get("organ")
+        if size is not None and (not isinstance(size, int) or isinstance(size, bool)):
+            raise BundleError(f"{file_name}: 'size' in manifest.json must be an integer")
+        if sha256 is not None and not isinstance(sha256, str):
+            raise BundleError(f"{file_name}: 'sha256' in manifest.json must be a string")
+        if organ is not None and not isinstance(organ, str):
+            raise BundleError(f"{file_name}: 'organ' in manifest.json must be a string")
+        part = staged.get(file_name) or by_base.get(posixpath.basename(file_name))
+        if part is None:
+            raise BundleError(f"{file_name} is listed in manifest.json but missing from the archive")
+        if any(other is part for other in organs.values()):
+            raise BundleError(f"{file_name} is listed more than once in manifest.json")
+        if size is not None and size != part["size"]:
+            raise BundleError(f"{file_name}: size mismatch ({part['size']} != {size})")
+        if sha256 and sha256.lower() != part["sha256"]:
+            raise BundleError(f"{file_name}: checksum mismatch")
+        organ = safe_organ_name(organ or posixpath.splitext(posixpath.basename(file_name))[0])
+        if not organ:
+            raise BundleError(f"{file_name}: invalid organ name")
+        organs[organ] = part
+    return organs
+
+
+def commit_bundle(
+    scan_id: str,
+    staged: dict[str, dict],
+    manifest: Optional[dict],
+    started: Optional[float] = None,
+    received: Optional[int] = None,
+) -> dict:
+    """
+    Move the staged meshes into ``stl/`` and record them in one metadata save.
+    The scan's status is not changed here – only the worker's completion
+    callback marks the segmentation complete.
+
+    Each organ's mesh replaces its file in the other format, if any.  The
+    returned ``{organ: {size, sha256, format}}`` names the stored files.
+
+    With *started* (epoch seconds the request began) the transfer is
+    recorded as the ``stl_upload`` stage of the timeline.
+
+    Blocking – run via ``run_io`` while holding ``metadata_lock(scan_id)``.
+    Parts not referenced by the manifest are left for
+    ``StlBundleReceiver.cleanup``.
+    """
+    organs = _resolve(staged, manifest)
+    if not organs:
+        raise BundleError("No STL or PLY files in archive")
+
+    stl_dir = get_scan_dir(scan_id) / "stl"
+    for organ, part in organs.items():
+        path = stl_dir / f"{organ}{part['suffix']}"
+        os.replace(part["path"], path)
+        remove_other_formats(stl_dir, organ, path)
+
+    uploaded_at = datetime.utcnow().isoformat() + "Z"
+    metadata = load_metadata(scan_id)
+    stl_files = metadata.setdefault("stl_files", {})
+    for organ, part in organs.items():
+        stl_files[organ] = {
+            "size": part["size"],
+            "sha256": part["sha256"],
+            "format": part["suffix"][1:],
+            "uploaded_at": uploaded_at,
+        }
+    if started is not None:
+        timeline.record(metadata, "stl_upload", started, nbytes=received, files=len(organs))
+    save_metadata(scan_id, metadata)
+
+    logger.info("Ingested %d meshes for scan %s in one archive", len(organs), scan_id)
+    return {
+        organ: {"size": part["size"], "sha256": part["sha256"], "format": part["suffix"][1:]}
+        for organ, part in organs.items()
+    }
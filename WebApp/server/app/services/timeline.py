@@ -0,0 +1,138 @@
+"""Per-stage pipeline timing – the ``timeline`` of a scan's metadata.
+
+Every stage a scan goes through records when it started and finished, how
+long it took and, where it moves data, how many bytes::
+
+    "timeline": {
+        "upload":       {"started_at": "...Z", "finished_at": "...Z", "duration": 41.2, "bytes": 524288000},
+        "ingest":       {...},                      # canonical CT for the worker
+        "runpod_queue": {...},                      # submitted → worker started
+        "download":     {...},                      # worker: CT download
+        "decode":       {...},                      # worker: CT → uncompressed NIfTI
+        "segmentation": {...},                      # worker: TotalSegmentator
+        "meshing":      {..., "organs": {"liver": 1.9, ...}},
+        "stl_upload":   {...},                      # meshes received by the API
+        "blender_prepare": {..., "runs": 3},        # per-organ preparation jobs
+        "blender_import":  {...}, "blender_remesh": {...}, "blender_export": {...},
+        "post_processing": {...},                   # the whole FBX assembly
+    }
+
+A stage that runs again (re-processing) replaces its entry, except
+``accumulate`` stages such as ``blender_prepare`` which add up.  Worker
+stages arrive with the handler's output (completion callback or RunPod
+status) and carry the worker's clock, so
+``runpod_queue`` is only as exact as the two clocks agree.
+"""
+
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+# Stages reported by the segmentation worker
+WORKER_STAGES = ("download", "decode", "segmentation", "meshing", "stl_upload")
+# Stages that survive a reset – they describe the scan, not a processing run
+_KEPT_ON_RESET = ("upload", "ingest")
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+def parse_time(value: str) -> Optional[float]:
+    """Epoch seconds of an ISO timestamp as written by the API (or None)."""
+    try:
+        return datetime.fromisoformat(value.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def record(
+    metadata: dict,
+    stage: str,
+    started: float,
+    finished: Optional[float] = None,
+    nbytes: Optional[int] = None,
+    duration: Optional[float] = None,
+    accumulate: bool = False,
+    **extra,
+) -> dict:
+    """
+    Store a stage that ran from *started* to *finished* (epoch seconds,
+    default now).  *duration* overrides ``finished - started`` for stages
+    interleaved with others.  Returns the entry; the caller saves the
+    metadata.
+    """
+    finished = time.time() if finished is None else finished
+    timeline = metadata.setdefault("timeline", {})
+    previous = timeline.get(stage) if accumulate else None
+    if duration is None:
+        duration = max(finished - started, 0.0)
+
+    if previous:
+        entry = dict(previous)
+        entry["finished_at"] = _iso(finished)
+        entry["duration"] = round(previous.get("duration", 0.0) + duration, 3)
+        entry["runs"] = previous.get("runs", 1) + 1
+        if nbytes is not None:
+            entry["bytes"] = previous.get("bytes", 0) + nbytes
+    else:
+        entry = {
+            "started_at": _iso(started),
+            "finished_at": _iso(finished),
+            "duration": round(duration, 3),
+        }
+        if nbytes is not None:
+            entry["bytes"] = nbytes
+        if accumulate:
+            entry["runs"] = 1
+    entry.update(extra)
+    timeline[stage] = entry
+    return entry
+
+
+@contextmanager
+def stage(metadata: dict, name: str, **extra) -> Iterator[dict]:
+    """
+    Time the ``with`` block as stage *name*.
+
+    The yielded dict is stored with the entry – set ``bytes`` or other
+    details on it.  A block that raises is recorded with ``failed``.
+    """
+    details: dict = dict(extra)
+    started = time.time()
+    try:
+        yield details
+    except BaseException:
+        details["failed"] = True
+        raise
+    finally:
+        nbytes = details.pop("bytes", None)
+        record(metadata, name, started, nbytes=nbytes, **details)
+
+
+def merge_worker(metadata: dict, reported) -> None:
+    """
+    Add the stages reported by the segmentation worker and derive the
+    RunPod queue wait from them.  Malformed input is ignored.
+    """
+    if not isinstance(reported, dict):
+        return
+    timeline = metadata.setdefault("timeline", {})
+    for name in WORKER_STAGES:
+        entry = reported.get(name)
+        if isinstance(entry, dict) and isinstance(entry.get("duration"), (int, float)):
+            timeline[name] = entry
+
+    submitted = parse_time(metadata.get("processing_started_at"))
+    worker_started = parse_time((timeline.get("download") or {}).get("started_at"))
+    if submitted is not None and worker_started is not None:
+        # An idle worker can start before the submission is stored
+        record(metadata, "runpod_queue", submitted, max(worker_started, submitted))
+
+
+def reset(metadata: dict) -> None:
+    """Drop the stages of the previous processing run."""
+    timeline = metadata.get("timeline")
+    if timeline:
+        metadata["timeline"] = {k: v for k, v in timeline.items() if k in _KEPT_ON_RESET}
@@ -1,10 +1,35 @@
 """Low-level helpers for scan storage and metadata persistence."""
 
+import asyncio
+import functools
 import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional
 
-from app.config import DATA_DIR
+from app.config import DATA_DIR, IO_WORKERS, UPLOAD_CHUNK_SIZE, UPLOADS_DIR
+from app.events import bus
+
+_io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="ar4ct-io")
+
+# One lock per scan for load → modify → save of its metadata.json
+_metadata_locks: dict[str, asyncio.Lock] = {}
+
+
+async def run_io(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking file-system call on the bounded I/O executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor, functools.partial(func, *args, **kwargs))
+
+
+def is_valid_scan_id(scan_id: str) -> bool:
+    """Scan IDs are canonical UUID strings – anything else never names a scan directory."""
+    try:
+        return str(uuid.UUID(scan_id)) == scan_id
+    except (ValueError, TypeError, AttributeError):
+        return False
 
 
 def get_scan_dir(scan_id: str) -> Path:
@@ -27,15 +52,65 @@ def load_metadata(scan_id: str) -> Optional[dict]:
 
 
 def save_metadata(scan_id: str, metadata: dict):
-    """Save metadata for a scan."""
+    """
+    Save metadata for a scan.
+
+    Written to a temp file and renamed into place so concurrent readers
+    never see a half-written JSON document.  Every write is published on
+    the event bus (see ``app.events``).
+    """
     metadata_path = get_metadata_path(scan_id)
-    with open(metadata_path, "w") as f:
+    tmp_path = metadata_path.with_name(f".metadata.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w") as f:
         json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, metadata_path)
+    bus.publish_metadata(scan_id, metadata)
+
+
+async def save_metadata_async(scan_id: str, metadata: dict):
+    """Save metadata for a scan without blocking the event loop."""
+    # Serialise on the loop so later in-place edits by the caller cannot
+    # race with the background write.
+    snapshot = json.loads(json.dumps(metadata))
+    await run_io(save_metadata, scan_id, snapshot)
+
+
+def metadata_lock(scan_id: str) -> asyncio.Lock:
+    """
+    The scan's metadata lock.  Hold it from ``load_metadata`` to
+    ``save_metadata`` whenever another task (STL uploads, jobs, callbacks)
+    may update the same scan meanwhile – a save writes the whole document.
+    """
+    return _metadata_locks.setdefault(scan_id, asyncio.Lock())
+
+
+def _apply_update(scan_id: str, update: Callable[[dict], None]) -> Optional[dict]:
+    metadata = load_metadata(scan_id)
+    if metadata is None:
+        return None
+    update(metadata)
+    save_metadata(scan_id, metadata)
+    return metadata
+
+
+async def update_metadata(scan_id: str, update: Callable[[dict], None]) -> Optional[dict]:
+    """
+    Load the scan's metadata, apply ``update(metadata)`` in place and save
+    it, all under ``metadata_lock`` and on the I/O executor (*update* may
+    block).  Returns the saved metadata, or ``None`` if the scan has none.
+    """
+    async with metadata_lock(scan_id):
+        return await run_io(_apply_update, scan_id, update)
+
+
+def list_scan_ids() -> list[str]:
+    """IDs of all scans on disk."""
+    return [p.name for p in DATA_DIR.iterdir() if p.is_dir()]
 
 
 def scan_exists(scan_id: str) -> bool:
     """Check if a scan exists."""
-    return get_scan_dir(scan_id).exists()
+    return is_valid_scan_id(scan_id) and get_scan_dir(scan_id).exists()
 
 
 def get_fbx_path(scan_id: str) -> Optional[Path]:
@@ -52,3 +127,96 @@ def get_usdz_path(scan_id: str) -> Optional[Path]:
     if usdz_path.exists():
         return usdz_path
     return None
+
+
+class AsyncFileWriter:
+    """
+    Buffered file writer whose disk writes run on the I/O executor.
+
+    Incoming chunks are collected until ``chunk_size`` bytes are pending and
+    then written in one call.  An optional ``hasher`` is updated with the
+    same blocks on the I/O thread.  With ``offset`` the file is opened for
+    update, truncated at *offset* and appended to from there.
+
+        async with AsyncFileWriter(path) as out:
+            await out.write(chunk)
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        offset: Optional[int] = None,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        hasher=None,
+    ):
+        self.path = path
+        self.offset = offset
+        self.chunk_size = chunk_size
+        self.hasher = hasher
+        self._file = None
+        self._pending: list[bytes] = []
+        self._pending_size = 0
+
+    async def __aenter__(self) -> "AsyncFileWriter":
+        if self.offset is None:
+            self._file = await run_io(open, self.path, "wb")
+        else:
+            self._file = await run_io(open, self.path, "r+b")
+            await run_io(self._file.seek, self.offset)
+            await run_io(self._file.truncate)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.flush()
+        finally:
+            await run_io(self._file.close)
+
+    async def write(self, chunk: bytes):
+        """Queue *chunk*; flush to disk once ``chunk_size`` bytes are pending."""
+        self._pending.append(chunk)
+        self._pending_size += len(chunk)
+        if self._pending_size >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending bytes to disk."""
+        if not self._pending:
+            return
+        block = self._pending[0] if len(self._pending) == 1 else b"".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        await run_io(self._write_block, block)
+
+    def _write_block(self, block: bytes):
+        self._file.write(block)
+        if self.hasher is not None:
+            self.hasher.update(block)
+
+
+# ── Resumable uploads ────────────────────────────────────────────────────
+
+def get_upload_dir(upload_id: str) -> Path:
+    """Get the staging directory for a resumable upload."""
+    return UPLOADS_DIR / upload_id
+
+
+def get_upload_data_path(upload_id: str) -> Path:
+    """Get the path of the (partial) payload of a resumable upload."""
+    return get_upload_dir(upload_id) / "data"
+
+
+def load_upload_info(upload_id: str) -> Optional[dict]:
+    """Load the bookkeeping info (offset, length, filename …) of an upload."""
+    info_path = get_upload_dir(upload_id) / "info.json"
+    if info_path.exists():
+        with open(info_path, "r") as f:
+            return json.load(f)
+    return None
+
+
+def save_upload_info(upload_id: str, info: dict):
+    """Save the bookkeeping info of a resumable upload."""
+    info_path = get_upload_dir(upload_id) / "info.json"
+    with open(info_path, "w") as f:
+        json.dump(info, f, indent=2)
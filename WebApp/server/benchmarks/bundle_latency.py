@@ -0,0 +1,118 @@
+"""
+Benchmark – ``/bundle`` latency while large CT uploads are in flight.
+
+Creates a throw-away scan, starts N concurrent CT uploads of SIZE MB each
+against ``POST /scans/{id}/ct`` and meanwhile hammers
+``GET /scans/{id}/bundle``.  Prints p50 / p99 / max latency of the bundle
+requests with and without upload load, then deletes the scan.
+
+Usage (against a running server):
+    python benchmarks/bundle_latency.py --base-url http://localhost:8000 \
+        --uploads 4 --size-mb 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+class _ZeroFile:
+    """File-like object that yields *size* bytes without holding them in RAM."""
+
+    def __init__(self, size: int, name: str = "benchmark_ct.nii"):
+        self.size = size
+        self.name = name
+        self._pos = 0
+        self._block = bytes(1024 * 1024)
+
+    def read(self, n: int = -1) -> bytes:
+        remaining = self.size - self._pos
+        if remaining <= 0:
+            return b""
+        if n < 0 or n > len(self._block):
+            n = len(self._block)
+        n = min(n, remaining)
+        self._pos += n
+        return self._block[:n]
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+async def _probe_bundle(client: httpx.AsyncClient, scan_id: str, stop: asyncio.Event) -> list[float]:
+    latencies = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        resp = await client.get(f"/scans/{scan_id}/bundle")
+        resp.raise_for_status()
+        latencies.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(0.02)
+    return latencies
+
+
+async def _upload(client: httpx.AsyncClient, scan_id: str, size: int):
+    body = _ZeroFile(size)
+    resp = await client.post(
+        f"/scans/{scan_id}/ct",
+        files={"file": (body.name, body, "application/octet-stream")},
+        timeout=None,
+    )
+    resp.raise_for_status()
+
+
+def _report(label: str, latencies: list[float]):
+    print(
+        f"{label:<16} n={len(latencies):<6} "
+        f"p50={statistics.median(latencies):7.1f} ms  "
+        f"p99={_percentile(latencies, 99):7.1f} ms  "
+        f"max={max(latencies):7.1f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure /bundle latency under upload load")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--uploads", type=int, default=4, help="Concurrent uploads")
+    parser.add_argument("--size-mb", type=int, default=500, help="Size of each upload")
+    parser.add_argument("--idle-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        seed = await client.post(
+            "/scans/upload",
+            files={"file": ("benchmark.fbx", b"Kaydara FBX Binary  \x00", "application/octet-stream")},
+        )
+        seed.raise_for_status()
+        scan_id = seed.json()["scan_id"]
+
+        try:
+            stop = asyncio.Event()
+            probe = asyncio.create_task(_probe_bundle(client, scan_id, stop))
+            await asyncio.sleep(args.idle_seconds)
+            stop.set()
+            _report("idle", await probe)
+
+            stop = asyncio.Event()
+            probe = asyncio.create_task(_probe_bundle(client, scan_id, stop))
+            t0 = time.perf_counter()
+            await asyncio.gather(
+                *(_upload(client, scan_id, args.size_mb * 1024 * 1024) for _ in range(args.uploads))
+            )
+            elapsed = time.perf_counter() - t0
+            stop.set()
+            _report("during uploads", await probe)
+
+            total_mb = args.uploads * args.size_mb
+            print(f"Uploaded {total_mb} MB in {elapsed:.1f}s ({total_mb / elapsed:.1f} MB/s)")
+        finally:
+            await client.delete(f"/scans/{scan_id}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+Benchmark – DICOM series decode throughput.
+
+Writes a synthetic CT series (SLICES × SIZE² int16 slices, optionally RLE
+compressed) to a temporary folder and loads it through
+``app.services.dicom.load_dicom_series`` once serially and once per
+requested process-pool size.  Prints slices/s and decoded MB/s; pool
+start-up (spawning workers) is timed separately in a warm-up pass.
+
+Usage (from WebApp/server):
+    python benchmarks/dicom_decode.py --slices 400 --size 512 --workers 2 4 8
+    python benchmarks/dicom_decode.py --compress rle
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.dicom import load_dicom_series  # noqa: E402
+
+
+def _write_series(directory: Path, slices: int, size: int, compress: str):
+    import pydicom
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, RLELossless, generate_uid
+
+    rng = np.random.default_rng(0)
+    series_uid = generate_uid()
+    study_uid = generate_uid()
+    # Smooth-ish body phantom so RLE has something realistic to chew on
+    yy, xx = np.mgrid[:size, :size]
+    body = ((xx - size / 2) ** 2 + (yy - size / 2) ** 2) < (0.4 * size) ** 2
+
+    for i in range(slices):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = "CT"
+        ds.InstanceNumber = i + 1
+        ds.ImagePositionPatient = [-size / 2 * 0.7, -size / 2 * 0.7, i * 1.25]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [0.7, 0.7]
+        ds.SliceThickness = 1.25
+        ds.Rows = ds.Columns = size
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 12
+        ds.HighBit = 11
+        ds.PixelRepresentation = 0
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+
+        pixels = np.where(body, 1064, 24) + rng.integers(0, 40, (size, size))
+        ds.PixelData = pixels.astype(np.uint16).tobytes()
+        if compress == "rle":
+            ds.compress(RLELossless)
+        # Shuffled file names – the loader must sort by position
+        pydicom.dcmwrite(directory / f"IM{(i * 7919) % slices:05d}.dcm", ds, enforce_file_format=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure DICOM series decode throughput")
+    parser.add_argument("--slices", type=int, default=300)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--compress", choices=["none", "rle"], default="none")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        t0 = time.perf_counter()
+        _write_series(directory, args.slices, args.size, args.compress)
+        print(f"Wrote {args.slices} slices ({args.compress}) in {time.perf_counter() - t0:.1f}s")
+
+        decoded_mb = args.slices * args.size * args.size * 2 / (1024 * 1024)
+        baseline = None
+        for workers in [1, *args.workers]:
+            t0 = time.perf_counter()
+            load_dicom_series(directory, workers=workers)  # warm-up: spawn pool, fill page cache
+            warmup = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            volume, spacing, _origin, _affine = load_dicom_series(directory, workers=workers)
+            elapsed = time.perf_counter() - t0
+            baseline = baseline or elapsed
+            print(
+                f"workers={workers:<3} {elapsed:6.2f}s  "
+                f"{args.slices / elapsed:7.1f} slices/s  "
+                f"{decoded_mb / elapsed:7.1f} MB/s  "
+                f"speed-up {baseline / elapsed:4.1f}×  "
+                f"(warm-up {warmup:.1f}s)  "
+                f"shape={volume.shape} spacing={tuple(round(s, 3) for s in spacing)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
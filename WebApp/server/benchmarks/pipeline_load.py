@@ -0,0 +1,123 @@
+"""
+Benchmark – end-to-end pipeline throughput (upload → segment → Blender → bundle).
+
+Uploads N synthetic CT volumes (SIZE³ voxels, NIfTI) concurrently through
+``POST /scans/upload``, which starts segmentation on its own, then polls
+each scan until it is ``completed`` or ``error`` and fetches its
+``/bundle``.  Prints, per scan, when each status was first seen, and the
+overall throughput.
+
+Meant to run against the local RunPod stand-in so no GPU is needed:
+
+    cd WebApp/totalsegmentator && python fake_runpod.py --port 8010 --workers 2 --delay 5
+    cd WebApp/server && RUNPOD_BASE_URL=http://localhost:8010/v2 RUNPOD_API_KEY=x \
+        RUNPOD_ENDPOINT_ID=fake API_BASE_URL=http://localhost:8000 uvicorn main:app --port 8000
+    python benchmarks/pipeline_load.py --scans 8 --size 96
+"""
+
+import argparse
+import asyncio
+import gzip
+import statistics
+import time
+
+import httpx
+import numpy as np
+
+STAGES = ("processing", "segmented", "post_processing", "completed")
+FINAL_STATES = ("completed", "error")
+
+
+def _synthetic_ct(size: int) -> bytes:
+    """Gzipped NIfTI of a soft-tissue ellipsoid in air."""
+    import nibabel as nib
+
+    grid = np.ogrid[:size, :size, :size]
+    inside = sum(((g - size / 2) / (size * r)) ** 2 for g, r in zip(grid, (0.4, 0.3, 0.45))) <= 1
+    volume = np.where(inside, 40, -1000).astype(np.int16)
+    img = nib.Nifti1Image(volume, np.diag([1.5, 1.5, 1.5, 1.0]))
+    return gzip.compress(img.to_bytes(), compresslevel=1)
+
+
+async def _run_scan(client: httpx.AsyncClient, index: int, body: bytes, poll: float, timeout: float) -> dict:
+    t0 = time.perf_counter()
+    resp = await client.post(
+        "/scans/upload",
+        files={"file": (f"benchmark_{index}.nii.gz", body, "application/gzip")},
+        timeout=None,
+    )
+    resp.raise_for_status()
+    scan_id = resp.json()["scan_id"]
+    result = {"scan_id": scan_id, "upload": time.perf_counter() - t0, "seen": {}}
+
+    status = None
+    while status not in FINAL_STATES:
+        if time.perf_counter() - t0 > timeout:
+            status = "timeout"
+            break
+        await asyncio.sleep(poll)
+        metadata = (await client.get(f"/scans/{scan_id}")).json()
+        status = metadata.get("status")
+        result["seen"].setdefault(status, time.perf_counter() - t0)
+    result["status"] = status
+    result["organs"] = len(metadata.get("stl_files") or {})
+    result["error"] = metadata.get("processing_error")
+
+    t1 = time.perf_counter()
+    bundle = await client.get(f"/scans/{scan_id}/bundle")
+    result["bundle_ms"] = (time.perf_counter() - t1) * 1000 if bundle.status_code == 200 else None
+    result["total"] = time.perf_counter() - t0
+    return result
+
+
+def _fmt(seconds) -> str:
+    return f"{seconds:7.1f}s" if seconds is not None else "      –"
+
+
+def _report(results: list[dict], elapsed: float):
+    print(f"{'scan':<38} {'upload':>8} " + " ".join(f"{s:>16}" for s in STAGES) + f" {'organs':>7}  status")
+    for r in results:
+        stages = " ".join(f"{_fmt(r['seen'].get(s)):>16}" for s in STAGES)
+        print(f"{r['scan_id']:<38} {_fmt(r['upload'])} {stages} {r['organs']:>7}  {r['status']}")
+        if r["error"]:
+            print(f"    error: {r['error']}")
+
+    done = [r for r in results if r["status"] == "completed"]
+    print(f"\n{len(done)}/{len(results)} completed in {elapsed:.1f}s "
+          f"({len(done) / elapsed * 60:.1f} scans/min)")
+    if done:
+        totals = [r["seen"]["completed"] for r in done]
+        print(f"time to completed: p50={statistics.median(totals):.1f}s max={max(totals):.1f}s")
+    bundles = [r["bundle_ms"] for r in results if r["bundle_ms"] is not None]
+    if bundles:
+        print(f"/bundle: p50={statistics.median(bundles):.1f} ms max={max(bundles):.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure end-to-end pipeline throughput")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--scans", type=int, default=4, help="Scans uploaded concurrently")
+    parser.add_argument("--size", type=int, default=96, help="Voxels per axis of the synthetic CT")
+    parser.add_argument("--poll", type=float, default=1.0, help="Status poll interval (s)")
+    parser.add_argument("--timeout", type=float, default=1800.0, help="Give up on a scan after this long (s)")
+    parser.add_argument("--keep", action="store_true", help="Keep the scans instead of deleting them")
+    args = parser.parse_args()
+
+    body = _synthetic_ct(args.size)
+    print(f"Synthetic CT: {args.size}³ voxels, {len(body) / 1024:.0f} KB gzipped")
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        t0 = time.perf_counter()
+        results = await asyncio.gather(
+            *(_run_scan(client, i, body, args.poll, args.timeout) for i in range(args.scans))
+        )
+        elapsed = time.perf_counter() - t0
+        _report(results, elapsed)
+
+        if not args.keep:
+            for r in results:
+                await client.delete(f"/scans/{r['scan_id']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+"""
+Benchmark – body-surface extraction: "full" vs. "fast" mode.
+
+Writes a synthetic int16 CT (a noisy torso with lungs, air pin-holes under
+the skin, dense specks just outside it, a separate patient table and air)
+as NIfTI and runs ``handler.extract_body_surface`` once per mode, each in
+a fresh process so peak memory is measured in isolation.  Prints wall
+time, peak RSS above the process baseline, triangle count and the mean /
+99th-percentile distance between the two surfaces.
+
+The fast mask is then compared voxel by voxel with the full-resolution
+one (``body_mask_full``): Dice, voxels only in either mask, and the number
+of components and enclosed cavities.  Exits non-zero if Dice falls below
+``--min-dice`` or the fast mask has extra components or cavities.
+
+Usage (from WebApp/totalsegmentator):
+    python benchmarks/body_surface.py --shape 512 512 400
+"""
+
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SPACING = (0.8, 0.8, 1.25)
+
+
+def _synthetic_ct(shape: tuple) -> nib.Nifti1Image:
+    rng = np.random.default_rng(0)
+    x, y, z = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    cx, cy = shape[0] / 2, shape[1] / 2
+    ct = np.full(shape, -1000, dtype=np.int16)
+    torso = ((x - cx) / (0.38 * shape[0])) ** 2 + ((y - cy) / (0.28 * shape[1])) ** 2 <= 1
+    ct[np.broadcast_to(torso, shape)] = 40
+    for side in (-1, 1):  # lungs
+        lung = (((x - cx - side * 0.15 * shape[0]) / (0.12 * shape[0])) ** 2
+                + ((y - cy) / (0.16 * shape[1])) ** 2
+                + ((z - 0.6 * shape[2]) / (0.3 * shape[2])) ** 2) <= 1
+        ct[lung] = -850
+    # Air pin-holes just under the skin and dense specks just outside it –
+    # the full path's closing removes both
+    from scipy import ndimage
+
+    body = np.broadcast_to(torso, shape)
+    struct = ndimage.generate_binary_structure(3, 2)
+    under_skin = ndimage.binary_erosion(body, struct) & ~ndimage.binary_erosion(body, struct, iterations=3)
+    outside = ndimage.binary_dilation(body, struct, iterations=2) & ~ndimage.binary_dilation(body, struct)
+    ct[under_skin & (rng.random(shape) < 0.02)] = -1000
+    ct[outside & (rng.random(shape) < 0.005)] = 200
+    table = (y > cy + 0.33 * shape[1]) & (y < cy + 0.36 * shape[1])
+    ct[np.broadcast_to(table, shape)] = 200
+    ct += rng.normal(0, 25, shape).astype(np.int16)
+    return nib.Nifti1Image(ct, np.diag([*SPACING, 1.0]))
+
+
+def _status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _run(ct_path: str, stl_path: str, mode: str, queue):
+    import handler
+
+    # ru_maxrss survives exec, so a spawned child would report the parent's
+    # peak – reset the kernel's high-water mark instead (Linux only)
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    baseline = _status_kb("VmRSS")
+    t0 = time.perf_counter()
+    handler.extract_body_surface(ct_path, stl_path, mode=mode)
+    elapsed = time.perf_counter() - t0
+    queue.put((elapsed, (_status_kb("VmHWM") - baseline) * 1024))
+
+
+def _vertices(stl_path: str) -> np.ndarray:
+    from mesh_writer import STL_RECORD
+
+    records = np.fromfile(stl_path, dtype=STL_RECORD, offset=84)
+    return np.unique(records["vectors"].reshape(-1, 3), axis=0)
+
+
+def _compare_masks(ct_path: str, min_dice: float) -> bool:
+    """Print how the fast mask differs from the full one; True if equivalent."""
+    from scipy import ndimage
+
+    import handler
+
+    img = nib.load(ct_path)
+    full = handler.body_mask_full(img, -500.0).astype(bool)
+    fast = handler.body_mask_fast(img, -500.0)
+    # The full path's closing erodes the volume's outer 3 voxels; compare inside that
+    inner = (slice(3, -3),) * 3
+    a, b = full[inner], fast[inner]
+    dice = 2 * np.count_nonzero(a & b) / max(np.count_nonzero(a) + np.count_nonzero(b), 1)
+
+    def components(mask):
+        return ndimage.label(mask)[1]
+
+    def cavities(mask):
+        # Background components not connected to the volume border
+        labelled, count = ndimage.label(~mask)
+        border = np.unique(np.concatenate([
+            labelled[[0, -1]].ravel(), labelled[:, [0, -1]].ravel(), labelled[:, :, [0, -1]].ravel()
+        ]))
+        return count - np.count_nonzero(border)
+
+    counts = {name: (components(m), cavities(m)) for name, m in (("full", full), ("fast", fast))}
+    print(f"\nmask vs. full: Dice {dice:.5f}, only full {np.count_nonzero(a & ~b)} voxels, "
+          f"only fast {np.count_nonzero(b & ~a)} voxels")
+    for name, (parts, holes) in counts.items():
+        print(f"  {name}: {parts} component(s), {holes} cavities")
+    return dice >= min_dice and counts["fast"][0] <= counts["full"][0] and counts["fast"][1] <= counts["full"][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full and fast body-surface extraction")
+    parser.add_argument("--shape", type=int, nargs=3, default=[384, 384, 300])
+    parser.add_argument("--min-dice", type=float, default=0.995,
+                        help="Fail if the fast mask's Dice against the full mask is lower")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        ct_path = str(Path(tmp) / "ct.nii.gz")
+        nib.save(_synthetic_ct(tuple(args.shape)), ct_path)
+        voxels = int(np.prod(args.shape))
+        print(f"CT {tuple(args.shape)} int16 ({voxels * 2 / 1024**2:.0f} MB decoded)\n")
+
+        print(f"{'mode':<6} {'time':>8} {'peak RSS':>10} {'faces':>10}")
+        results = {}
+        for mode in ("full", "fast"):
+            stl_path = str(Path(tmp) / f"body_{mode}.stl")
+            queue = context.Queue()
+            proc = context.Process(target=_run, args=(ct_path, stl_path, mode, queue))
+            proc.start()
+            elapsed, peak = queue.get()
+            proc.join()
+            faces = (Path(stl_path).stat().st_size - 84) // 50
+            results[mode] = (elapsed, peak, stl_path)
+            print(f"{mode:<6} {elapsed:>7.1f}s {peak / 1024**2:>8.0f} MB {faces:>10}")
+
+        full, fast = results["full"], results["fast"]
+        print(f"\nfast: {full[0] / fast[0]:.1f}× faster, {full[1] / max(fast[1], 1):.1f}× less peak memory")
+
+        from scipy.spatial import cKDTree
+
+        a, b = _vertices(full[2]), _vertices(fast[2])
+        distances = np.concatenate([cKDTree(b).query(a)[0], cKDTree(a).query(b)[0]]) * 1000
+        print(f"surface distance: mean {distances.mean():.2f} mm, p99 {np.percentile(distances, 99):.2f} mm")
+
+        if not _compare_masks(ct_path, args.min_dice):
+            print("FAIL: fast mask is not equivalent to the full mask")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
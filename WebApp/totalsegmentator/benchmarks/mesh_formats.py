@@ -0,0 +1,81 @@
+"""
+Benchmark – binary STL vs. indexed binary PLY per organ mesh.
+
+Runs marching cubes on synthetic masks (as ``decimation.py``), decimates
+each mesh to its budget and writes it in both formats.  Prints the file
+sizes, the gzip-compressed sizes and how long the server takes to read
+each back into an indexed mesh (STL needs a vertex weld, PLY does not).
+
+Usage (from WebApp/totalsegmentator):
+    python benchmarks/mesh_formats.py --spacing 0.8
+"""
+
+import argparse
+import gzip
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from skimage import measure
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "server"))
+
+from app.services.meshes import read_ply  # noqa: E402
+from benchmarks.decimation import _masks  # noqa: E402
+from handler import triangle_budget  # noqa: E402
+from mesh_decimate import decimate  # noqa: E402
+from mesh_writer import STL_RECORD, voxel_to_physical, write_mesh_file  # noqa: E402
+
+
+def _read_stl(path: Path):
+    records = np.fromfile(path, dtype=STL_RECORD, offset=84)
+    corners = records["vectors"].reshape(-1, 3)
+    verts, faces = np.unique(corners, axis=0, return_inverse=True)
+    return verts, faces.reshape(-1, 3)
+
+
+def _timed(fn, path: Path, repeat: int = 3) -> float:
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare STL and PLY mesh files")
+    parser.add_argument("--spacing", type=float, default=0.8, help="Isotropic voxel spacing (mm)")
+    args = parser.parse_args()
+
+    print(f"{'mask':<7} {'triangles':>9} {'STL KB':>8} {'PLY KB':>8} {'STL gz':>8} {'PLY gz':>8} "
+          f"{'STL read':>9} {'PLY read':>9}")
+    totals = np.zeros(4)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, mask in _masks(args.spacing).items():
+            verts, faces, _, _ = measure.marching_cubes(mask.astype(np.uint8), level=0.5)
+            verts = voxel_to_physical(verts, (args.spacing,) * 3, np.eye(4))
+            budget = triangle_budget(name)
+            verts, faces, _ = decimate(verts, faces, budget["triangles"], budget["max_error"])
+
+            stl, ply = Path(tmp) / f"{name}.stl", Path(tmp) / f"{name}.ply"
+            write_mesh_file(str(stl), verts, faces)
+            write_mesh_file(str(ply), verts, faces)
+            sizes = np.array([
+                stl.stat().st_size, ply.stat().st_size,
+                len(gzip.compress(stl.read_bytes(), 6)), len(gzip.compress(ply.read_bytes(), 6)),
+            ])
+            totals += sizes
+            kb = sizes / 1024
+            print(f"{name:<7} {len(faces):>9} {kb[0]:>8.0f} {kb[1]:>8.0f} {kb[2]:>8.0f} {kb[3]:>8.0f} "
+                  f"{_timed(_read_stl, stl) * 1000:>7.1f}ms {_timed(read_ply, ply) * 1000:>7.1f}ms")
+
+    print(f"\ntotal: STL {totals[0] / 1024**2:.1f} MB → PLY {totals[1] / 1024**2:.1f} MB "
+          f"({totals[0] / totals[1]:.1f}× smaller); gzip {totals[2] / 1024**2:.1f} → {totals[3] / 1024**2:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
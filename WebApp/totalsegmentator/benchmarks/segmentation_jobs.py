@@ -0,0 +1,73 @@
+"""
+Benchmark – TotalSegmentator CLI per job vs. the persistent engine.
+
+Segments the same CT *--jobs* times with ``run_totalsegmentator_subprocess``
+(a fresh CLI process each time) and with one ``SegmentationEngine``, and
+prints every job's wall time.  The CLI pays imports and model loading on
+every job; the engine only on its first.  Needs TotalSegmentator and its
+weights; runs on the CPU (``--device cpu``, the default) with ``--fast``
+in a few minutes per job.
+
+Usage (from WebApp/totalsegmentator):
+    python benchmarks/segmentation_jobs.py --jobs 3 --fast
+    python benchmarks/segmentation_jobs.py --ct scan.nii.gz --device gpu
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from handler import run_totalsegmentator_subprocess  # noqa: E402
+from segmentation_engine import SegmentationEngine  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the TotalSegmentator CLI with the persistent engine")
+    parser.add_argument("--ct", default="", help="CT NIfTI (default: a synthetic 256×256×160 CT)")
+    parser.add_argument("--jobs", type=int, default=3)
+    parser.add_argument("--device", default="cpu", help="cpu or gpu")
+    parser.add_argument("--fast", action="store_true", help="3 mm model (recommended on the CPU)")
+    parser.add_argument("--timeout", type=int, default=7200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ct_path = args.ct
+        if not ct_path:
+            import nibabel as nib
+            from benchmarks.body_surface import _synthetic_ct
+
+            ct_path = os.path.join(tmp, "ct.nii")
+            nib.save(_synthetic_ct((256, 256, 160)), ct_path)
+
+        engine = SegmentationEngine()
+        segmenters = {"cli": run_totalsegmentator_subprocess, "engine": engine}
+        times = {name: [] for name in segmenters}
+        try:
+            for name, segment in segmenters.items():
+                for job in range(args.jobs):
+                    output_path = os.path.join(tmp, f"{name}_{job}.nii.gz")
+                    t0 = time.perf_counter()
+                    success, message = segment(input_path=ct_path, output_path=output_path, fast=args.fast,
+                                               device=args.device, timeout=args.timeout, multilabel=True)
+                    if not success:
+                        sys.exit(f"{name} job {job + 1} failed: {message}")
+                    times[name].append(time.perf_counter() - t0)
+        finally:
+            engine.stop()
+
+    print(f"\n{'job':<5} {'cli':>9} {'engine':>9}")
+    for job in range(args.jobs):
+        print(f"{job + 1:<5} {times['cli'][job]:>8.1f}s {times['engine'][job]:>8.1f}s")
+    if args.jobs > 1:
+        cli_warm = sum(times["cli"][1:]) / (args.jobs - 1)
+        engine_warm = sum(times["engine"][1:]) / (args.jobs - 1)
+        print(f"\nwarm jobs: cli {cli_warm:.1f}s, engine {engine_warm:.1f}s ({cli_warm - engine_warm:.1f}s saved per job)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark – STL writing: per-face Python loop vs. ``mesh_writer``.
+
+Builds synthetic masks (a smooth organ-sized ellipsoid and a noisy
+body-sized blob), runs marching cubes once per mask, then writes the
+mesh both ways:
+
+* legacy – ``numpy-stl`` ``Mesh.vectors`` filled face by face (the
+  handler's former code path),
+* vectorised – ``mesh_writer.write_binary_stl``.
+
+Prints faces, seconds and speed-up per mask and checks that both files
+hold the same triangles.  Needs numpy-stl for the legacy path.
+
+Usage (from WebApp/totalsegmentator):
+    python benchmarks/stl_writer.py --size 256
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from skimage import measure
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mesh_writer import voxel_to_physical, write_binary_stl  # noqa: E402
+
+ZOOMS = (0.8, 0.8, 1.5)
+AFFINE = np.diag([0.8, 0.8, 1.5, 1.0])
+AFFINE[:3, 3] = (-200.0, -180.0, -600.0)
+
+
+def _ellipsoid(size: int, radii: tuple) -> np.ndarray:
+    grid = np.ogrid[:size, :size, :size]
+    return (sum(((g - size / 2) / (size * r)) ** 2 for g, r in zip(grid, radii)) <= 1).astype(np.uint8)
+
+
+def _masks(size: int) -> dict[str, np.ndarray]:
+    from scipy import ndimage
+
+    rng = np.random.default_rng(0)
+    noise = ndimage.gaussian_filter(rng.standard_normal((size,) * 3), sigma=size / 32)
+    body = _ellipsoid(size, (0.42, 0.32, 0.48)) & (noise > -0.02 * noise.std())
+    return {
+        "organ": _ellipsoid(size, (0.12, 0.09, 0.15)),
+        "body": body.astype(np.uint8),
+    }
+
+
+def _legacy(path: str, verts: np.ndarray, faces: np.ndarray):
+    from stl import mesh
+
+    stl_mesh = mesh.Mesh(np.zeros(faces.shape[0], dtype=mesh.Mesh.dtype))
+    for i, face in enumerate(faces):
+        for j in range(3):
+            stl_mesh.vectors[i][j] = verts[face[j], :]
+    stl_mesh.save(path)
+
+
+def _vectors(path: str) -> np.ndarray:
+    from stl import mesh
+
+    return mesh.Mesh.from_file(path).vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and vectorised STL writers")
+    parser.add_argument("--size", type=int, default=192, help="Voxels per axis of the synthetic masks")
+    args = parser.parse_args()
+
+    print(f"{'mask':<8} {'faces':>10} {'marching':>10} {'legacy':>10} {'vectorised':>11} {'speed-up':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, mask in _masks(args.size).items():
+            t0 = time.perf_counter()
+            verts, faces, _, _ = measure.marching_cubes(mask, level=0.5)
+            verts = voxel_to_physical(verts, ZOOMS, AFFINE)
+            t_mc = time.perf_counter() - t0
+
+            legacy_path = str(Path(tmp) / f"{name}_legacy.stl")
+            t0 = time.perf_counter()
+            _legacy(legacy_path, verts, faces)
+            t_legacy = time.perf_counter() - t0
+
+            fast_path = str(Path(tmp) / f"{name}_fast.stl")
+            t0 = time.perf_counter()
+            write_binary_stl(fast_path, verts, faces)
+            t_fast = time.perf_counter() - t0
+
+            if not np.array_equal(_vectors(legacy_path), _vectors(fast_path)):
+                print(f"{name}: triangles differ!")
+            print(
+                f"{name:<8} {len(faces):>10} {t_mc:>9.2f}s {t_legacy:>9.2f}s "
+                f"{t_fast:>10.3f}s {t_legacy / t_fast:>8.0f}×"
+            )
+
+
+if __name__ == "__main__":
+    main()
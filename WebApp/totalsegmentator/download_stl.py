@@ -1,5 +1,6 @@
 import requests
 import os
+import zipfile
 
 # Configuration
 SCAN_ID = "f0da0ef5-3c13-4978-b5b2-c2517225cfd5"
@@ -18,28 +19,31 @@ def download_stl_files():
     
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    for organ in ORGANS:
-        url = f"{BASE_URL}/stl/{organ}"
-        output_path = os.path.join(OUTPUT_DIR, f"{organ}.stl")
-        
-        print(f"\n📦 Downloading {organ}...")
-        print(f"   URL: {url}")
+    # One request for all organs – the server streams a ZIP of the STLs
+    url = f"{BASE_URL}/stl.zip"
+    params = {"organs": ",".join(ORGANS)}
+    zip_path = os.path.join(OUTPUT_DIR, "stl.zip")
+    
+    print(f"\n📦 Downloading {len(ORGANS)} organs...")
+    print(f"   URL: {url}")
+    
+    try:
+        response = requests.get(url, params=params, stream=True, timeout=120)
         
-        try:
-            response = requests.get(url, stream=True, timeout=120)
+        if response.status_code == 200:
+            with open(zip_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
             
-            if response.status_code == 200:
-                with open(output_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
-                size_kb = os.path.getsize(output_path) / 1024
-                print(f"   ✅ Saved: {output_path} ({size_kb:.1f} KB)")
-            else:
-                print(f"   ❌ Failed: HTTP {response.status_code}")
-                print(f"   Response: {response.text[:200]}")
-        except Exception as e:
-            print(f"   ❌ Error: {e}")
+            with zipfile.ZipFile(zip_path) as zf:
+                zf.extractall(OUTPUT_DIR)
+            os.remove(zip_path)
+            print(f"   ✅ Extracted to {OUTPUT_DIR}")
+        else:
+            print(f"   ❌ Failed: HTTP {response.status_code}")
+            print(f"   Response: {response.text[:200]}")
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
     
     print("\n" + "=" * 60)
     print("📊 Summary")
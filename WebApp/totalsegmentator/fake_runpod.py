@@ -0,0 +1,203 @@
+"""
+Local stand-in for the RunPod serverless API – load-test the pipeline
+without a GPU.
+
+Implements the two endpoints the AR4CT server uses:
+
+    POST /v2/{endpoint_id}/run              → {"id": ..., "status": "IN_QUEUE"}
+    GET  /v2/{endpoint_id}/status/{job_id}  → {"status": ..., "output": ...}
+
+Jobs run the real ``handler.handler()`` (download, STL conversion, STL
+upload to the callback URL) on a pool of worker threads – one per
+simulated GPU – with ``handler.SEGMENTER`` replaced by ``FakeSegmenter``,
+which writes synthetic ellipsoid masks instead of running TotalSegmentator.
+
+Usage:
+    python fake_runpod.py --port 8010 --workers 2 --delay 5
+    # then start the server with
+    RUNPOD_BASE_URL=http://localhost:8010/v2 RUNPOD_API_KEY=x RUNPOD_ENDPOINT_ID=fake \
+        API_BASE_URL=http://localhost:8000 uvicorn main:app --port 8000
+    # and drive it with server/benchmarks/pipeline_load.py
+
+Needs the handler's Python dependencies except PyTorch / TotalSegmentator
+(nibabel, numpy, scikit-image, SimpleITK, requests).
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+import handler
+
+# Organs written when a job does not say which it wants
+DEFAULT_FAKE_ORGANS = [
+    "liver", "spleen", "kidney_left", "kidney_right", "stomach", "pancreas",
+    "heart", "lung_upper_lobe_left", "lung_upper_lobe_right", "aorta",
+]
+
+_job_context = threading.local()
+
+
+class FakeSegmenter:
+    """
+    Drop-in for ``handler.run_totalsegmentator_subprocess``.
+
+    Segments each organ of the current job as a random ellipsoid inside
+    the CT volume, deterministic per organ name, after sleeping *delay*
+    seconds to stand in for inference time.  Like TotalSegmentator it
+    writes either one ``<organ>.nii.gz`` mask per organ into *output_path*
+    or, with *multilabel*, a single label image there – plus a
+    ``<name>.json`` label map, since ``handler.multilabel_names`` cannot
+    use TotalSegmentator's class map for made-up labels.
+    """
+
+    def __init__(self, delay: float = 0.0, organs: list | None = None):
+        self.delay = delay
+        self.organs = organs
+
+    def __call__(self, input_path, output_path, fast=False, device="cpu", timeout=None, multilabel=False):
+        start = time.time()
+        img = nib.load(input_path)
+        shape = img.shape[:3]
+        organs = self.organs or getattr(_job_context, "organs", None) or DEFAULT_FAKE_ORGANS
+        # "body" is extracted from the CT by the handler itself
+        organs = [organ for organ in organs if organ != "body"]
+
+        if multilabel:
+            labels = np.zeros(shape, dtype=np.uint8)
+            for value, organ in enumerate(organs, start=1):
+                labels[self.mask(organ, shape).astype(bool)] = value
+            nib.save(nib.Nifti1Image(labels, img.affine), output_path)
+            with open(output_path.replace(".nii.gz", ".json"), "w") as f:
+                json.dump({value: organ for value, organ in enumerate(organs, start=1)}, f)
+        else:
+            for organ in organs:
+                mask = self.mask(organ, shape)
+                nib.save(nib.Nifti1Image(mask, img.affine), str(Path(output_path) / f"{organ}.nii.gz"))
+
+        remaining = self.delay - (time.time() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+        print(f"[FakeSegmenter] {len(organs)} masks for {shape} in {time.time() - start:.1f}s")
+        return True, "Success"
+
+    @staticmethod
+    def mask(organ: str, shape: tuple) -> np.ndarray:
+        rng = np.random.default_rng(zlib.crc32(organ.encode()))
+        dims = np.array(shape)
+        centre = rng.uniform(0.25, 0.75, 3) * dims
+        radii = np.maximum(rng.uniform(0.04, 0.15, 3) * dims, 2)
+        lo = np.maximum(np.floor(centre - radii), 0).astype(int)
+        hi = np.minimum(np.ceil(centre + radii) + 1, dims).astype(int)
+
+        mask = np.zeros(shape, dtype=np.uint8)
+        grid = np.ogrid[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+        inside = sum(((g - c) / r) ** 2 for g, c, r in zip(grid, centre, radii)) <= 1
+        mask[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] = inside
+        return mask
+
+
+class FakeRunPod:
+    """Job table plus the worker pool that runs ``handler.handler``."""
+
+    def __init__(self, workers: int):
+        self.jobs: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fake-gpu")
+
+    def submit(self, payload: dict) -> dict:
+        job_id = f"fake-{uuid.uuid4()}"
+        job = {"id": job_id, "status": "IN_QUEUE", "submitted": time.time()}
+        with self.lock:
+            self.jobs[job_id] = job
+        self.pool.submit(self._run, job, payload)
+        return {"id": job_id, "status": "IN_QUEUE"}
+
+    def _run(self, job: dict, payload: dict):
+        started = time.time()
+        job.update(status="IN_PROGRESS", delayTime=int((started - job["submitted"]) * 1000))
+        _job_context.organs = payload.get("input", {}).get("organs")
+        try:
+            output = handler.handler(payload)
+            job.update(status="COMPLETED", output=output)
+        except Exception as e:  # the real worker reports these as FAILED
+            job.update(status="FAILED", error=str(e))
+        job["executionTime"] = int((time.time() - started) * 1000)
+
+    def status(self, job_id: str) -> dict | None:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if k != "submitted"}
+
+
+def make_handler(runpod: FakeRunPod):
+    run_path = re.compile(r"^/v2/[^/]+/run$")
+    status_path = re.compile(r"^/v2/[^/]+/status/([^/]+)$")
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def _send(self, code: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not run_path.match(self.path):
+                return self._send(404, {"error": "not found"})
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._send(400, {"error": "invalid JSON"})
+            self._send(200, runpod.submit(payload))
+
+        def do_GET(self):
+            match = status_path.match(self.path)
+            if not match:
+                return self._send(404, {"error": "not found"})
+            job = runpod.status(match.group(1))
+            if job is None:
+                return self._send(404, {"error": "job not found"})
+            self._send(200, job)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return RequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake RunPod API running handler.py with a synthetic segmenter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--workers", type=int, default=1, help="Jobs run in parallel (simulated GPUs)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Simulated inference seconds per job")
+    parser.add_argument("--organs", default="", help="Comma-separated organs to emit (default: those requested)")
+    args = parser.parse_args()
+
+    handler.SEGMENTER = FakeSegmenter(
+        delay=args.delay,
+        organs=[o for o in args.organs.split(",") if o] or None,
+    )
+    runpod = FakeRunPod(args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(runpod))
+    print(f"Fake RunPod listening on http://{args.host}:{args.port}/v2 ({args.workers} worker(s))")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,172 +1,189 @@
-import runpod
 import os
 import uuid
 import base64
 import nibabel as nib
 import numpy as np
 from skimage import measure
-from stl import mesh
 import tempfile
 import zipfile
+import hashlib
+import json
 import glob
+import gzip
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
 import SimpleITK as sitk
 import subprocess
 import sys
 import signal
 import threading
 import time
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-# Startup logging to verify dependencies
-print("=" * 60)
-print("TotalSegmentator Handler Starting...")
-print("=" * 60)
-try:
-    import brotli
-    print(f"✓ brotli module: AVAILABLE (version info: {brotli.__file__})")
-except ImportError as e:
-    print(f"✗ brotli module: NOT AVAILABLE - {e}")
-
-try:
-    import aiohttp
-    print(f"✓ aiohttp version: {aiohttp.__version__}")
-    # Check if aiohttp actually detected brotli
+from mesh_decimate import DEFAULT_BUDGETS, decimate, organ_class
+from mesh_writer import voxel_to_physical, write_mesh_file
+from segmentation_engine import SegmentationEngine
+
+def log_environment():
+    """Startup logging to verify dependencies and the GPU (worker start only)."""
+    print("=" * 60)
+    print("TotalSegmentator Handler Starting...")
+    print("=" * 60)
     try:
-        from aiohttp.http_parser import HAS_BROTLI
-        print(f"✓ aiohttp HAS_BROTLI flag: {HAS_BROTLI}")
-    except ImportError:
-        print("✗ Could not check aiohttp HAS_BROTLI flag")
-except ImportError as e:
-    print(f"✗ aiohttp: NOT AVAILABLE - {e}")
-
-# Comprehensive GPU/CUDA diagnostics
-print("=" * 60)
-print("GPU/CUDA DIAGNOSTICS")
-print("=" * 60)
-
-import torch
-print(f"PyTorch version: {torch.__version__}")
-print(f"PyTorch file location: {torch.__file__}")
-
-# Check if PyTorch was built with CUDA
-print(f"PyTorch built with CUDA: {torch.cuda.is_available()}")
-print(f"PyTorch CUDA version (compiled): {torch.version.cuda}")
-print(f"PyTorch cuDNN version: {torch.backends.cudnn.version() if torch.backends.cudnn.is_available() else 'N/A'}")
-print(f"cuDNN enabled: {torch.backends.cudnn.enabled}")
-
-# Check NVIDIA driver
-try:
-    import subprocess
-    result = subprocess.run(['nvidia-smi', '--query-gpu=name,driver_version,memory.total', '--format=csv,noheader'], 
-                          capture_output=True, text=True, timeout=10)
-    print(f"nvidia-smi output: {result.stdout.strip()}")
-    if result.returncode != 0:
-        print(f"nvidia-smi error: {result.stderr}")
-except Exception as e:
-    print(f"nvidia-smi failed: {e}")
-
-# Check CUDA devices
-if torch.cuda.is_available():
-    print(f"CUDA device count: {torch.cuda.device_count()}")
-    print(f"CUDA current device: {torch.cuda.current_device()}")
-    for i in range(torch.cuda.device_count()):
-        print(f"  GPU {i}: {torch.cuda.get_device_name(i)}")
-        props = torch.cuda.get_device_properties(i)
-        print(f"    - Total memory: {props.total_memory / 1024**3:.2f} GB")
-        print(f"    - Compute capability: {props.major}.{props.minor}")
-        print(f"    - Multi-processor count: {props.multi_processor_count}")
-    
-    # Test actual CUDA operation
-    print("Testing CUDA tensor operations...")
+        import brotli
+        print(f"✓ brotli module: AVAILABLE (version info: {brotli.__file__})")
+    except ImportError as e:
+        print(f"✗ brotli module: NOT AVAILABLE - {e}")
+
+    try:
+        import aiohttp
+        print(f"✓ aiohttp version: {aiohttp.__version__}")
+        # Check if aiohttp actually detected brotli
+        try:
+            from aiohttp.http_parser import HAS_BROTLI
+            print(f"✓ aiohttp HAS_BROTLI flag: {HAS_BROTLI}")
+        except ImportError:
+            print("✗ Could not check aiohttp HAS_BROTLI flag")
+    except ImportError as e:
+        print(f"✗ aiohttp: NOT AVAILABLE - {e}")
+
+    # Comprehensive GPU/CUDA diagnostics
+    print("=" * 60)
+    print("GPU/CUDA DIAGNOSTICS")
+    print("=" * 60)
+
+    import torch
+    print(f"PyTorch version: {torch.__version__}")
+    print(f"PyTorch file location: {torch.__file__}")
+
+    # Check if PyTorch was built with CUDA
+    print(f"PyTorch built with CUDA: {torch.cuda.is_available()}")
+    print(f"PyTorch CUDA version (compiled): {torch.version.cuda}")
+    print(f"PyTorch cuDNN version: {torch.backends.cudnn.version() if torch.backends.cudnn.is_available() else 'N/A'}")
+    print(f"cuDNN enabled: {torch.backends.cudnn.enabled}")
+
+    # Check NVIDIA driver
     try:
-        # Create tensor on GPU
-        x = torch.randn(1000, 1000, device='cuda')
-        y = torch.randn(1000, 1000, device='cuda')
-        z = torch.matmul(x, y)
-        torch.cuda.synchronize()  # Wait for GPU operation to complete
-        print(f"✓ CUDA tensor test PASSED - result shape: {z.shape}, device: {z.device}")
-        del x, y, z
-        torch.cuda.empty_cache()
-        print(f"✓ GPU memory after cleanup: {torch.cuda.memory_allocated() / 1024**2:.2f} MB allocated")
+        import subprocess
+        result = subprocess.run(['nvidia-smi', '--query-gpu=name,driver_version,memory.total', '--format=csv,noheader'], 
+                              capture_output=True, text=True, timeout=10)
+        print(f"nvidia-smi output: {result.stdout.strip()}")
+        if result.returncode != 0:
+            print(f"nvidia-smi error: {result.stderr}")
     except Exception as e:
-        print(f"✗ CUDA tensor test FAILED: {e}")
-        import traceback
-        traceback.print_exc()
-else:
-    print("✗ CUDA is NOT available!")
-    print("Possible reasons:")
-    print("  - No NVIDIA GPU in system")
-    print("  - NVIDIA driver not installed")
-    print("  - PyTorch not built with CUDA support")
-    print("  - CUDA version mismatch")
-
-# Check environment variables that might affect CUDA
-print("=" * 60)
-print("CUDA-related environment variables:")
-cuda_env_vars = ['CUDA_VISIBLE_DEVICES', 'CUDA_HOME', 'CUDA_PATH', 'LD_LIBRARY_PATH', 'NVIDIA_VISIBLE_DEVICES']
-for var in cuda_env_vars:
-    val = os.environ.get(var, 'NOT SET')
-    print(f"  {var}: {val}")
-
-# Check nnUNet environment (TotalSegmentator uses nnUNet)
-print("=" * 60)
-print("nnUNet environment variables:")
-nnunet_vars = ['nnUNet_raw', 'nnUNet_preprocessed', 'nnUNet_results', 'TOTALSEG_HOME_DIR']
-for var in nnunet_vars:
-    val = os.environ.get(var, 'NOT SET')
-    print(f"  {var}: {val}")
-
-# Check TotalSegmentator and nnUNet versions
-print("=" * 60)
-print("Package versions:")
-try:
-    import totalsegmentator as ts_module
-    ts_version = getattr(ts_module, '__version__', 'unknown')
-    print(f"  TotalSegmentator version: {ts_version}")
-    print(f"  TotalSegmentator location: {ts_module.__file__}")
-    print(f"  LATEST on PyPI: 2.12.0 (as of Jan 2026)")
-    if ts_version != 'unknown' and ts_version < '2.12.0':
-        print(f"  ⚠ WARNING: Not using latest version!")
-except Exception as e:
-    print(f"  TotalSegmentator: Error getting version - {e}")
-
-try:
-    import nnunetv2
-    nnunet_version = getattr(nnunetv2, '__version__', 'unknown')
-    print(f"  nnUNet v2 version: {nnunet_version}")
-except ImportError:
+        print(f"nvidia-smi failed: {e}")
+
+    # Check CUDA devices
+    if torch.cuda.is_available():
+        print(f"CUDA device count: {torch.cuda.device_count()}")
+        print(f"CUDA current device: {torch.cuda.current_device()}")
+        for i in range(torch.cuda.device_count()):
+            print(f"  GPU {i}: {torch.cuda.get_device_name(i)}")
+            props = torch.cuda.get_device_properties(i)
+            print(f"    - Total memory: {props.total_memory / 1024**3:.2f} GB")
+            print(f"    - Compute capability: {props.major}.{props.minor}")
+            print(f"    - Multi-processor count: {props.multi_processor_count}")
+
+        # Test actual CUDA operation
+        print("Testing CUDA tensor operations...")
+        try:
+            # Create tensor on GPU
+            x = torch.randn(1000, 1000, device='cuda')
+            y = torch.randn(1000, 1000, device='cuda')
+            z = torch.matmul(x, y)
+            torch.cuda.synchronize()  # Wait for GPU operation to complete
+            print(f"✓ CUDA tensor test PASSED - result shape: {z.shape}, device: {z.device}")
+            del x, y, z
+            torch.cuda.empty_cache()
+            print(f"✓ GPU memory after cleanup: {torch.cuda.memory_allocated() / 1024**2:.2f} MB allocated")
+        except Exception as e:
+            print(f"✗ CUDA tensor test FAILED: {e}")
+            import traceback
+            traceback.print_exc()
+    else:
+        print("✗ CUDA is NOT available!")
+        print("Possible reasons:")
+        print("  - No NVIDIA GPU in system")
+        print("  - NVIDIA driver not installed")
+        print("  - PyTorch not built with CUDA support")
+        print("  - CUDA version mismatch")
+
+    # Check environment variables that might affect CUDA
+    print("=" * 60)
+    print("CUDA-related environment variables:")
+    cuda_env_vars = ['CUDA_VISIBLE_DEVICES', 'CUDA_HOME', 'CUDA_PATH', 'LD_LIBRARY_PATH', 'NVIDIA_VISIBLE_DEVICES']
+    for var in cuda_env_vars:
+        val = os.environ.get(var, 'NOT SET')
+        print(f"  {var}: {val}")
+
+    # Check nnUNet environment (TotalSegmentator uses nnUNet)
+    print("=" * 60)
+    print("nnUNet environment variables:")
+    nnunet_vars = ['nnUNet_raw', 'nnUNet_preprocessed', 'nnUNet_results', 'TOTALSEG_HOME_DIR']
+    for var in nnunet_vars:
+        val = os.environ.get(var, 'NOT SET')
+        print(f"  {var}: {val}")
+
+    # Check TotalSegmentator and nnUNet versions
+    print("=" * 60)
+    print("Package versions:")
+    try:
+        import totalsegmentator as ts_module
+        ts_version = getattr(ts_module, '__version__', 'unknown')
+        print(f"  TotalSegmentator version: {ts_version}")
+        print(f"  TotalSegmentator location: {ts_module.__file__}")
+        print(f"  LATEST on PyPI: 2.12.0 (as of Jan 2026)")
+        if ts_version != 'unknown' and ts_version < '2.12.0':
+            print(f"  ⚠ WARNING: Not using latest version!")
+    except Exception as e:
+        print(f"  TotalSegmentator: Error getting version - {e}")
+
     try:
-        import nnunet
-        nnunet_version = getattr(nnunet, '__version__', 'unknown')
-        print(f"  nnUNet v1 version: {nnunet_version}")
+        import nnunetv2
+        nnunet_version = getattr(nnunetv2, '__version__', 'unknown')
+        print(f"  nnUNet v2 version: {nnunet_version}")
     except ImportError:
-        print("  nnUNet: Not found")
+        try:
+            import nnunet
+            nnunet_version = getattr(nnunet, '__version__', 'unknown')
+            print(f"  nnUNet v1 version: {nnunet_version}")
+        except ImportError:
+            print("  nnUNet: Not found")
+
+    try:
+        import SimpleITK
+        print(f"  SimpleITK version: {SimpleITK.__version__}")
+    except:
+        print("  SimpleITK: Not found")
 
-try:
-    import SimpleITK
-    print(f"  SimpleITK version: {SimpleITK.__version__}")
-except:
-    print("  SimpleITK: Not found")
+    try:
+        import nibabel
+        print(f"  nibabel version: {nibabel.__version__}")
+    except:
+        print("  nibabel: Not found")
 
-try:
-    import nibabel
-    print(f"  nibabel version: {nibabel.__version__}")
-except:
-    print("  nibabel: Not found")
+    print("=" * 60)
 
-print("=" * 60)
 
-def run_totalsegmentator_subprocess(input_path: str, output_dir: str, fast: bool, device: str, timeout: int = 1800):
+def run_totalsegmentator_subprocess(input_path: str, output_path: str, fast: bool, device: str,
+                                    timeout: int = 1800, multilabel: bool = False):
     """
     Run TotalSegmentator in a separate subprocess to prevent hanging.
     This ensures that if inference fails, we can kill the subprocess cleanly.
     
     Args:
         input_path: Path to input NIfTI file
-        output_dir: Path to output directory
+        output_path: Output directory for one mask per organ or, with
+            multilabel, the path of the single label image (.nii.gz)
         fast: Whether to use fast mode (3mm resampling)
         device: 'gpu' or 'cpu'
         timeout: Maximum time in seconds (default 30 minutes)
+        multilabel: Write one label image for all classes (--ml)
     
     Returns:
         tuple: (success: bool, message: str)
@@ -175,13 +192,15 @@ def run_totalsegmentator_subprocess(input_path: str, output_dir: str, fast: bool
     cmd = [
         "TotalSegmentator",
         "-i", input_path,
-        "-o", output_dir,
+        "-o", output_path,
         "--device", device,
         "-v"  # verbose
     ]
     
     if fast:
         cmd.append("--fast")
+    if multilabel:
+        cmd.append("--ml")
     
     print(f"Running TotalSegmentator subprocess: {' '.join(cmd)}")
     print(f"Timeout: {timeout} seconds")
@@ -279,60 +298,336 @@ def run_totalsegmentator_subprocess(input_path: str, output_dir: str, fast: bool
         except:
             pass
 
-def nifti_to_stl(nifti_path: str, stl_path: str):
-    """Convert a NIfTI segmentation mask to STL mesh."""
-    img = nib.load(nifti_path)
-    data = img.get_fdata()
-    
-    if data.max() == 0:
+@contextmanager
+def timed(timeline: dict, stage: str, **extra):
+    """
+    Record the ``with`` block as *stage* in *timeline* – the format of the
+    API's scan timeline (started_at / finished_at / duration, optional
+    bytes).  The yielded dict is merged into the entry.
+    """
+    details = dict(extra)
+    started = time.time()
+    try:
+        yield details
+    finally:
+        record_stage(timeline, stage, started, **details)
+
+
+def record_stage(timeline: dict, stage: str, started: float, **details):
+    """Record *stage* as running from *started* until now."""
+    finished = time.time()
+    timeline[stage] = {
+        "started_at": _utc(started),
+        "finished_at": _utc(finished),
+        "duration": round(finished - started, 3),
+        **details,
+    }
+
+
+def _utc(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+# Segmentation backend: called as SEGMENTER(input_path=, output_path=, fast=,
+# device=, timeout=, multilabel=True) and must write a label image to
+# output_path and return (success, message).  The worker replaces it with a
+# SegmentationEngine at start unless SEGMENTATION_ENGINE=cli; fake_runpod.py
+# swaps in a synthetic segmenter.
+SEGMENTER = run_totalsegmentator_subprocess
+
+# "persistent" (one warm engine process for all jobs) or "cli" (one
+# TotalSegmentator CLI run per job)
+SEGMENTATION_ENGINE = os.environ.get("SEGMENTATION_ENGINE", "persistent").lower()
+# Modes the engine loads at worker start, e.g. "full" or "fast,full"
+SEGMENTATION_WARMUP = [m.strip() for m in os.environ.get("SEGMENTATION_WARMUP", "").split(",") if m.strip()]
+
+
+# ── CT download ──
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 5
+
+
+class DownloadError(Exception):
+    """The CT could not be downloaded completely and intact."""
+
+
+def download_file(url: str, dest_path: str, expected_sha256: str = None,
+                  attempts: int = DOWNLOAD_ATTEMPTS) -> dict:
+    """
+    Stream *url* to *dest_path* chunk by chunk – memory use does not depend
+    on the file size.
+
+    The SHA-256 is computed while writing.  A dropped connection resumes
+    with ``Range: bytes=<received>-`` (guarded by ``If-Range`` on the
+    ETag); a server that answers 200 instead of 206 sends the whole file
+    again.  ``identity`` encoding keeps byte offsets and the checksum those
+    of the stored file.  Returns ``{"bytes", "sha256", "resumes"}``.
+    """
+    sha256 = hashlib.sha256()
+    received = 0
+    total = None
+    etag = None
+    resumes = 0
+    next_report = 0.1
+    started = time.monotonic()
+
+    with open(dest_path, "wb") as f:
+        for attempt in range(1, attempts + 1):
+            headers = {"Accept-Encoding": "identity"}
+            if received:
+                headers["Range"] = f"bytes={received}-"
+                if etag:
+                    headers["If-Range"] = etag
+            try:
+                with requests.get(url, stream=True, timeout=(30, 300), headers=headers) as response:
+                    if response.status_code >= 500:
+                        raise requests.exceptions.ConnectionError(f"server error {response.status_code}")
+                    response.raise_for_status()
+                    if received and response.status_code != 206:
+                        print("  Server ignored the range request – downloading again from the start")
+                        f.seek(0)
+                        f.truncate()
+                        sha256 = hashlib.sha256()
+                        received = 0
+                    if not received:
+                        length = response.headers.get("Content-Length")
+                        total = int(length) if length and length.isdigit() else None
+                        etag = response.headers.get("ETag")
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        received += len(chunk)
+                        if total and received / total >= next_report:
+                            rate = received / max(time.monotonic() - started, 1e-6) / (1024 * 1024)
+                            print(f"  Downloaded {received / (1024*1024):.1f} / "
+                                  f"{total / (1024*1024):.1f} MB ({received / total:.0%}, {rate:.1f} MB/s)")
+                            next_report = received / total + 0.1
+                if total is not None and received < total:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"connection closed after {received} of {total} bytes")
+                break
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                if attempt == attempts:
+                    raise DownloadError(f"Download failed after {attempts} attempts: {e}") from e
+                resumes += 1
+                delay = min(2 ** attempt, 30)
+                print(f"  Download interrupted at {received / (1024*1024):.1f} MB ({e}) – "
+                      f"resuming in {delay}s (attempt {attempt + 1}/{attempts})")
+                time.sleep(delay)
+
+    digest = sha256.hexdigest()
+    if expected_sha256 and digest != expected_sha256.lower():
+        raise DownloadError(f"Checksum mismatch: expected {expected_sha256}, got {digest}")
+    return {"bytes": received, "sha256": digest, "resumes": resumes}
+
+
+def sniff_magic(path: str, size: int = 4) -> bytes:
+    """First *size* bytes of a file."""
+    with open(path, "rb") as f:
+        return f.read(size)
+
+
+# ── Input decoding ──
+
+GZIP_MAGIC = b"\x1f\x8b"
+DECODE_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def gunzip_file(src_path: str, dest_path: str) -> int:
+    """
+    Inflate *src_path* into *dest_path* in chunks and remove the gzip file.
+    Returns the decoded size in bytes.
+    """
+    with gzip.open(src_path, "rb") as src, open(dest_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, DECODE_CHUNK_SIZE)
+    os.remove(src_path)
+    return os.path.getsize(dest_path)
+
+
+def prepare_input(path: str, tmp_dir: str, stage: dict) -> str:
+    """
+    Decode the CT at *path* once into an uncompressed ``input.nii``.
+
+    TotalSegmentator reads it without inflating it again and the body
+    surface memory-maps it instead of decompressing a third copy.  MHD /
+    NRRD are converted by SimpleITK, gzipped NIfTI is inflated, plain NIfTI
+    is used as is.  Details go into *stage* (the ``decode`` timeline entry).
+    """
+    input_path = os.path.join(tmp_dir, "input.nii")
+    if path.lower().endswith((".mhd", ".nrrd")):
+        print(f"Found {os.path.splitext(path)[1][1:].upper()} file: {path}, converting to NIfTI...")
+        sitk.WriteImage(sitk.ReadImage(path), input_path, useCompression=False)
+        stage["source"] = "sitk"
+    elif sniff_magic(path, 2) == GZIP_MAGIC:
+        stage["source"] = "gzip"
+        stage["compressed_bytes"] = os.path.getsize(path)
+        gunzip_file(path, input_path)
+    else:
+        stage["source"] = "nifti"
+        if path != input_path:
+            os.replace(path, input_path)
+    stage["bytes"] = os.path.getsize(input_path)
+    print(f"Input decoded to {input_path} ({stage['bytes'] / (1024*1024):.1f} MB, {stage['source']})")
+    return input_path
+
+
+# ── Multi-label output → per-organ crops ──
+
+def multilabel_names(label_path: str) -> dict:
+    """
+    Label value → organ name of a multi-label image: from a JSON sidecar
+    (<name>.json, written by fake_runpod.py) if present, otherwise
+    TotalSegmentator's class map for the "total" task.
+    """
+    sidecar = label_path.replace(".nii.gz", ".json")
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            return {int(k): v for k, v in json.load(f).items()}
+    from totalsegmentator.map_to_binary import class_map
+    return dict(class_map["total"])
+
+
+def padded_box(box: tuple, shape: tuple, pad: int = 1) -> tuple:
+    """Grow a ``find_objects`` bounding box by *pad* voxels, clamped to the volume."""
+    return tuple(slice(max(s.start - pad, 0), min(s.stop + pad, n)) for s, n in zip(box, shape))
+
+
+def multilabel_crops(label_path: str, organs: list, work_dir: str):
+    """
+    Decode the label image once and cut out each requested organ: its
+    bounding box (``ndimage.find_objects``) padded by one voxel, as a uint8
+    0/1 mask.  Marching cubes on the padded crop yields the same triangles
+    as on the full volume – every surface cell lies inside it – so only the
+    crop's voxel offset has to be added back.
+
+    Returns ``{organ: ("crop", mask, offset, zooms, affine, stl_path)}`` mesh
+    tasks and the organs not present in the segmentation.
+    """
+    from scipy import ndimage
+
+    img = nib.load(label_path)
+    labels = np.asanyarray(img.dataobj)
+    if labels.dtype.kind == "f":  # label images are integral; tolerate float storage
+        labels = np.rint(labels)
+    labels = labels.astype(np.uint8 if labels.max() < 256 else np.uint16, copy=False)
+    zooms, affine = img.header.get_zooms()[:3], img.affine
+    boxes = ndimage.find_objects(labels)
+    names = multilabel_names(label_path)
+    by_name = {name: value for value, name in names.items()}
+
+    tasks, missing = {}, []
+    for organ in organs:
+        value = by_name.get(organ)
+        box = boxes[value - 1] if value and value <= len(boxes) else None
+        if box is None:
+            missing.append(organ)
+            continue
+        crop = padded_box(box, labels.shape)
+        mask = (labels[crop] == value).view(np.uint8)
+        offset = np.array([s.start for s in crop], dtype=np.float32)
+        tasks[organ] = ("crop", mask, offset, zooms, affine, os.path.join(work_dir, f"{organ}.{MESH_FORMAT}"))
+    return tasks, missing
+
+
+# ── Triangle budgets ──
+
+# Organ mesh transfer format: "ply" (indexed, ~2.5× smaller) or "stl"
+MESH_FORMAT = os.environ.get("MESH_FORMAT", "ply").lower()
+
+def triangle_budget(organ: str):
+    """
+    Decimation budget (``{"triangles", "max_error"}``) for *organ*, or None
+    when MESH_DECIMATION=off.  MESH_BUDGETS (JSON, per class) overrides the
+    defaults, e.g. ``{"organ": {"triangles": 40000}}``.
+    """
+    if os.environ.get("MESH_DECIMATION", "on").lower() in ("off", "0", "false"):
+        return None
+    kind = organ_class(organ)
+    budget = dict(DEFAULT_BUDGETS[kind])
+    overrides = json.loads(os.environ.get("MESH_BUDGETS") or "{}")
+    budget.update(overrides.get(kind, {}))
+    return {"class": kind, **budget}
+
+
+def write_mesh(stl_path: str, verts: np.ndarray, faces: np.ndarray, budget: dict = None,
+               stats: dict = None) -> int:
+    """
+    Decimate a physical-space mesh to *budget* (see ``triangle_budget``)
+    and write it as binary PLY or STL (by the path's suffix).  Fills
+    *stats* with the triangle counts.
+    """
+    triangles_in = len(faces)
+    cell = None
+    if budget:
+        verts, faces, cell = decimate(verts, faces, budget.get("triangles"), budget.get("max_error"))
+    written = write_mesh_file(stl_path, verts, faces)
+    if stats is not None:
+        stats.update(marching_cubes=triangles_in, triangles=written,
+                     cell_mm=round(cell * 1000, 2) if cell else None)
+    return written
+
+
+def mask_to_stl(mask: np.ndarray, offset, zooms, affine, stl_path: str, budget: dict = None,
+                stats: dict = None):
+    """Marching cubes on a (cropped) binary mask whose voxel origin is *offset* → STL."""
+    if not mask.any():
         return None  # Empty mask
-    
-    # Generate mesh using marching cubes
-    verts, faces, _, _ = measure.marching_cubes(data, level=0.5)
-    
+    verts, faces, _, _ = measure.marching_cubes(mask, level=0.5)
+    verts += offset
     # Transform voxel coords → physical coords (mm) then to meters
-    spacing = np.array(img.header.get_zooms()[:3]) * 0.001
-    origin = np.array(img.affine[:3, 3]) * 0.001
-    verts = verts * spacing + origin
-    
-    # Create STL mesh
-    stl_mesh = mesh.Mesh(np.zeros(faces.shape[0], dtype=mesh.Mesh.dtype))
-    for i, face in enumerate(faces):
-        for j in range(3):
-            stl_mesh.vectors[i][j] = verts[face[j], :]
-    
-    stl_mesh.save(stl_path)
+    verts = voxel_to_physical(verts, zooms, affine)
+    write_mesh(stl_path, verts, faces, budget, stats)
     return stl_path
 
 
-def extract_body_surface(input_nifti_path: str, stl_path: str, hu_threshold: float = -500.0):
-    """
-    Extract the outer body surface from a CT scan and save as STL.
+# "fast" (coarse-grid morphology, see body_mask_fast) or "full" (full resolution)
+BODY_SURFACE_MODE = os.environ.get("BODY_SURFACE_MODE", "fast")
 
-    Uses a Hounsfield-Unit threshold to separate body from air, then
-    applies binary morphological closing to fill small holes before
-    running marching cubes.
 
-    Args:
-        input_nifti_path: Path to the original CT NIfTI file.
-        stl_path: Where to write the resulting STL.
-        hu_threshold: HU value above which voxels are considered "body".
-                      -500 captures skin, fat, muscle, bone, etc.
-    Returns:
-        stl_path on success, None if the mask is empty.
+def threshold_native(img, hu_threshold: float) -> np.ndarray:
+    """
+    Voxels above *hu_threshold* as a bool mask, compared on the stored
+    (integer) data – the threshold is mapped through the NIfTI scaling
+    instead of converting the whole volume to float.
     """
+    raw = np.asanyarray(img.dataobj.get_unscaled())
+    slope = float(getattr(img.dataobj, "slope", 1.0) or 1.0)
+    inter = float(getattr(img.dataobj, "inter", 0.0) or 0.0)
+    limit = (hu_threshold - inter) / slope
+    return raw > limit if slope > 0 else raw < limit
+
+
+def _pool_majority(mask: np.ndarray, factor: int) -> np.ndarray:
+    """Downsample a bool mask by *factor* per axis: a cell is set if at least half its voxels are."""
+    pad = [(0, -n % factor) for n in mask.shape]
+    if any(after for _, after in pad):
+        mask = np.pad(mask, pad)
+    nx, ny, nz = (n // factor for n in mask.shape)
+    counts = mask.reshape(nx, factor, ny, factor, nz, factor).sum(axis=(1, 3, 5), dtype=np.uint16)
+    return counts * 2 >= factor ** 3
+
+
+def _upsample(mask: np.ndarray, factor: int, shape: tuple) -> np.ndarray:
+    """Nearest-neighbour upsampling of a coarse mask back to *shape*."""
+    for axis in range(3):
+        mask = mask.repeat(factor, axis=axis)
+    return mask[:shape[0], :shape[1], :shape[2]]
+
+
+def body_mask_full(img, hu_threshold: float) -> np.ndarray:
+    """Body mask at full resolution: threshold, closing, largest component (uint8)."""
     from scipy import ndimage
 
-    print(f"  Extracting body surface (HU > {hu_threshold}) ...")
-    img = nib.load(input_nifti_path)
     data = img.get_fdata()
 
     # Threshold to get a binary body mask
     body_mask = (data > hu_threshold).astype(np.uint8)
-
+    del data
     if body_mask.max() == 0:
-        print("  SKIP: body mask is empty")
-        return None
+        return body_mask
 
     # Morphological closing to fill internal gaps and smooth the surface
     struct = ndimage.generate_binary_structure(3, 2)
@@ -344,6 +639,92 @@ def extract_body_surface(input_nifti_path: str, stl_path: str, hu_threshold: flo
         component_sizes = ndimage.sum(body_mask, labelled, range(1, num_features + 1))
         largest = int(np.argmax(component_sizes)) + 1
         body_mask = (labelled == largest).astype(np.uint8)
+    return body_mask
+
+
+def body_mask_fast(img, hu_threshold: float, factor: int = 2) -> np.ndarray:
+    """
+    Body mask for the surface mesh with a fraction of ``body_mask_full``'s
+    memory and CPU:
+
+    * threshold on the native integer data (1 byte per voxel, no float64),
+    * closing and largest-component selection on a grid *factor*× coarser
+      per axis (closing radius scaled to match),
+    * full-resolution threshold only in a band of coarse cells around the
+      surface; everything else takes the coarse result,
+    * the refined band is closed at full resolution and only voxels
+      connected to the coarse body's interior are kept, so specks and
+      pin-holes the raw threshold brings back do not reach the mesh.
+    """
+    from scipy import ndimage
+
+    fine = threshold_native(img, hu_threshold)
+    if not fine.any():
+        return fine
+
+    struct = ndimage.generate_binary_structure(3, 2)
+    coarse = _pool_majority(fine, factor)
+    coarse = ndimage.binary_closing(coarse, structure=struct, iterations=max(1, round(3 / factor)))
+
+    labelled, num_features = ndimage.label(coarse)
+    if num_features > 1:
+        sizes = np.bincount(labelled.ravel())
+        sizes[0] = 0
+        coarse = labelled == sizes.argmax()
+    del labelled
+
+    core = ndimage.binary_erosion(coarse, struct)
+    band = ndimage.binary_dilation(coarse, struct) & ~core
+    del coarse
+    near_surface = _upsample(band, factor, fine.shape)
+    body = _upsample(core, factor, fine.shape)
+    body[near_surface] = fine[near_surface]
+    del fine
+
+    # Close the refined band (the core is already solid), then drop
+    # anything not face-connected to the core, as ``ndimage.label`` does
+    closed = ndimage.binary_closing(body, structure=struct)
+    body[near_surface] = closed[near_surface]
+    del closed
+    seed = _upsample(core, factor, body.shape)
+    return ndimage.binary_propagation(seed, mask=body)
+
+
+def extract_body_surface(input_nifti_path: str, stl_path: str, hu_threshold: float = -500.0,
+                         mode: str = None, budget: dict = None, stats: dict = None):
+    """
+    Extract the outer body surface from a CT scan and save as STL.
+
+    Uses a Hounsfield-Unit threshold to separate body from air, then
+    applies binary morphological closing to fill small holes before
+    running marching cubes.
+
+    Args:
+        input_nifti_path: Path to the CT NIfTI file (memory-mapped when
+            uncompressed, see ``prepare_input``).
+        stl_path: Where to write the resulting STL.
+        hu_threshold: HU value above which voxels are considered "body".
+                      -500 captures skin, fat, muscle, bone, etc.
+        mode: "fast" (``body_mask_fast``) or "full" (``body_mask_full``);
+              default BODY_SURFACE_MODE.
+        budget, stats: see ``write_mesh``.
+    Returns:
+        stl_path on success, None if the mask is empty.
+    """
+    mode = mode or BODY_SURFACE_MODE
+    print(f"  Extracting body surface (HU > {hu_threshold}, {mode}) ...")
+    img = nib.load(input_nifti_path)
+
+    if mode == "fast":
+        body_mask = body_mask_fast(img, hu_threshold).view(np.uint8)
+        if not body_mask.any():
+            print("  SKIP: body mask is empty")
+            return None
+    else:
+        body_mask = body_mask_full(img, hu_threshold)
+        if body_mask.max() == 0:
+            print("  SKIP: body mask is empty")
+            return None
 
     # Optional: subsample for performance if the volume is very large
     # (marching cubes on full-res CT can be huge)
@@ -357,32 +738,281 @@ def extract_body_surface(input_nifti_path: str, stl_path: str, hu_threshold: flo
 
     # Transform voxel coords → physical coords (mm) then to meters
     # marching_cubes with step_size already returns coords in original voxel space
-    spacing = np.array(img.header.get_zooms()[:3]) * 0.001
-    origin = np.array(img.affine[:3, 3]) * 0.001
-    verts = verts * spacing + origin
-
-    stl_mesh = mesh.Mesh(np.zeros(faces.shape[0], dtype=mesh.Mesh.dtype))
-    for i, face in enumerate(faces):
-        for j in range(3):
-            stl_mesh.vectors[i][j] = verts[face[j], :]
-
-    stl_mesh.save(stl_path)
+    verts = voxel_to_physical(verts, img.header.get_zooms(), img.affine)
+    written = write_mesh(stl_path, verts, faces, budget, stats)
     size_kb = os.path.getsize(stl_path) / 1024
-    print(f"  Body surface STL: {size_kb:.1f} KB ({len(faces)} faces)")
+    print(f"  Body surface STL: {size_kb:.1f} KB ({written} of {len(faces)} faces)")
     return stl_path
 
+# ── Parallel meshing ──
+
+def container_cpus() -> int:
+    """CPUs this container may use: the cgroup CPU quota if set, else the affinity mask."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:  # cgroup v2: "<quota> <period>" or "max <period>"
+            limit, period = f.read().split()[:2]
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:  # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+def _memory_available() -> int:
+    """Bytes of MemAvailable (0 if unknown)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+# Peak bytes per CT voxel of the body-surface task by BODY_SURFACE_MODE
+# (benchmarks/body_surface.py: ~7 fast, ~28 full at 384×384×300)
+_BODY_BYTES_PER_VOXEL = {"fast": 8, "full": 30}
+# Mesh arrays of a crop task per voxel^(2/3) of the crop (~surface size)
+_MESH_BYTES_PER_SURFACE_VOXEL = 2048
+
+
+def mesh_task_bytes(task: tuple) -> int:
+    """
+    Estimated peak memory of one ``mesh_one`` task: for a crop, the
+    worker's copy of the mask, marching cubes' float32 copy and the mesh;
+    for the body surface, the CT volume at its mode's cost per voxel.
+    """
+    if task[0] == "ct":
+        voxels = int(np.prod(nib.load(task[1]).shape[:3]))
+        return voxels * _BODY_BYTES_PER_VOXEL.get(BODY_SURFACE_MODE, _BODY_BYTES_PER_VOXEL["full"])
+    mask = task[1]
+    return mask.size * (mask.itemsize + 4) + int(_MESH_BYTES_PER_SURFACE_VOXEL * mask.size ** (2 / 3))
+
+
+def mesh_workers(task_bytes: list) -> int:
+    """
+    Processes for the meshing pool: one per container CPU, but no more than
+    there are tasks and no more than fit in memory – the largest tasks
+    (*task_bytes*, see ``mesh_task_bytes``) running at once must fit in
+    MemAvailable.  The MESH_WORKERS environment variable overrides the CPU
+    count.
+    """
+    workers = int(os.environ.get("MESH_WORKERS", 0)) or container_cpus()
+    workers = min(workers, len(task_bytes))
+    available = _memory_available()
+    if available:
+        largest = sorted(task_bytes, reverse=True)[:workers]
+        fit = np.searchsorted(np.cumsum(largest), available, side="right")
+        workers = min(workers, int(fit))
+    return max(1, workers)
+
+
+def mesh_one(organ: str, kind: str, *args):
+    """
+    Pool task → (STL path or None, seconds, triangle stats).  *kind* is
+    "crop" for an organ mask crop (``mask_to_stl`` args) or "ct" for the
+    body surface (``extract_body_surface`` args).  The mesh is decimated to
+    the organ's ``triangle_budget``.
+    """
+    t0 = time.time()
+    stats = {}
+    budget = triangle_budget(organ)
+    if kind == "ct":
+        path = extract_body_surface(*args, budget=budget, stats=stats)
+    else:
+        path = mask_to_stl(*args, budget=budget, stats=stats)
+    if budget:
+        stats["budget"] = budget
+    return path, round(time.time() - t0, 3), stats
+
+
+def mesh_organs(tasks: dict, workers: int, on_done=None):
+    """
+    Mesh ``{organ: (kind, *args)}`` (see ``mesh_one``) on *workers*
+    processes, collecting results as they complete.  A failing organ is
+    logged and reported without affecting the others.  ``on_done(organ,
+    stl_path)`` is called for each mesh as soon as it is written.
+
+    Returns (stl_paths in task order, failed organs, {organ: seconds},
+    {organ: triangle stats}).
+    """
+    done, failed, seconds, triangles = {}, [], {}, {}
+
+    def collect(organ, result=None, error=None):
+        if error is not None:
+            print(f"  ✗ Meshing {organ} failed: {error!r}")
+            failed.append(organ)
+            return
+        path, seconds[organ], stats = result
+        if path:
+            triangles[organ] = stats
+            print(f"  Generated STL for {organ}: {os.path.getsize(path) / 1024:.1f} KB, "
+                  f"{stats['triangles']} of {stats['marching_cubes']} triangles ({seconds[organ]:.1f}s)")
+            done[organ] = path
+            if on_done is not None:
+                on_done(organ, path)
+        elif organ == "body":
+            print("  Body surface STL not available")
+            failed.append(organ)
+
+    if workers <= 1:
+        for organ, task in tasks.items():
+            try:
+                collect(organ, mesh_one(organ, *task))
+            except Exception as e:
+                collect(organ, error=e)
+    else:
+        # spawn, not fork: the parent may hold CUDA state and monitor threads
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(mesh_one, organ, *task): organ for organ, task in tasks.items()}
+            for future in as_completed(futures):
+                try:
+                    collect(futures[future], future.result())
+                except Exception as e:  # includes BrokenProcessPool if a worker was killed
+                    collect(futures[future], error=e)
+
+    stl_paths = {organ: done[organ] for organ in tasks if organ in done}
+    return stl_paths, failed, seconds, triangles
+
+
+# ── STL upload ──
+
+STL_UPLOAD_CONCURRENCY = int(os.environ.get("STL_UPLOAD_CONCURRENCY", 4))
+STL_UPLOAD_ATTEMPTS = 5
+# Worth another attempt: gateway errors, overload, rate limiting
+_RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+_MESH_TYPES = {".stl": "model/stl", ".ply": "application/ply"}
+
+
+class StlUploader:
+    """
+    Uploads organ STLs to ``{callback_url}/stl/{organ}`` while meshing is
+    still running.
+
+    One pooled ``requests.Session`` (keep-alive, at most *concurrency*
+    connections) is shared by *concurrency* upload threads.  Each organ
+    gets an ``Idempotency-Key`` that stays the same across its retries, so
+    a retry whose first attempt did reach the API is answered from the
+    stored upload instead of writing – and preparing – the mesh twice.
+    Connection errors, timeouts and retryable statuses are retried with
+    exponential backoff and jitter.
+    """
+
+    def __init__(self, callback_url: str, concurrency: int = STL_UPLOAD_CONCURRENCY,
+                 attempts: int = STL_UPLOAD_ATTEMPTS):
+        self.callback_url = callback_url
+        self.attempts = attempts
+        self.concurrency = max(1, concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="stl-upload")
+        self.futures = {}
+        self.started = None
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def submit(self, organ: str, stl_path: str):
+        """Queue *organ* for upload (returns immediately)."""
+        if self.started is None:
+            self.started = time.time()
+        key = uuid.uuid4().hex
+        self.futures[organ] = self.pool.submit(self._upload, organ, stl_path, key)
+
+    def _upload(self, organ: str, stl_path: str, key: str) -> dict:
+        upload_url = f"{self.callback_url}/stl/{organ}"
+        size = os.path.getsize(stl_path)
+        suffix = os.path.splitext(stl_path)[1].lower()
+        content_type = _MESH_TYPES.get(suffix, "application/octet-stream")
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with open(stl_path, "rb") as f:
+                    response = self.session.post(
+                        upload_url,
+                        files={"file": (os.path.basename(stl_path), f, content_type)},
+                        headers={"Idempotency-Key": key},
+                        timeout=(10, 300),
+                    )
+                if response.status_code == 200:
+                    print(f"  ✓ Uploaded {organ}{suffix} ({size / 1024:.1f} KB)")
+                    return {"status": "uploaded", "size": size, "url": upload_url, "attempts": attempt}
+                error = f"{response.status_code} - {response.text[:200]}"
+                if response.status_code not in _RETRY_STATUS:
+                    print(f"  ✗ Failed to upload {organ}{suffix}: {error}")
+                    return {"status": "upload_failed", "error": error, "attempts": attempt}
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = str(e)
+            if attempt < self.attempts:
+                delay = min(2 ** (attempt - 1), 30) * (0.5 + random.random())
+                print(f"  Upload of {organ}{suffix} failed ({error}) – retry {attempt}/{self.attempts - 1} in {delay:.1f}s")
+                with self._lock:
+                    self.retries += 1
+                time.sleep(delay)
+        print(f"  ✗ Giving up on {organ}{suffix} after {self.attempts} attempts: {error}")
+        return {"status": "upload_error", "error": error, "attempts": self.attempts}
+
+    def finish(self) -> dict:
+        """Wait for every queued upload; returns ``{organ: result}``."""
+        results = {}
+        try:
+            for organ, future in self.futures.items():
+                try:
+                    results[organ] = future.result()
+                except Exception as e:
+                    results[organ] = {"status": "upload_error", "error": str(e)}
+        finally:
+            self.pool.shutdown()
+            self.session.close()
+        return results
+
+
+def notify_segmentation_complete(callback_url: str, organs_processed: list, organs_failed: list,
+                                 timeline: dict = None):
+    """Tell the API all STLs are uploaded so it starts post-processing."""
+    try:
+        response = requests.post(
+            f"{callback_url}/segmentation/complete",
+            json={"organs_processed": organs_processed, "organs_failed": organs_failed,
+                  "timeline": timeline},
+            timeout=60
+        )
+        response.raise_for_status()
+        print("  ✓ Notified API that segmentation is complete")
+    except Exception as e:
+        # Post-processing can still be triggered manually via /postprocess
+        print(f"  ✗ Completion callback failed: {e}")
+
+
 def handler(event):
     """
     RunPod serverless handler for TotalSegmentator.
     
     Input:
-        - file_url: URL to download the CT file from
+        - file_url: URL to download the CT file from (streamed to disk, resumed on failure)
+        - file_sha256: Optional checksum the download is verified against
         - organs: List of organs to segment
         - fast: Whether to use fast mode (3mm resampling)
         - callback_url: Base URL to upload STL files to (e.g., https://api.ar4ct.com/scans/{scan_id})
     
     Output: Metadata about processed organs (files are uploaded directly to callback_url)
+    and the per-stage ``timeline`` (download, decode, segmentation, meshing, stl_upload)
     """
+    timeline = {}
     try:
         input_data = event.get("input", {})
         
@@ -399,66 +1029,53 @@ def handler(event):
         
         # Create temp directory
         with tempfile.TemporaryDirectory() as tmp_dir:
-            # Download file from URL
+            # Stream the CT straight to disk; the type is sniffed afterwards
             print(f"Downloading file from URL: {file_url}")
-            # Explicitly exclude brotli encoding (br) as requests doesn't support it natively
-            headers = {"Accept-Encoding": "gzip, deflate"}
-            response = requests.get(file_url, stream=True, timeout=300, headers=headers)
-            response.raise_for_status()
-            file_bytes = response.content
-            print(f"Downloaded {len(file_bytes) / (1024*1024):.2f} MB")
+            download_path = os.path.join(tmp_dir, "download")
+            with timed(timeline, "download") as stage:
+                download = download_file(file_url, download_path, input_data.get("file_sha256"))
+                stage.update(download)
+            print(f"Downloaded {download['bytes'] / (1024*1024):.2f} MB (sha256 {download['sha256'][:12]}…)")
             
             # Detect file type and extract if needed
-            if file_bytes[:4] == b'PK\x03\x04':  # ZIP file magic bytes
+            if sniff_magic(download_path) == b'PK\x03\x04':  # ZIP file magic bytes
                 zip_path = os.path.join(tmp_dir, "input.zip")
-                with open(zip_path, "wb") as f:
-                    f.write(file_bytes)
+                os.replace(download_path, zip_path)
                 
-                # Extract zip
+                # Extract zip, then drop the archive so only one copy stays on disk
                 with zipfile.ZipFile(zip_path, 'r') as zip_ref:
                     zip_ref.extractall(tmp_dir)
+                os.remove(zip_path)
                 
                 # Find the input file (MHD, NIfTI, or NRRD)
                 mhd_files = glob.glob(os.path.join(tmp_dir, "**/*.mhd"), recursive=True)
                 nifti_files = glob.glob(os.path.join(tmp_dir, "**/*.nii*"), recursive=True)
                 nrrd_files = glob.glob(os.path.join(tmp_dir, "**/*.nrrd"), recursive=True)
                 
+                # MHD / NRRD are converted (TotalSegmentator doesn't read MHD)
                 if mhd_files:
-                    # Convert MHD to NIfTI (TotalSegmentator doesn't support MHD directly)
-                    mhd_path = mhd_files[0]
-                    print(f"Found MHD file: {mhd_path}, converting to NIfTI...")
-                    img = sitk.ReadImage(mhd_path)
-                    input_path = os.path.join(tmp_dir, "input_converted.nii.gz")
-                    sitk.WriteImage(img, input_path)
-                    print(f"Converted MHD to NIfTI: {input_path}")
+                    source_path = mhd_files[0]
                 elif nifti_files:
-                    input_path = nifti_files[0]
+                    source_path = nifti_files[0]
                 elif nrrd_files:
-                    # Convert NRRD to NIfTI as well for safety
-                    nrrd_path = nrrd_files[0]
-                    print(f"Found NRRD file: {nrrd_path}, converting to NIfTI...")
-                    img = sitk.ReadImage(nrrd_path)
-                    input_path = os.path.join(tmp_dir, "input_converted.nii.gz")
-                    sitk.WriteImage(img, input_path)
-                    print(f"Converted NRRD to NIfTI: {input_path}")
+                    source_path = nrrd_files[0]
                 else:
                     return {"error": "No supported file found in zip (mhd, nii, nii.gz, nrrd)"}
             else:
-                # Assume NIfTI file
-                input_path = os.path.join(tmp_dir, "input.nii.gz")
-                with open(input_path, "wb") as f:
-                    f.write(file_bytes)
+                # Assume NIfTI (the API serves its canonical int16 .nii.gz at /ct/canonical)
+                source_path = download_path
+
+            # Decode once: segmentation and body surface share the uncompressed file
+            with timed(timeline, "decode") as stage:
+                input_path = prepare_input(source_path, tmp_dir, stage)
             
-            # Output directory - create it explicitly
-            output_dir = os.path.join(tmp_dir, "segmentations")
-            os.makedirs(output_dir, exist_ok=True)
+            # One multi-label image for all classes instead of 117 mask files
+            output_path = os.path.join(tmp_dir, "segmentations.nii.gz")
             
             print(f"Input path: {input_path}")
-            print(f"Output dir: {output_dir}")
+            print(f"Output path: {output_path}")
             print(f"Input exists: {os.path.exists(input_path)}")
             print(f"Input is file: {os.path.isfile(input_path)}")
-            print(f"Output dir exists: {os.path.exists(output_dir)}")
-            print(f"Output dir is dir: {os.path.isdir(output_dir)}")
             
             # List tmp_dir contents for debugging
             print(f"Contents of tmp_dir ({tmp_dir}):")
@@ -473,11 +1090,14 @@ def handler(event):
                     print(f'{subindent}{file} ({size} bytes)')
             
             # Determine device - check if CUDA is actually available and working
-            import torch
-            print(f"PyTorch version: {torch.__version__}")
-            print(f"CUDA available: {torch.cuda.is_available()}")
+            try:
+                import torch
+                print(f"PyTorch version: {torch.__version__}")
+                print(f"CUDA available: {torch.cuda.is_available()}")
+            except ImportError:  # local fake worker (fake_runpod.py) without PyTorch
+                torch = None
             
-            if torch.cuda.is_available():
+            if torch is not None and torch.cuda.is_available():
                 device = "gpu"
                 print(f"CUDA device count: {torch.cuda.device_count()}")
                 print(f"CUDA current device: {torch.cuda.current_device()}")
@@ -501,135 +1121,94 @@ def handler(event):
             # Run TotalSegmentator with verbose output
             print(f"Starting TotalSegmentator with device={device}, fast={fast_mode}")
             print(f"  Input: {input_path}")
-            print(f"  Output: {output_dir}")
+            print(f"  Output: {output_path}")
             
             # Monitor GPU during inference
-            if torch.cuda.is_available():
+            if torch is not None and torch.cuda.is_available():
                 print(f"  GPU memory before: {torch.cuda.memory_allocated() / 1024**2:.1f} MB")
             
             # Run in subprocess with timeout to prevent hanging
-            success, message = run_totalsegmentator_subprocess(
-                input_path=input_path,
-                output_dir=output_dir,
-                fast=fast_mode,
-                device=device,
-                timeout=7200  # 2 hours – large CTs with all 117 organs need ~60-90 min
-            )
+            with timed(timeline, "segmentation", device=device, fast=fast_mode) as stage:
+                success, message = SEGMENTER(
+                    input_path=input_path,
+                    output_path=output_path,
+                    fast=fast_mode,
+                    device=device,
+                    timeout=7200,  # 2 hours – large CTs with all 117 organs need ~60-90 min
+                    multilabel=True
+                )
+                stage["success"] = success
             
             if not success:
-                return {"error": f"TotalSegmentator failed: {message}"}
+                return {"error": f"TotalSegmentator failed: {message}", "timeline": timeline}
             
-            if torch.cuda.is_available():
+            if torch is not None and torch.cuda.is_available():
                 print(f"  GPU memory after: {torch.cuda.memory_allocated() / 1024**2:.1f} MB")
             
             print("TotalSegmentator completed successfully")
             
-            # ── Extract body surface from the original CT scan ──
-            if "body" in organs:
-                body_stl_path = os.path.join(tmp_dir, "body.stl")
-                try:
-                    if extract_body_surface(input_path, body_stl_path):
-                        print("  Body surface extraction succeeded")
-                    else:
-                        print("  Body surface extraction returned empty mask")
-                except Exception as e:
-                    print(f"  Body surface extraction failed: {e}")
-                    import traceback
-                    traceback.print_exc()
-
-            # Convert requested organs to STL and upload/collect results
+            # Convert requested organs to STL in parallel, uploading each as it is done
             results = {}
             uploaded_organs = []
             failed_organs = []
-            
-            for organ in organs:
-                # Body surface is generated from the CT directly, not from TotalSegmentator
-                if organ == "body":
-                    stl_path = os.path.join(tmp_dir, "body.stl")
-                    if os.path.exists(stl_path) and os.path.getsize(stl_path) > 84:
-                        stl_size = os.path.getsize(stl_path)
-                        print(f"  Using body surface STL: {stl_size / 1024:.1f} KB")
-                        if callback_url:
-                            try:
-                                upload_url = f"{callback_url}/stl/body"
-                                print(f"  Uploading body.stl to {upload_url}")
-                                with open(stl_path, "rb") as f:
-                                    upload_response = requests.post(
-                                        upload_url,
-                                        files={"file": ("body.stl", f, "model/stl")},
-                                        timeout=300
-                                    )
-                                if upload_response.status_code == 200:
-                                    print("  \u2713 Uploaded body.stl successfully")
-                                    uploaded_organs.append("body")
-                                    results["body"] = {"status": "uploaded", "size": stl_size}
-                                else:
-                                    print(f"  \u2717 Failed to upload body.stl: {upload_response.status_code}")
-                                    failed_organs.append("body")
-                                    results["body"] = {"status": "upload_failed", "error": upload_response.text}
-                            except Exception as e:
-                                print(f"  \u2717 Error uploading body.stl: {e}")
-                                failed_organs.append("body")
-                                results["body"] = {"status": "upload_error", "error": str(e)}
-                        else:
-                            with open(stl_path, "rb") as f:
-                                results["body"] = base64.b64encode(f.read()).decode("utf-8")
-                            uploaded_organs.append("body")
+
+            meshing_started = time.time()
+            mesh_tasks, missing = multilabel_crops(output_path, [o for o in organs if o != "body"], tmp_dir)
+            for organ in missing:
+                print(f"  Organ {organ} not found in segmentation output")
+            # Body surface is generated from the CT directly, not from TotalSegmentator
+            if "body" in organs:
+                mesh_tasks["body"] = ("ct", input_path, os.path.join(tmp_dir, f"body.{MESH_FORMAT}"))
+
+            workers = mesh_workers([mesh_task_bytes(task) for task in mesh_tasks.values()])
+            # Each finished mesh is uploaded while the others are still meshing
+            uploader = StlUploader(callback_url) if callback_url else None
+            print(f"Meshing {len(mesh_tasks)} organs on {workers} process(es)"
+                  + (f", uploading on {uploader.concurrency} connection(s)" if uploader else ""))
+            try:
+                stl_paths, mesh_failed, organ_seconds, organ_triangles = mesh_organs(
+                    mesh_tasks, workers, on_done=uploader.submit if uploader else None
+                )
+            except BaseException:
+                if uploader is not None:
+                    uploader.finish()  # no uploads left running against the temp dir
+                raise
+            failed_organs.extend(mesh_failed)
+
+            stl_bytes = sum(os.path.getsize(p) for p in stl_paths.values())
+            triangles_in = sum(t["marching_cubes"] for t in organ_triangles.values())
+            triangles_out = sum(t["triangles"] for t in organ_triangles.values())
+            record_stage(timeline, "meshing", meshing_started, bytes=stl_bytes,
+                         organs=organ_seconds, workers=workers,
+                         triangles={"marching_cubes": triangles_in, "written": triangles_out,
+                                    "organs": {o: t["triangles"] for o, t in organ_triangles.items()}})
+            print(f"Meshing finished: {len(stl_paths)} STLs in {timeline['meshing']['duration']:.1f}s, "
+                  f"{triangles_out} of {triangles_in} triangles")
+
+            if uploader is not None:
+                meshing_finished = time.time()
+                results = uploader.finish()
+                for organ in stl_paths:
+                    results[organ]["mesh"] = organ_triangles.get(organ)
+                    if results[organ]["status"] == "uploaded":
+                        uploaded_organs.append(organ)
                     else:
-                        print("  Body surface STL not available")
-                        failed_organs.append("body")
-                    continue
-
-                nifti_path = os.path.join(output_dir, f"{organ}.nii.gz")
-                if os.path.exists(nifti_path):
-                    stl_path = os.path.join(tmp_dir, f"{organ}.stl")
-                    if nifti_to_stl(nifti_path, stl_path):
-                        stl_size = os.path.getsize(stl_path)
-                        print(f"  Generated STL for {organ}: {stl_size / 1024:.1f} KB")
-                        
-                        # If callback URL is provided, upload the STL file
-                        if callback_url:
-                            try:
-                                upload_url = f"{callback_url}/stl/{organ}"
-                                print(f"  Uploading {organ}.stl to {upload_url}")
-                                
-                                with open(stl_path, "rb") as f:
-                                    upload_response = requests.post(
-                                        upload_url,
-                                        files={"file": (f"{organ}.stl", f, "model/stl")},
-                                        timeout=300
-                                    )
-                                
-                                if upload_response.status_code == 200:
-                                    print(f"  ✓ Uploaded {organ}.stl successfully")
-                                    uploaded_organs.append(organ)
-                                    results[organ] = {
-                                        "status": "uploaded",
-                                        "size": stl_size,
-                                        "url": f"{callback_url}/stl/{organ}"
-                                    }
-                                else:
-                                    print(f"  ✗ Failed to upload {organ}.stl: {upload_response.status_code} - {upload_response.text}")
-                                    failed_organs.append(organ)
-                                    results[organ] = {
-                                        "status": "upload_failed",
-                                        "error": upload_response.text
-                                    }
-                            except Exception as e:
-                                print(f"  ✗ Error uploading {organ}.stl: {e}")
-                                failed_organs.append(organ)
-                                results[organ] = {
-                                    "status": "upload_error",
-                                    "error": str(e)
-                                }
-                        else:
-                            # No callback URL - return base64 encoded (may fail if too large)
-                            print(f"  Warning: No callback_url provided, returning base64 (may exceed size limit)")
-                            with open(stl_path, "rb") as f:
-                                results[organ] = base64.b64encode(f.read()).decode("utf-8")
-                            uploaded_organs.append(organ)
-                else:
-                    print(f"  Organ {organ} not found in segmentation output")
+                        failed_organs.append(organ)
+                if uploader.started is not None:
+                    record_stage(timeline, "stl_upload", uploader.started, bytes=stl_bytes,
+                                 files=len(stl_paths), retries=uploader.retries,
+                                 concurrency=uploader.concurrency,
+                                 after_meshing=round(time.time() - meshing_finished, 3))
+                notify_segmentation_complete(callback_url, uploaded_organs, failed_organs, timeline)
+            else:
+                upload_started = time.time()
+                for organ, stl_path in stl_paths.items():
+                    # No callback URL - return base64 encoded (may fail if too large)
+                    print(f"  Warning: No callback_url provided, returning base64 for {organ} (may exceed size limit)")
+                    with open(stl_path, "rb") as f:
+                        results[organ] = base64.b64encode(f.read()).decode("utf-8")
+                    uploaded_organs.append(organ)
+                record_stage(timeline, "stl_upload", upload_started, bytes=stl_bytes, files=len(stl_paths))
             
             print(f"\nProcessed {len(uploaded_organs)} organs: {uploaded_organs}")
             if failed_organs:
@@ -640,11 +1219,18 @@ def handler(event):
                 "organs_processed": uploaded_organs,
                 "organs_failed": failed_organs,
                 "results": results,
-                "callback_url": callback_url
+                "callback_url": callback_url,
+                "timeline": timeline
             }
             
     except Exception as e:
-        return {"error": str(e)}
+        return {"error": str(e), "timeline": timeline}
 
-# Start the serverless worker
-runpod.serverless.start({"handler": handler})
+# Start the serverless worker (not when imported, e.g. by fake_runpod.py)
+if __name__ == "__main__":
+    import runpod
+    log_environment()
+    if SEGMENTATION_ENGINE == "persistent":
+        SEGMENTER = SegmentationEngine(warmup=SEGMENTATION_WARMUP)
+        SEGMENTER.start()  # imports and warm-up overlap with waiting for the first job
+    runpod.serverless.start({"handler": handler})
@@ -0,0 +1,158 @@
+"""
+Vectorised quadric mesh decimation for the segmentation worker.
+
+Marching cubes on a sub-millimetre CT yields far more triangles than the
+app can use – Blender remeshes every organ to octree depth 6 anyway – so
+meshes are decimated before upload.  Edge-collapse QEM is inherently
+sequential; this uses quadric-error *vertex clustering* (Lindstrom 2000)
+instead, which maps onto whole-array NumPy operations:
+
+* the vertices are bucketed into a grid of cubic cells of size *h*,
+* every face's plane quadric (area-weighted) is summed per cell,
+* each cell collapses to the point minimising its summed quadric (clamped
+  to the cell, so no vertex moves further than the cell diagonal),
+* faces whose corners fall into fewer than three cells vanish.
+
+A triangle target is met by bisecting *h* on the cheap face count; an
+error bound caps *h* at ``max_error / √3``.
+"""
+
+import numpy as np
+
+# Per organ class: at most this many triangles, and no vertex moved
+# further than max_error (mm).  The error bound wins over the target.  The
+# bounds stay within Blender's remesh cell (octree depth 6 at scale 0.9
+# over the organ's extent: ~4 mm for a liver, ~9 mm for the body).
+DEFAULT_BUDGETS = {
+    "body":   {"triangles": 80_000, "max_error": 8.0},
+    "organ":  {"triangles": 20_000, "max_error": 4.0},
+    "bone":   {"triangles": 10_000, "max_error": 3.0},
+    "vessel": {"triangles": 15_000, "max_error": 2.0},
+}
+
+_VESSEL_WORDS = ("aorta", "artery", "vein", "vena", "trunk", "portal", "iliac_ven", "iliac_art")
+_BONE_WORDS = (
+    "vertebra", "rib", "sternum", "costal", "clavicula", "scapula", "humerus", "femur",
+    "hip", "sacrum", "skull", "patella", "tibia", "fibula", "ulna", "radius", "carpal",
+    "tarsal", "metatarsal", "phalanges",
+)
+
+_BITS = 21  # per axis in the packed cell key
+_SEARCH_STEPS = 10  # cell size to within ~1 %
+
+
+def organ_class(organ: str) -> str:
+    """Budget class of a TotalSegmentator organ name."""
+    if organ == "body":
+        return "body"
+    if any(word in organ for word in _VESSEL_WORDS):
+        return "vessel"
+    if any(word in organ for word in _BONE_WORDS):
+        return "bone"
+    return "organ"
+
+
+def _cell_keys(verts: np.ndarray, origin: np.ndarray, h: float):
+    cells = np.floor((verts - origin) / h).astype(np.int64)
+    keys = (cells[:, 0] << (2 * _BITS)) | (cells[:, 1] << _BITS) | cells[:, 2]
+    return keys, cells
+
+
+def _surviving_faces(keys: np.ndarray, faces: np.ndarray) -> int:
+    c = keys[faces]
+    return int(np.count_nonzero((c[:, 0] != c[:, 1]) & (c[:, 1] != c[:, 2]) & (c[:, 0] != c[:, 2])))
+
+
+def _cell_size_for(verts: np.ndarray, faces: np.ndarray, origin: np.ndarray, target: int) -> float:
+    """Smallest cell size (log-bisection) that leaves at most *target* faces."""
+    extent = float(np.max(verts.max(axis=0) - origin))
+    edges = np.linalg.norm(verts[faces[:, 1]] - verts[faces[:, 0]], axis=1)
+    lo = max(float(edges.mean()) * 0.5, extent / (1 << _BITS) * 2)
+    hi = extent * 2
+    if _surviving_faces(_cell_keys(verts, origin, lo)[0], faces) <= target:
+        return lo
+    for _ in range(_SEARCH_STEPS):
+        mid = float(np.sqrt(lo * hi))
+        if _surviving_faces(_cell_keys(verts, origin, mid)[0], faces) <= target:
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
+def _face_quadrics(verts: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """``(n_faces, 4, 4)`` area-weighted plane quadrics."""
+    v0 = verts[faces[:, 0]]
+    normals = np.cross(verts[faces[:, 1]] - v0, verts[faces[:, 2]] - v0)
+    double_area = np.linalg.norm(normals, axis=1)
+    np.divide(normals, double_area[:, None], out=normals, where=double_area[:, None] > 0)
+    planes = np.empty((len(faces), 4))
+    planes[:, :3] = normals
+    planes[:, 3] = -np.einsum("ij,ij->i", normals, v0)
+    return planes[:, :, None] * planes[:, None, :] * (0.5 * double_area)[:, None, None]
+
+
+def cluster(verts: np.ndarray, faces: np.ndarray, h: float):
+    """Collapse *verts* onto a grid of cell size *h*.  Returns ``(verts, faces)``."""
+    verts = np.asarray(verts, dtype=np.float64)
+    origin = verts.min(axis=0)
+    keys, cells = _cell_keys(verts, origin, h)
+    unique_keys, first, label = np.unique(keys, return_index=True, return_inverse=True)
+    label = label.ravel()
+    n = len(unique_keys)
+
+    # Sum each face's quadric into the cells of its three corners
+    quadrics = _face_quadrics(verts, faces).reshape(len(faces), 16)
+    corner_cells = label[faces].T.ravel()
+    q = np.stack([
+        np.bincount(corner_cells, weights=np.tile(quadrics[:, k], 3), minlength=n) for k in range(16)
+    ], axis=1).reshape(n, 4, 4)
+
+    counts = np.bincount(label, minlength=n)[:, None]
+    centroid = np.stack([np.bincount(label, weights=verts[:, k], minlength=n) for k in range(3)], axis=1) / counts
+
+    # Minimise x·Ax + 2b·x near the centroid; pseudo-inverse for flat / straight cells
+    a, b = q[:, :3, :3], q[:, :3, 3]
+    w, v = np.linalg.eigh(a)
+    keep = w > np.maximum(w[:, -1:], 1e-300) * 1e-3
+    inv_w = np.where(keep, 1.0 / np.where(keep, w, 1.0), 0.0)
+    residual = -(np.einsum("nij,nj->ni", a, centroid) + b)
+    step = np.einsum("nij,nj->ni", v, inv_w * np.einsum("nji,nj->ni", v, residual))
+    cell_lo = origin + cells[first] * h
+    new_verts = np.clip(centroid + step, cell_lo, cell_lo + h)
+
+    # Remap, drop collapsed and duplicate faces (first occurrence wins)
+    f = label[faces]
+    f = f[(f[:, 0] != f[:, 1]) & (f[:, 1] != f[:, 2]) & (f[:, 0] != f[:, 2])]
+    s = np.sort(f, axis=1).astype(np.int64)
+    _, keep_faces = np.unique((s[:, 0] * n + s[:, 1]) * n + s[:, 2], return_index=True)
+    f = f[np.sort(keep_faces)]
+
+    # Compact away cells no face uses any more
+    used = np.zeros(n, dtype=bool)
+    used[f.ravel()] = True
+    remap = np.cumsum(used) - 1
+    return new_verts[used], remap[f]
+
+
+def decimate(verts: np.ndarray, faces: np.ndarray, triangles: int = None, max_error: float = None,
+             unit: float = 1.0):
+    """
+    Reduce an indexed mesh to about *triangles* faces, never moving a vertex
+    more than *max_error* (mm; *unit* is the mesh's length unit in metres).
+
+    Returns ``(verts, faces, cell_size)``; the mesh is returned unchanged
+    (cell size ``None``) when it is already within budget.
+    """
+    if len(faces) == 0 or (triangles is None and max_error is None):
+        return verts, faces, None
+    if triangles is not None and len(faces) <= triangles:
+        return verts, faces, None
+
+    verts = np.asarray(verts, dtype=np.float64)
+    h_error = max_error * 0.001 / unit / np.sqrt(3) if max_error is not None else np.inf
+    h = h_error
+    if triangles is not None:
+        h = min(h, _cell_size_for(verts, faces, verts.min(axis=0), triangles))
+    new_verts, new_faces = cluster(verts, faces, h)
+    return new_verts, new_faces, h
@@ -0,0 +1,266 @@
+"""
+Persistent TotalSegmentator engine for the segmentation worker.
+
+The ``TotalSegmentator`` CLI (``handler.run_totalsegmentator_subprocess``)
+re-imports torch and nnU-Net and reloads every model checkpoint for each
+job – tens of seconds on a warm worker before inference starts.  The
+engine keeps one long-lived child process instead:
+
+* the child imports TotalSegmentator's Python API once and runs every job
+  through ``totalsegmentator(...)`` in-process,
+* nnU-Net's ``initialize_from_trained_model_folder`` is memoised in the
+  child, so each model's weights are read from disk once and reused by
+  later jobs (keyed by model folder, folds, checkpoint and device),
+* an optional warm-up segments a tiny synthetic CT at start so even the
+  first job finds its models loaded.
+
+The timeout and kill semantics of the CLI path are kept: the child runs
+in its own process group (with nnU-Net's preprocessing / export workers),
+a job that exceeds its timeout kills the whole group with SIGKILL and the
+next job starts a fresh engine.  A crashed child is reported as a failed
+job the same way.  Jobs run one at a time.
+"""
+
+import atexit
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+
+# Seconds to wait between liveness checks of the engine process
+_POLL_INTERVAL = 5.0
+
+
+# ── Child process ──
+
+def _memoise_nnunet_models():
+    """Cache what ``initialize_from_trained_model_folder`` sets up per model."""
+    try:
+        from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+    except ImportError:
+        print("[Engine] nnU-Net not importable – model weights are not cached")
+        return
+
+    original = nnUNetPredictor.initialize_from_trained_model_folder
+    cache = {}
+
+    def initialize(self, model_training_output_dir, use_folds, checkpoint_name="checkpoint_final.pth"):
+        key = (str(model_training_output_dir), repr(use_folds), checkpoint_name, str(self.device))
+        cached = cache.get(key)
+        if cached is None:
+            before = dict(vars(self))
+            original(self, model_training_output_dir, use_folds, checkpoint_name)
+            cached = {k: v for k, v in vars(self).items() if k not in before or before[k] is not v}
+            cache[key] = cached
+            print(f"[Engine] Loaded model {os.path.basename(str(model_training_output_dir))}")
+        vars(self).update(cached)
+
+    nnUNetPredictor.initialize_from_trained_model_folder = initialize
+
+
+def load_totalsegmentator():
+    """Import TotalSegmentator once; returns the per-job segment function."""
+    from totalsegmentator.python_api import totalsegmentator
+
+    _memoise_nnunet_models()
+
+    def segment(input_path, output_path, fast=False, device="cpu", multilabel=False):
+        totalsegmentator(input_path, output_path, ml=multilabel, fast=fast, device=device, verbose=True)
+
+    return segment
+
+
+def _warm_up(segment, warmup: list, device: str):
+    """Segment a small synthetic CT once per mode so its models are loaded."""
+    import tempfile
+
+    import nibabel as nib
+    import numpy as np
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ct = np.full((64, 64, 64), -1000, dtype=np.int16)
+        ct[16:48, 16:48, 8:56] = 40
+        input_path = os.path.join(tmp, "warmup.nii")
+        nib.save(nib.Nifti1Image(ct, np.diag([3.0, 3.0, 3.0, 1.0])), input_path)
+        for mode in warmup:
+            output_path = os.path.join(tmp, f"warmup_{mode}.nii.gz")
+            segment(input_path, output_path, fast=(mode == "fast"), device=device, multilabel=True)
+
+
+def _serve(conn, load, warmup: list, warmup_device: str):
+    """Engine main loop: load once, then run jobs from *conn* until it closes."""
+    # Own process group: a timeout kills the engine and its nnU-Net workers together
+    os.setsid()
+    started = time.time()
+    try:
+        segment = load()
+    except BaseException:
+        conn.send(("failed", traceback.format_exc()))
+        return
+    if warmup:
+        try:
+            _warm_up(segment, warmup, warmup_device)
+        except Exception:
+            print(f"[Engine] Warm-up failed (continuing):\n{traceback.format_exc()}")
+    conn.send(("ready", round(time.time() - started, 3)))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        t0 = time.time()
+        try:
+            segment(**job)
+            conn.send(("done", round(time.time() - t0, 3)))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+        finally:
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+
+# ── Parent side ──
+
+class SegmentationEngine:
+    """
+    Callable like ``run_totalsegmentator_subprocess`` – ``engine(input_path=,
+    output_path=, fast=, device=, timeout=, multilabel=)`` → ``(success,
+    message)`` – backed by the persistent child described above.
+
+    *load* runs in the child and returns ``segment(input_path, output_path,
+    fast, device, multilabel)``; it must be importable (the child is
+    spawned).  *warmup* lists the modes ("fast", "full") to pre-load on
+    *warmup_device* when the engine starts.
+    """
+
+    def __init__(self, load=load_totalsegmentator, warmup: list = None, warmup_device: str = "gpu"):
+        self.load = load
+        self.warmup = list(warmup or [])
+        self.warmup_device = warmup_device
+        self.jobs = 0
+        self._process = None
+        self._conn = None
+        self._ready = False
+        self._atexit = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Spawn the engine if it is not running (loading happens in the background)."""
+        if self._process is not None and self._process.is_alive():
+            return
+        # spawn, not fork: the parent may hold CUDA state and monitor threads
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_serve, args=(child_conn, self.load, self.warmup, self.warmup_device),
+            # not a daemon: nnU-Net starts worker processes of its own
+            name="segmentation-engine",
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self._ready = False
+        self.jobs = 0
+        if not self._atexit:
+            atexit.register(self.stop)
+            self._atexit = True
+        print(f"[Engine] Started segmentation engine (pid {self._process.pid}, warm-up: {self.warmup or 'none'})")
+
+    def stop(self):
+        """Ask the engine to exit; kill it if it does not."""
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(10)
+        if self._process.is_alive():
+            self._kill()
+        self._reset()
+
+    def _kill(self):
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except ProcessLookupError:  # killed before it became a group leader
+            self._process.kill()
+        self._process.join()
+
+    def _reset(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._process = self._conn = None
+        self._ready = False
+
+    def _receive(self, deadline: float):
+        """Next message from the engine, or ``("timeout" | "exited", ...)``."""
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return "timeout", None
+            try:
+                if self._conn.poll(min(remaining, _POLL_INTERVAL)):
+                    return self._conn.recv()
+                alive = self._process.is_alive()
+            except (EOFError, OSError):  # the engine closed its end: it is exiting
+                alive = False
+            if not alive:
+                self._process.join()
+                return "exited", self._process.exitcode
+
+    def __call__(self, input_path, output_path, fast=False, device="cpu", timeout=1800, multilabel=False):
+        with self._lock:
+            start_time = time.time()
+            deadline = start_time + timeout
+            self.start()
+            print(f"[Engine] Segmenting {input_path} (device={device}, fast={fast}, "
+                  f"{'warm' if self._ready else 'starting'}, job {self.jobs + 1})")
+
+            job = {"input_path": input_path, "output_path": output_path, "fast": fast,
+                   "device": device, "multilabel": multilabel}
+            try:
+                self._conn.send(job)
+            except (BrokenPipeError, OSError):
+                pass  # an engine that died is reported below
+
+            while True:
+                kind, value = self._receive(deadline)
+                if kind == "ready":
+                    self._ready = True
+                    print(f"[Engine] Engine ready after {value:.1f}s")
+                    continue
+                break
+
+            elapsed = time.time() - start_time
+            if kind == "done":
+                self.jobs += 1
+                print(f"[SUCCESS] TotalSegmentator completed in {elapsed:.1f}s (inference {value:.1f}s)")
+                return True, "Success"
+            if kind == "error":
+                self.jobs += 1
+                print(f"[ERROR] TotalSegmentator failed:\n{value}")
+                return False, f"TotalSegmentator failed: {value.strip().splitlines()[-1]}"
+            if kind == "timeout":
+                print(f"[ERROR] TotalSegmentator timed out after {elapsed:.0f}s")
+                self._kill()
+                self._reset()
+                return False, f"Timeout after {timeout} seconds"
+            if kind == "failed":
+                print(f"[ERROR] Segmentation engine could not load TotalSegmentator:\n{value}")
+                self._process.join()
+                self._reset()
+                return False, f"Engine failed to start: {value.strip().splitlines()[-1]}"
+            # exited
+            error_msg = f"Segmentation engine exited with code {value}"
+            print(f"[ERROR] {error_msg}")
+            self._reset()
+            return False, error_msg